@@ -1,4 +1,5 @@
 import argparse
+import json
 import os
 import sys
 import textwrap
@@ -10,8 +11,13 @@ from typing import Dict, List, Optional, Set, Union
 from packaging.specifiers import SpecifierSet
 
 import cibuildwheel
+import cibuildwheel.cache
+import cibuildwheel.daemon
+import cibuildwheel.images
 import cibuildwheel.linux
 import cibuildwheel.macos
+import cibuildwheel.plan
+import cibuildwheel.snapshots
 import cibuildwheel.util
 import cibuildwheel.windows
 from cibuildwheel.architecture import Architecture, allowed_architectures_check
@@ -24,6 +30,8 @@ from cibuildwheel.util import (
     BuildOptions,
     BuildSelector,
     DependencyConstraints,
+    ProjectFiles,
+    ProjectTransfer,
     TestSelector,
     Unbuffered,
     detect_ci_provider,
@@ -45,6 +53,26 @@ MANYLINUX_ARCHS = (
 def main() -> None:
     platform: PlatformName
 
+    # `cibuildwheel snapshots ...` manages the before_all snapshots
+    if sys.argv[1:2] == ["snapshots"]:
+        cibuildwheel.snapshots.main(sys.argv[2:])
+        return
+
+    # `cibuildwheel daemon ...` keeps warm containers for Linux builds
+    if sys.argv[1:2] == ["daemon"]:
+        cibuildwheel.daemon.main(sys.argv[2:])
+        return
+
+    # `cibuildwheel images ...` saves and loads the Docker images for a build.
+    # `save` takes the usual arguments, to select the build
+    images_args = None
+    build_args = sys.argv[1:]
+    if sys.argv[1:2] == ["images"]:
+        images_args, build_args = cibuildwheel.images.parse_args(sys.argv[2:])
+        if images_args.command == "load":
+            cibuildwheel.images.load_images(images_args.directory)
+            return
+
     parser = argparse.ArgumentParser(
         description="Build wheels for all the platforms.",
         epilog="""
@@ -113,6 +141,29 @@ def main() -> None:
         help="Print the build identifiers matched by the current invocation and exit.",
     )
 
+    parser.add_argument(
+        "--print-build-plan",
+        action="store_true",
+        help="""
+            Print the build plan for the current invocation as JSON and exit.
+            For each build identifier, this includes the Docker image and
+            container group it's built in, whether it's emulated or tested,
+            and an estimate of how long it takes to build. Only the options
+            are read - nothing is run.
+        """,
+    )
+
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="""
+            On Linux, skip the build identifiers that a previous, interrupted
+            run already completed, according to the journal it left in the
+            output dir. An identifier is only skipped if its wheels are still
+            in the output dir, unchanged.
+        """,
+    )
+
     parser.add_argument(
         "--allow-empty",
         action="store_true",
@@ -125,7 +176,55 @@ def main() -> None:
         help="Enable pre-release Python versions if available.",
     )
 
-    args = parser.parse_args()
+    parser.add_argument(
+        "--jobs",
+        help="""
+            Number of Docker containers to build in at the same time on Linux.
+            Each container builds one platform, e.g. manylinux x86_64 or
+            manylinux aarch64, and the CPUs of the Docker host are shared
+            between them. Default: the parallel option (CIBW_PARALLEL), or 1.
+        """,
+    )
+
+    parser.add_argument(
+        "--container-jobs",
+        help="""
+            Number of wheels to build at the same time inside each Docker
+            container on Linux, each in its own shell session. before_all is
+            still run once per container. Default: the container-parallel
+            option (CIBW_CONTAINER_PARALLEL), or 1.
+        """,
+    )
+
+    parser.add_argument(
+        "--shard",
+        default=os.environ.get("CIBW_SHARD") or None,
+        metavar="K/N",
+        help="""
+            Only build the K-th of N shards of the selected identifiers, e.g.
+            '2/4', to spread a build across N CI jobs. The shards are balanced
+            by estimated build time, and identifiers that share a Docker image
+            are kept together where possible. Default: CIBW_SHARD if set.
+        """,
+    )
+
+    parser.add_argument(
+        "--shard-timings",
+        default=os.environ.get("CIBW_SHARD_TIMINGS") or None,
+        metavar="FILE",
+        help="""
+            JSON file of previous build times in seconds, by identifier, used
+            to balance the shards and for the estimates in --print-build-plan.
+            Every shard must use the same file. Default: CIBW_SHARD_TIMINGS if
+            set.
+        """,
+    )
+
+    args = parser.parse_args(build_args)
+
+    if images_args is not None:
+        # the images are only used by Linux builds
+        args.platform = "linux"
 
     if args.platform != "auto":
         platform = args.platform
@@ -167,10 +266,21 @@ def main() -> None:
     manylinux_identifiers = {
         f"manylinux-{build_platform}-image" for build_platform in MANYLINUX_ARCHS
     }
+    linux_only_identifiers = manylinux_identifiers | {
+        "before-all-snapshot",
+        "before-all-inputs",
+        "project-files",
+        "project-transfer",
+        "parallel",
+        "container-parallel",
+        "cache-dir",
+        "cache-max-size",
+        "cache-url",
+    }
     disallow = {
         "linux": {"dependency-versions"},
-        "macos": manylinux_identifiers,
-        "windows": manylinux_identifiers,
+        "macos": linux_only_identifiers,
+        "windows": linux_only_identifiers,
     }
     options = ConfigOptions(package_dir, args.config_file, platform=platform, disallow=disallow)
     output_dir = Path(
@@ -188,6 +298,10 @@ def main() -> None:
     build_frontend_str = options("build-frontend", env_plat=False)
     environment_config = options("environment", table={"item": '{k}="{v}"', "sep": " "})
     before_all = options("before-all", sep=" && ")
+    before_all_snapshot = cibuildwheel.util.strtobool(options("before-all-snapshot"))
+    before_all_inputs = options("before-all-inputs", sep=" ").split()
+    project_files_str = options("project-files")
+    project_transfer_str = options("project-transfer")
     before_build = options("before-build", sep=" && ")
     repair_command = options("repair-wheel-command", sep=" && ")
 
@@ -212,6 +326,28 @@ def main() -> None:
         print(msg, file=sys.stderr)
         sys.exit(2)
 
+    project_files: ProjectFiles
+    if project_files_str == "all":
+        project_files = "all"
+    elif project_files_str == "git":
+        project_files = "git"
+    else:
+        msg = f"cibuildwheel: Unrecognised project-files '{project_files_str}', only 'all' and 'git' are supported"
+        print(msg, file=sys.stderr)
+        sys.exit(2)
+
+    project_transfer: ProjectTransfer
+    if project_transfer_str == "copy":
+        project_transfer = "copy"
+    elif project_transfer_str == "mount":
+        project_transfer = "mount"
+    elif project_transfer_str == "volume":
+        project_transfer = "volume"
+    else:
+        msg = f"cibuildwheel: Unrecognised project-transfer '{project_transfer_str}', only 'copy', 'mount' and 'volume' are supported"
+        print(msg, file=sys.stderr)
+        sys.exit(2)
+
     package_files = {"setup.py", "setup.cfg", "pyproject.toml"}
 
     if not any(package_dir.joinpath(name).exists() for name in package_files):
@@ -264,19 +400,27 @@ def main() -> None:
     except ValueError:
         build_verbosity = 0
 
+    jobs = parse_jobs(args.jobs or options("parallel"))
+    container_jobs = parse_jobs(args.container_jobs or options("container-parallel"))
+
+    cache_dir_str = options("cache-dir")
+    cache_dir = Path(cache_dir_str).expanduser().resolve() if cache_dir_str else None
+    cache_max_size_str = options("cache-max-size")
+    try:
+        cache_max_size = (
+            cibuildwheel.cache.parse_size(cache_max_size_str) if cache_max_size_str else None
+        )
+    except ValueError:
+        print(f"cibuildwheel: Invalid cache-max-size {cache_max_size_str!r}", file=sys.stderr)
+        sys.exit(2)
+    cache_url = options("cache-url") or None
+
     # Add CIBUILDWHEEL environment variable
     # This needs to be passed on to the docker container in linux.py
     os.environ["CIBUILDWHEEL"] = "1"
 
     archs = Architecture.parse_config(archs_config_str, platform=platform)
 
-    identifiers = get_build_identifiers(platform, build_selector, archs)
-
-    if args.print_build_identifiers:
-        for identifier in identifiers:
-            print(identifier)
-        sys.exit(0)
-
     manylinux_images: Dict[str, str] = {}
     if platform == "linux":
         pinned_docker_images_file = resources_dir / "pinned_docker_images.cfg"
@@ -303,6 +447,51 @@ def main() -> None:
 
             manylinux_images[build_platform] = image
 
+    try:
+        timings = (
+            cibuildwheel.plan.read_timings(Path(args.shard_timings)) if args.shard_timings else None
+        )
+    except (ValueError, OSError) as error:
+        print(f"cibuildwheel: {error}", file=sys.stderr)
+        sys.exit(2)
+
+    if args.shard is not None:
+        build_selector = get_shard_build_selector(
+            platform,
+            build_selector,
+            archs,
+            manylinux_images or None,
+            shard_str=args.shard,
+            timings=timings,
+        )
+
+    identifiers = get_build_identifiers(platform, build_selector, archs)
+
+    if images_args is not None:
+        container_groups = cibuildwheel.linux.get_container_groups(
+            cibuildwheel.linux.get_python_configurations(build_selector, archs), manylinux_images
+        )
+        docker_images = list(dict.fromkeys(group.docker_image for group in container_groups))
+        cibuildwheel.images.save_images(docker_images, images_args.directory)
+        sys.exit(0)
+
+    if args.print_build_identifiers:
+        for identifier in identifiers:
+            print(identifier)
+        sys.exit(0)
+
+    if args.print_build_plan:
+        build_plan = cibuildwheel.plan.get_build_plan(
+            platform,
+            build_selector,
+            archs,
+            manylinux_images or None,
+            test_selector=test_selector if test_command else None,
+            timings=timings,
+        )
+        print(json.dumps(build_plan, indent=2))
+        sys.exit(0)
+
     build_options = BuildOptions(
         architectures=archs,
         package_dir=package_dir,
@@ -313,6 +502,8 @@ def main() -> None:
         before_test=before_test,
         before_build=before_build,
         before_all=before_all,
+        before_all_snapshot=before_all_snapshot,
+        before_all_inputs=before_all_inputs,
         build_verbosity=build_verbosity,
         build_selector=build_selector,
         test_selector=test_selector,
@@ -321,6 +512,14 @@ def main() -> None:
         dependency_constraints=dependency_constraints,
         manylinux_images=manylinux_images or None,
         build_frontend=build_frontend,
+        project_files=project_files,
+        project_transfer=project_transfer,
+        jobs=jobs,
+        container_jobs=container_jobs,
+        cache_dir=cache_dir,
+        cache_max_size=cache_max_size,
+        cache_url=cache_url,
+        resume=args.resume,
     )
 
     # Python is buffering by default when running on the CI platforms, giving problems interleaving subprocess call output with unflushed calls to 'print'
@@ -355,6 +554,64 @@ def main() -> None:
             assert_never(platform)
 
 
+def parse_jobs(jobs_str: str) -> int:
+    try:
+        jobs = int(jobs_str)
+    except ValueError:
+        jobs = 0
+
+    if jobs < 1:
+        print(f"cibuildwheel: Invalid number of jobs {jobs_str!r}", file=sys.stderr)
+        sys.exit(2)
+
+    return jobs
+
+
+def get_shard_build_selector(
+    platform: PlatformName,
+    build_selector: BuildSelector,
+    architectures: Set[Architecture],
+    manylinux_images: Optional[Dict[str, str]],
+    *,
+    shard_str: str,
+    timings: Optional[Dict[str, float]],
+) -> BuildSelector:
+    """
+    Returns a build selector that only selects the identifiers in one shard.
+    """
+    try:
+        shard_index, shard_count = cibuildwheel.plan.parse_shard(shard_str)
+    except ValueError as error:
+        print(f"cibuildwheel: {error}", file=sys.stderr)
+        sys.exit(2)
+
+    groups = cibuildwheel.plan.get_build_groups(
+        platform, build_selector, architectures, manylinux_images
+    )
+    costs = {
+        identifier: cibuildwheel.plan.estimate_cost(platform, identifier, timings)
+        for group in groups
+        for identifier in group
+    }
+    shards = cibuildwheel.plan.split_into_shards(groups, costs, shard_count)
+    shard_identifiers = shards[shard_index - 1]
+
+    print(
+        f"cibuildwheel: shard {shard_index}/{shard_count} has {len(shard_identifiers)} of "
+        f"{len(costs)} identifiers, estimated at {sum(costs[i] for i in shard_identifiers) / 60:.0f} "
+        "minutes",
+        file=sys.stderr,
+    )
+
+    return BuildSelector(
+        # an empty build config would select everything
+        build_config=" ".join(shard_identifiers) or "none",
+        skip_config=" ".join(build_selector.skip_patterns),
+        requires_python=build_selector.requires_python,
+        prerelease_pythons=build_selector.prerelease_pythons,
+    )
+
+
 def deprecated_selectors(name: str, selector: str, *, error: bool = False) -> None:
     if "p2" in selector or "p35" in selector:
         msg = f"cibuildwheel 2.x no longer supports Python < 3.6. Please use the 1.x series or update {name}"
@@ -0,0 +1,386 @@
+"""
+A cache of built wheels. Each entry holds the (repaired, and tested if
+testing was selected) wheels for one build identifier, and is keyed on a hash
+of everything that goes into the build, so an entry can be reused whenever
+the same build would run again. Entries are kept in a local directory, and
+can be shared between machines through a remote cache on an HTTP server.
+"""
+
+import contextlib
+import hashlib
+import json
+import os
+import re
+import shutil
+import ssl
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, wait
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional
+
+import certifi
+
+from .transfer import Manifest
+from .util import copy_file_atomically
+
+SIZE_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+
+
+def parse_size(size_str: str) -> int:
+    """
+    Parses a size like '500M' or '10G' into a number of bytes.
+
+    >>> parse_size('1024')
+    1024
+    >>> parse_size('2K')
+    2048
+    >>> parse_size('1.5GB')
+    1610612736
+    """
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)B?\s*", size_str, flags=re.IGNORECASE)
+    if not match:
+        raise ValueError(f"Invalid size {size_str!r}")
+    number, unit = match.groups()
+    return int(float(number) * SIZE_UNITS[unit.upper()])
+
+
+def get_git_state(project_dir: Path) -> Optional[str]:
+    """
+    Returns the state of the git repository that the project is in, as far
+    as tools like setuptools_scm can see it: the commit that's checked out,
+    the tags on it, `git describe --tags`, and whether the tree is dirty.
+    Unlike the files in .git, such as the index, this is the same in every
+    clone of a commit. Returns None if the project isn't in a git repository.
+    """
+
+    def git(*args: str) -> str:
+        return subprocess.run(
+            ["git", *args],
+            cwd=project_dir,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True,
+            check=True,
+        ).stdout.strip()
+
+    try:
+        head = git("rev-parse", "HEAD")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    try:
+        describe: Optional[str] = git("describe", "--tags")
+    except subprocess.CalledProcessError:
+        # there are no tags
+        describe = None
+
+    git_state = {
+        "head": head,
+        "tags": sorted(git("tag", "--points-at", "HEAD").splitlines()),
+        "describe": describe,
+        "dirty": git("status", "--porcelain", "--untracked-files=no") != "",
+    }
+    return json.dumps(git_state, sort_keys=True)
+
+
+def fingerprint_manifest(manifest: Manifest, git_state: Optional[str] = None) -> str:
+    """
+    Returns a hash of the paths, kinds, modes and digests in the manifest of
+    the project archive - exactly what's copied into containers - and of
+    `git_state`, from get_git_state(). The .git directory is copied too,
+    but it's left out of the hash, since files like .git/index differ
+    between clones of the same commit; `git_state` stands in for it. Every
+    file in the manifest must have a digest.
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps(git_state).encode("utf8"))
+    digest.update(b"\n")
+
+    for rel_path in sorted(manifest):
+        if rel_path == ".git" or rel_path.startswith(".git/"):
+            continue
+        state = manifest[rel_path]
+        assert state.kind == "dir" or state.digest is not None
+        entry = [rel_path, state.kind, state.mode, state.digest]
+        digest.update(json.dumps(entry).encode("utf8"))
+        digest.update(b"\n")
+
+    return digest.hexdigest()
+
+
+def cache_key(**inputs: Optional[str]) -> str:
+    """
+    Returns a key for a cache entry, from the named inputs to the build.
+    """
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode("utf8")).hexdigest()
+
+
+class CacheEntry(NamedTuple):
+    path: Path
+    size: int
+    last_used: float
+
+
+class RemoteCache:
+    """
+    A wheel cache on an HTTP server. Each entry is a tar file at
+    `<url>/<key>.tar`, fetched with GET and stored with PUT.
+    """
+
+    def __init__(self, url: str, token: Optional[str] = None, timeout: float = 30) -> None:
+        self.url = url.rstrip("/")
+        self.token = token
+        self.timeout = timeout
+        cafile = os.environ.get("SSL_CERT_FILE", certifi.where())
+        self.ssl_context = ssl.create_default_context(cafile=cafile)
+
+    def request(self, method: str, key: str, **kwargs: Any) -> urllib.request.Request:
+        request = urllib.request.Request(f"{self.url}/{key}.tar", method=method, **kwargs)
+        if self.token:
+            request.add_header("Authorization", f"Bearer {self.token}")
+        return request
+
+    def download(self, key: str, dest_dir: Path) -> bool:
+        """
+        Extracts the entry for `key` into `dest_dir`. Returns False if the
+        server doesn't have it.
+        """
+        try:
+            response = urllib.request.urlopen(
+                self.request("GET", key), timeout=self.timeout, context=self.ssl_context
+            )
+        except urllib.error.HTTPError as error:
+            if error.code == 404:
+                return False
+            raise
+
+        with response, tarfile.open(fileobj=response, mode="r|") as tar:
+            for member in tar:
+                # only accept plain files, directly inside the entry
+                if not member.isfile() or "/" in member.name:
+                    continue
+                member_file = tar.extractfile(member)
+                assert member_file is not None
+                with (dest_dir / member.name).open("wb") as f:
+                    shutil.copyfileobj(member_file, f)
+
+        return True
+
+    def upload(self, key: str, entry_dir: Path) -> None:
+        with tempfile.TemporaryFile() as f:
+            with tarfile.open(fileobj=f, mode="w") as tar:
+                for path in sorted(entry_dir.iterdir()):
+                    tar.add(path, arcname=path.name)
+            size = f.tell()
+            f.seek(0)
+
+            request = self.request(
+                "PUT",
+                key,
+                data=f,
+                headers={"Content-Type": "application/x-tar", "Content-Length": str(size)},
+            )
+            urllib.request.urlopen(request, timeout=self.timeout, context=self.ssl_context).close()
+
+
+class WheelCache:
+    """
+    A directory of cached wheels, evicted least-recently-used first once it
+    grows beyond `max_size` bytes, and optionally backed by a RemoteCache.
+    Safe to use from several threads.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Path,
+        max_size: Optional[int] = None,
+        remote: Optional[RemoteCache] = None,
+        remote_jobs: int = 8,
+    ) -> None:
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.remote = remote
+        self.hits: List[str] = []
+        self.misses: List[str] = []
+        self.remote_hits: List[str] = []
+        self.uploads: List[str] = []
+        self._lock = threading.Lock()
+        self._remote_executor = ThreadPoolExecutor(max_workers=remote_jobs)
+        self._uploads: List["Future[None]"] = []
+
+    @property
+    def entries_dir(self) -> Path:
+        return self.cache_dir / "wheels"
+
+    def entry_path(self, key: str) -> Path:
+        return self.entries_dir / key[:2] / key
+
+    def fetch(self, keys: Dict[str, str]) -> None:
+        """
+        Downloads the entries for `keys` (a dict of key to identifier) that
+        aren't in the local cache from the remote cache, in parallel.
+        """
+        missing = {k: i for k, i in keys.items() if not self.entry_path(k).exists()}
+        if self.remote is None or not missing:
+            return
+
+        futures = {self._remote_executor.submit(self._download, k): i for k, i in missing.items()}
+        for future in as_completed(futures):
+            if future.result():
+                with self._lock:
+                    self.remote_hits.append(futures[future])
+
+    def get(self, key: str, identifier: str) -> Optional[List[Path]]:
+        """
+        Returns the cached wheels for `key`, or None if there's no entry.
+        Lookups are counted towards the hit/miss summary.
+        """
+        path = self.entry_path(key)
+        wheels = sorted(path.glob("*.whl")) if path.is_dir() else []
+
+        with self._lock:
+            if wheels:
+                self.hits.append(identifier)
+                # the entry's mtime is used to track when it was last used
+                os.utime(path)
+            else:
+                self.misses.append(identifier)
+
+        return wheels or None
+
+    def put(self, key: str, identifier: str, wheels: List[Path]) -> None:
+        """
+        Adds wheels to the cache. If there's a remote cache, they're uploaded
+        to it in the background.
+        """
+        if self.entry_path(key).exists():
+            return
+
+        with self._new_entry(key) as staging_dir:
+            for wheel in wheels:
+                shutil.copy2(wheel, staging_dir / wheel.name)
+            (staging_dir / "entry.json").write_text(
+                json.dumps({"identifier": identifier, "created": time.time()})
+            )
+
+        if self.remote is not None:
+            future = self._remote_executor.submit(self._upload, key, identifier)
+            with self._lock:
+                self._uploads.append(future)
+
+    @contextlib.contextmanager
+    def _new_entry(self, key: str) -> Iterator[Path]:
+        """
+        Yields a temporary directory to fill with the contents of an entry,
+        which is then moved into place, so that partially-written entries are
+        never seen.
+        """
+        path = self.entry_path(key)
+        staging_dir = self.cache_dir / "tmp" / str(uuid.uuid4())
+        staging_dir.mkdir(parents=True)
+        try:
+            yield staging_dir
+            path.parent.mkdir(parents=True, exist_ok=True)
+            os.rename(staging_dir, path)
+        except OSError:
+            if not path.exists():
+                raise
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+    def _download(self, key: str) -> bool:
+        remote = self.remote
+        if remote is None:
+            return False
+
+        try:
+            with self._new_entry(key) as staging_dir:
+                if not remote.download(key, staging_dir):
+                    raise KeyError(key)
+        except KeyError:
+            return False
+        except Exception as error:
+            self._remote_failed("download from", error)
+            return False
+
+        return True
+
+    def _upload(self, key: str, identifier: str) -> None:
+        remote = self.remote
+        if remote is None:
+            return
+
+        try:
+            remote.upload(key, self.entry_path(key))
+        except Exception as error:
+            self._remote_failed("upload to", error)
+        else:
+            with self._lock:
+                self.uploads.append(identifier)
+
+    def _remote_failed(self, action: str, error: Exception) -> None:
+        # the remote cache is only an optimisation, so if it can't be
+        # reached, carry on without it
+        with self._lock:
+            if self.remote is not None:
+                print(
+                    f"cibuildwheel: Warning: failed to {action} the remote wheel cache at "
+                    f"{self.remote.url}, it won't be used for the rest of this run. {error}",
+                    file=sys.stderr,
+                )
+            self.remote = None
+
+    def wait_for_uploads(self) -> None:
+        with self._lock:
+            uploads = list(self._uploads)
+        wait(uploads)
+
+    def close(self) -> None:
+        self.wait_for_uploads()
+        self._remote_executor.shutdown()
+
+    def copy_to(self, wheels: List[Path], output_dir: Path) -> List[Path]:
+        return [copy_file_atomically(wheel, output_dir) for wheel in wheels]
+
+    def entries(self) -> Iterator[CacheEntry]:
+        for path in self.entries_dir.glob("*/*"):
+            size = sum(f.stat().st_size for f in path.iterdir())
+            yield CacheEntry(path=path, size=size, last_used=path.stat().st_mtime)
+
+    def evict(self) -> List[Path]:
+        """
+        Removes the least-recently-used entries until the cache is no bigger
+        than max_size. Returns the paths of the removed entries.
+        """
+        if self.max_size is None or not self.entries_dir.exists():
+            return []
+
+        entries = sorted(self.entries(), key=lambda e: e.last_used)
+        total_size = sum(e.size for e in entries)
+        removed = []
+
+        for entry in entries:
+            if total_size <= self.max_size:
+                break
+            shutil.rmtree(entry.path, ignore_errors=True)
+            total_size -= entry.size
+            removed.append(entry.path)
+
+        return removed
+
+    def summary(self) -> Dict[str, List[str]]:
+        with self._lock:
+            return {
+                "hits": list(self.hits),
+                "misses": list(self.misses),
+                "remote_hits": list(self.remote_hits),
+                "uploads": list(self.uploads),
+            }
@@ -0,0 +1,426 @@
+"""
+A pool of warm Linux build containers, kept by `cibuildwheel daemon run`, so
+that cibuildwheel invocations on the same machine can reuse containers
+rather than starting each from scratch.
+
+Pooled containers are ordinary Docker containers, labelled with LABEL, that
+run an idle process. A build leases one by creating its lock file, and opens
+shells in it, like a session. When the build is finished with it, the
+scratch directories are removed, and the lease is released. Containers are
+only reused by builds of the same project with the same before_all, since
+anything else a build changes in a container is kept, and those builds skip
+before_all. The daemon removes containers that have been idle for too long,
+or have stopped, and the least recently used ones when there are more than
+the maximum.
+"""
+
+import argparse
+import getpass
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from pathlib import Path, PurePath
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+LABEL = "io.cibuildwheel.pool"
+
+# the process that keeps a pooled container running between leases
+IDLE_COMMAND = ["tail", "-f", "/dev/null"]
+
+
+class PooledContainer(NamedTuple):
+    name: str
+    docker_image: str
+    simulate_32_bit: bool
+    cpus: Optional[float]
+    # the project directory on the host, and a hash of the setup that
+    # before_all did in the container
+    project: str
+    setup: str
+    last_used: float
+    # the pid of the process that has leased the container, if any
+    leased_by: Optional[int]
+
+
+def get_state_dir() -> Path:
+    state_dir = os.environ.get("CIBW_DAEMON_DIR")
+    if state_dir:
+        return Path(state_dir)
+    return Path(tempfile.gettempdir()) / f"cibuildwheel-daemon-{getpass.getuser()}"
+
+
+def process_is_running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # it exists, but belongs to someone else
+        return True
+    return True
+
+
+def choose_containers_to_remove(
+    containers: List[PooledContainer], *, now: float, idle_timeout: float, max_containers: int
+) -> List[PooledContainer]:
+    """
+    Returns the containers that aren't leased and have been idle for longer
+    than `idle_timeout` seconds, and then the least recently used of the
+    rest, while there are more than `max_containers`.
+    """
+    idle_containers = sorted(
+        (c for c in containers if c.leased_by is None), key=lambda c: c.last_used
+    )
+    excess = len(containers) - max_containers
+    to_remove = []
+
+    for container in idle_containers:
+        if excess > 0 or now - container.last_used > idle_timeout:
+            to_remove.append(container)
+            excess -= 1
+
+    return to_remove
+
+
+class ContainerPool:
+    """
+    The pool of warm containers, whose state - the leases, and when each
+    container was last used - is kept in files in `state_dir`.
+    """
+
+    def __init__(self, state_dir: Path) -> None:
+        self.state_dir = state_dir
+        self.pid_file = state_dir / "daemon.pid"
+        self.leases_dir = state_dir / "leases"
+        self.last_used_dir = state_dir / "last-used"
+
+    @classmethod
+    def find_running(cls) -> Optional["ContainerPool"]:
+        """
+        Returns the pool kept by a running daemon, or None if there isn't one.
+        """
+        pool = cls(get_state_dir())
+        return pool if pool.daemon_pid() is not None else None
+
+    def daemon_pid(self) -> Optional[int]:
+        try:
+            pid = int(self.pid_file.read_text())
+        except (OSError, ValueError):
+            return None
+        return pid if process_is_running(pid) else None
+
+    def _lease_path(self, name: str) -> Path:
+        return self.leases_dir / name
+
+    def _try_lease(self, name: str) -> bool:
+        try:
+            fd = os.open(self._lease_path(name), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        try:
+            os.write(fd, str(os.getpid()).encode("ascii"))
+        finally:
+            os.close(fd)
+        return True
+
+    def _end_lease(self, name: str) -> None:
+        try:
+            self._lease_path(name).unlink()
+        except FileNotFoundError:
+            pass
+
+    def _leased_by(self, name: str) -> Optional[int]:
+        try:
+            return int(self._lease_path(name).read_text() or "0")
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            # the lease is being written
+            return 0
+
+    def _touch(self, name: str) -> None:
+        (self.last_used_dir / name).touch()
+
+    def _last_used(self, name: str) -> float:
+        try:
+            return (self.last_used_dir / name).stat().st_mtime
+        except FileNotFoundError:
+            return 0.0
+
+    def list_containers(self, *, running_only: bool = False) -> List[PooledContainer]:
+        """
+        Returns the containers in the pool, or only those that are running,
+        if `running_only` is set. The others have stopped, e.g. because the
+        machine restarted, and can't be used.
+        """
+        status_args = ["--filter=status=running"] if running_only else []
+        output = subprocess.run(
+            [
+                "docker",
+                "ps",
+                "--all",
+                f"--filter=label={LABEL}={self.state_dir}",
+                *status_args,
+                "--format",
+                f'{{{{.Names}}}}\t{{{{.Label "{LABEL}.image"}}}}\t'
+                f'{{{{.Label "{LABEL}.linux32"}}}}\t{{{{.Label "{LABEL}.cpus"}}}}\t'
+                f'{{{{.Label "{LABEL}.project"}}}}\t{{{{.Label "{LABEL}.setup"}}}}',
+            ],
+            check=True,
+            stdout=subprocess.PIPE,
+            universal_newlines=True,
+        ).stdout
+
+        containers = []
+        for line in output.splitlines():
+            name, docker_image, linux32, cpus, project, setup = line.split("\t")
+            containers.append(
+                PooledContainer(
+                    name=name,
+                    docker_image=docker_image,
+                    simulate_32_bit=linux32 == "1",
+                    cpus=float(cpus) if cpus else None,
+                    project=project,
+                    setup=setup,
+                    last_used=self._last_used(name),
+                    leased_by=self._leased_by(name),
+                )
+            )
+        return containers
+
+    def lease(
+        self,
+        docker_image: str,
+        *,
+        simulate_32_bit: bool,
+        cpus: Optional[float],
+        project: str,
+        setup: str,
+    ) -> Tuple[str, bool]:
+        """
+        Leases an idle, running container for `docker_image` that was last
+        used to build `project` with the same `setup`, starting one if there
+        isn't one. Returns the container's name, and whether it was reused,
+        rather than started.
+        """
+        for container in self.list_containers(running_only=True):
+            if (
+                container.leased_by is None
+                and container.docker_image == docker_image
+                and container.simulate_32_bit == simulate_32_bit
+                and container.cpus == cpus
+                and container.project == project
+                and container.setup == setup
+                and self._try_lease(container.name)
+            ):
+                print(f"Reusing warm container {container.name}")
+                return container.name, True
+
+        name = f"cibuildwheel-pool-{uuid.uuid4()}"
+        self._try_lease(name)
+        cpus_args = [f"--cpus={cpus}"] if cpus else []
+
+        try:
+            subprocess.run(
+                [
+                    "docker",
+                    "run",
+                    "--detach",
+                    "--env=CIBUILDWHEEL",
+                    f"--name={name}",
+                    "--volume=/:/host",  # ignored on CircleCI
+                    f"--label={LABEL}={self.state_dir}",
+                    f"--label={LABEL}.image={docker_image}",
+                    f"--label={LABEL}.linux32={1 if simulate_32_bit else 0}",
+                    f"--label={LABEL}.cpus={cpus or ''}",
+                    f"--label={LABEL}.project={project}",
+                    f"--label={LABEL}.setup={setup}",
+                    *cpus_args,
+                    docker_image,
+                    *IDLE_COMMAND,
+                ],
+                check=True,
+                stdout=subprocess.DEVNULL,
+            )
+        except BaseException:
+            self._end_lease(name)
+            raise
+
+        self._touch(name)
+        print(f"Started warm container {name}")
+        return name, False
+
+    def release(self, name: str, *, reset_paths: Sequence[PurePath], reuse: bool = True) -> None:
+        """
+        Removes `reset_paths` in the container, and returns it to the pool.
+        If `reuse` is False, or the reset fails, the container is removed
+        instead.
+        """
+        if reuse:
+            result = subprocess.run(
+                ["docker", "exec", name, "rm", "-rf", *map(str, reset_paths)],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+            reuse = result.returncode == 0
+
+        if reuse:
+            self._touch(name)
+        else:
+            remove_container(name)
+
+        self._end_lease(name)
+
+    def reap(self, *, idle_timeout: float, max_containers: int) -> List[str]:
+        """
+        Removes containers that are idle, as chosen by
+        choose_containers_to_remove(). Containers whose lease was held by a
+        process that's gone are removed too, because they might be in any
+        state, as are idle containers that have stopped. Returns the names of
+        the removed containers.
+        """
+        containers = self.list_containers()
+        running_names = {c.name for c in self.list_containers(running_only=True)}
+        removed = []
+
+        for container in containers:
+            if container.leased_by is None and container.name not in running_names:
+                if self._try_lease(container.name):
+                    remove_container(container.name)
+                    self._end_lease(container.name)
+                    removed.append(container.name)
+            elif container.leased_by and not process_is_running(container.leased_by):
+                self._end_lease(container.name)
+                if self._try_lease(container.name):
+                    remove_container(container.name)
+                    self._end_lease(container.name)
+                    removed.append(container.name)
+
+        containers = [c for c in containers if c.name not in removed]
+        to_remove = choose_containers_to_remove(
+            containers, now=time.time(), idle_timeout=idle_timeout, max_containers=max_containers
+        )
+
+        for container in to_remove:
+            # the lease stops a build from taking the container meanwhile
+            if self._try_lease(container.name):
+                remove_container(container.name)
+                self._end_lease(container.name)
+                removed.append(container.name)
+
+        # forget containers that have gone
+        names = {c.name for c in containers} - set(removed)
+        for path in self.last_used_dir.iterdir():
+            if path.name not in names and self._leased_by(path.name) is None:
+                path.unlink()
+
+        return removed
+
+    def run_daemon(
+        self, *, idle_timeout: float, max_containers: int, interval: float = 10.0
+    ) -> None:
+        """
+        Keeps the pool until interrupted, or sent SIGTERM. On exit, the
+        containers that aren't leased are removed.
+        """
+        for directory in (self.state_dir, self.leases_dir, self.last_used_dir):
+            directory.mkdir(parents=True, exist_ok=True)
+
+        running_pid = self.daemon_pid()
+        if running_pid is not None:
+            raise RuntimeError(f"A cibuildwheel daemon is running already, pid {running_pid}")
+
+        self.pid_file.write_text(str(os.getpid()))
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+
+        print(
+            f"cibuildwheel daemon running, keeping up to {max_containers} containers, "
+            f"each for up to {idle_timeout:.0f}s when idle. State: {self.state_dir}"
+        )
+
+        try:
+            while not stop.is_set():
+                for name in self.reap(idle_timeout=idle_timeout, max_containers=max_containers):
+                    print(f"Removed {name}")
+                stop.wait(interval)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.pid_file.unlink()
+            for name in self.reap(idle_timeout=0, max_containers=0):
+                print(f"Removed {name}")
+
+
+def remove_container(name: str) -> None:
+    subprocess.run(
+        ["docker", "rm", "--force", "-v", name],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def main(args: List[str]) -> None:
+    """
+    Entry point for `cibuildwheel daemon`.
+    """
+    parser = argparse.ArgumentParser(
+        prog="cibuildwheel daemon",
+        description="""
+            Keep warm Linux build containers, which cibuildwheel runs on this
+            machine reuse, while the project-transfer option is "copy".
+        """,
+    )
+    subparsers = parser.add_subparsers(dest="command")
+    run_parser = subparsers.add_parser("run", help="Run the daemon, until interrupted.")
+    run_parser.add_argument(
+        "--idle-timeout",
+        type=float,
+        default=30.0,
+        metavar="MINUTES",
+        help="Remove containers that haven't been used for this long. Default: 30.",
+    )
+    run_parser.add_argument(
+        "--max-containers",
+        type=int,
+        default=8,
+        metavar="N",
+        help="Keep at most this many containers. Default: 8.",
+    )
+    subparsers.add_parser("list", help="List the containers in the pool.")
+    subparsers.add_parser("stop", help="Stop the running daemon.")
+
+    parsed_args = parser.parse_args(args)
+    pool = ContainerPool(get_state_dir())
+
+    if parsed_args.command == "run":
+        try:
+            pool.run_daemon(
+                idle_timeout=parsed_args.idle_timeout * 60,
+                max_containers=parsed_args.max_containers,
+            )
+        except RuntimeError as error:
+            print(f"cibuildwheel: {error}", file=sys.stderr)
+            sys.exit(1)
+    elif parsed_args.command == "list":
+        now = time.time()
+        for container in pool.list_containers():
+            status = "leased" if container.leased_by else f"idle {now - container.last_used:.0f}s"
+            print(
+                f"{container.name}  {container.docker_image}"
+                f"{' (linux32)' if container.simulate_32_bit else ''}  {container.project}  {status}"
+            )
+    elif parsed_args.command == "stop":
+        pid = pool.daemon_pid()
+        if pid is None:
+            print("cibuildwheel: The daemon isn't running", file=sys.stderr)
+            sys.exit(1)
+        os.kill(pid, signal.SIGTERM)
+    else:
+        parser.print_usage(sys.stderr)
+        sys.exit(2)
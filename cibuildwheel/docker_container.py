@@ -4,12 +4,14 @@ import os
 import shlex
 import subprocess
 import sys
+import tempfile
 import uuid
 from pathlib import Path, PurePath
 from types import TracebackType
-from typing import IO, Dict, List, Optional, Sequence, Type, cast
+from typing import IO, Any, Dict, Iterator, List, Optional, Sequence, Tuple, Type, cast
 
 from .typing import PathOrStr, PopenBytes
+from .util import resources_dir
 
 
 class DockerContainer:
@@ -22,16 +24,45 @@ class DockerContainer:
     A bash shell is running in the remote container. When `call()` is invoked,
     the command is relayed to the remote shell, and the results are streamed
     back to cibuildwheel.
+
+    If `attach_to` is the name of a running container, a new shell is opened
+    in that container instead, and the container is left running on exit.
+
+    `mounts` are passed to `docker create` as `--mount` arguments.
+
+    The environments passed to `call()` are remembered in the shell, as
+    arrays of assignments, so that later calls with a similar environment
+    only send the variables that differ.
+
+    Filesystem and environment queries, like `glob()` and `which()`, are
+    answered by a helper process that's started in the container the first
+    time one is made, and then kept running, so that each query doesn't cost
+    an interpreter start.
     """
 
     UTILITY_PYTHON = "/opt/python/cp38-cp38/bin/python"
 
+    # the most output to read from the shell at once
+    READ_SIZE = 1024 * 1024
+
+    # the most environments to keep defined in the shell, and the size of
+    # the smallest that's worth defining
+    MAX_ENVIRONMENTS = 8
+    MIN_DEFINED_ENVIRONMENT_SIZE = 1024
+
     process: PopenBytes
     bash_stdin: IO[bytes]
     bash_stdout: IO[bytes]
 
     def __init__(
-        self, docker_image: str, simulate_32_bit: bool = False, cwd: Optional[PathOrStr] = None
+        self,
+        docker_image: str,
+        simulate_32_bit: bool = False,
+        cwd: Optional[PathOrStr] = None,
+        cpus: Optional[float] = None,
+        *,
+        attach_to: Optional[str] = None,
+        mounts: Sequence[str] = (),
     ):
         if not docker_image:
             raise ValueError("Must have a non-empty docker image to run.")
@@ -39,34 +70,49 @@ class DockerContainer:
         self.docker_image = docker_image
         self.simulate_32_bit = simulate_32_bit
         self.cwd = cwd
+        self.cpus = cpus
+        self.attach_to = attach_to
+        self.mounts = mounts
         self.name: Optional[str] = None
+        self._pending_output = b""
+        self._helper: Optional[PopenBytes] = None
+        # environments defined in the shell, by variable name, least
+        # recently used first
+        self._environments: Dict[str, Dict[str, str]] = {}
 
     def __enter__(self) -> "DockerContainer":
-        self.name = f"cibuildwheel-{uuid.uuid4()}"
         cwd_args = ["-w", str(self.cwd)] if self.cwd else []
         shell_args = ["linux32", "/bin/bash"] if self.simulate_32_bit else ["/bin/bash"]
-        subprocess.run(
-            [
-                "docker",
-                "create",
-                "--env=CIBUILDWHEEL",
-                f"--name={self.name}",
-                "--interactive",
-                "--volume=/:/host",  # ignored on CircleCI
-                *cwd_args,
-                self.docker_image,
-                *shell_args,
-            ],
-            check=True,
-        )
+
+        if self.attach_to:
+            # open another shell in a container that's already running
+            self.name = self.attach_to
+            popen_args = ["docker", "exec", "--interactive", *cwd_args, self.name, *shell_args]
+        else:
+            self.name = f"cibuildwheel-{uuid.uuid4()}"
+            cpus_args = [f"--cpus={self.cpus}"] if self.cpus else []
+            mount_args = [f"--mount={mount}" for mount in self.mounts]
+            subprocess.run(
+                [
+                    "docker",
+                    "create",
+                    "--env=CIBUILDWHEEL",
+                    f"--name={self.name}",
+                    "--interactive",
+                    "--volume=/:/host",  # ignored on CircleCI
+                    *cwd_args,
+                    *cpus_args,
+                    *mount_args,
+                    self.docker_image,
+                    *shell_args,
+                ],
+                check=True,
+                stdout=subprocess.DEVNULL,
+            )
+            popen_args = ["docker", "start", "--attach", "--interactive", self.name]
+
         self.process = subprocess.Popen(
-            [
-                "docker",
-                "start",
-                "--attach",
-                "--interactive",
-                self.name,
-            ],
+            popen_args,
             stdin=subprocess.PIPE,
             stdout=subprocess.PIPE,
         )
@@ -75,8 +121,13 @@ class DockerContainer:
         self.bash_stdin = self.process.stdin
         self.bash_stdout = self.process.stdout
 
-        # run a noop command to block until the container is responding
-        self.call(["/bin/true"])
+        try:
+            # run a noop command to block until the container is responding
+            self.call(["/bin/true"])
+        except (subprocess.CalledProcessError, BrokenPipeError):
+            # the container didn't start, e.g. because a mount failed
+            self.__exit__(None, None, None)
+            raise
 
         return self
 
@@ -87,15 +138,52 @@ class DockerContainer:
         exc_tb: Optional[TracebackType],
     ) -> None:
 
-        self.bash_stdin.close()
+        self._stop_helper()
+
+        try:
+            self.bash_stdin.close()
+        except BrokenPipeError:
+            # the shell has already gone away
+            pass
         self.process.terminate()
         self.process.wait()
 
         assert isinstance(self.name, str)
 
-        subprocess.run(["docker", "rm", "--force", "-v", self.name], stdout=subprocess.DEVNULL)
+        if not self.attach_to:
+            subprocess.run(["docker", "rm", "--force", "-v", self.name], stdout=subprocess.DEVNULL)
         self.name = None
 
+    def session(self) -> "DockerContainer":
+        """
+        Returns another DockerContainer, which opens a new shell inside this
+        (running) container when entered. Sessions can be used concurrently,
+        from different threads.
+        """
+        assert self.name is not None
+        return DockerContainer(
+            self.docker_image,
+            simulate_32_bit=self.simulate_32_bit,
+            cwd=self.cwd,
+            attach_to=self.name,
+        )
+
+    def kill(self) -> None:
+        """
+        Disconnects from the container's shell, causing any call() that is in
+        progress to fail. Unless this is a session, the container is stopped,
+        too, which ends all of its sessions. This can be called from another
+        thread, to abandon a build.
+        """
+        self.process.kill()
+        if self._helper is not None:
+            self._helper.kill()
+
+        if not self.attach_to and self.name is not None:
+            subprocess.run(
+                ["docker", "kill", self.name], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            )
+
     def copy_into(self, from_path: Path, to_path: PurePath) -> None:
         # `docker cp` causes 'no space left on device' error when
         # a container is running and the host filesystem is
@@ -128,22 +216,59 @@ class DockerContainer:
             cwd=to_path,
         )
 
+    def copy_out_file(self, from_path: PurePath, to_path: Path) -> None:
+        """
+        Copies a single file out of the container. It's written to a
+        temporary name and then renamed, so that `to_path` appears complete,
+        or not at all.
+        """
+        temp_path = to_path.with_name(f".{to_path.name}.{uuid.uuid4().hex[:8]}.tmp")
+
+        try:
+            with temp_path.open("wb") as f:
+                subprocess.run(
+                    ["docker", "exec", "-i", str(self.name), "cat", str(from_path)],
+                    check=True,
+                    stdout=f,
+                )
+            os.replace(temp_path, to_path)
+        finally:
+            if temp_path.exists():
+                temp_path.unlink()
+
     def glob(self, path: PurePath, pattern: str) -> List[PurePath]:
         glob_pattern = os.path.join(str(path), pattern)
-
-        path_strs = json.loads(
-            self.call(
-                [
-                    self.UTILITY_PYTHON,
-                    "-c",
-                    f"import sys, json, glob; json.dump(glob.glob({glob_pattern!r}), sys.stdout)",
-                ],
-                capture_output=True,
-            )
-        )
-
+        path_strs = self._helper_request("glob", pattern=glob_pattern)
         return [PurePath(p) for p in path_strs]
 
+    def which(self, name: str, env: Optional[Dict[str, str]] = None) -> Optional[PurePath]:
+        """
+        Returns the path of the executable `name` on the PATH from `env` (or
+        the container's PATH), or None if it's not found.
+        """
+        path = env.get("PATH") if env is not None else None
+        result = self._helper_request("which", name=name, path=path)
+        return PurePath(result) if result is not None else None
+
+    def make_dirs(self, path: PurePath) -> None:
+        # like `mkdir -p`
+        self._helper_request("mkdir", path=str(path))
+
+    def remove(self, path: PurePath) -> None:
+        # like `rm -rf`
+        self._helper_request("rm", path=str(path))
+
+    def stat(self, path: PurePath) -> Optional[Dict[str, Any]]:
+        """
+        Returns the size, mtime and mode of `path`, or None if it doesn't
+        exist.
+        """
+        return cast(Optional[Dict[str, Any]], self._helper_request("stat", path=str(path)))
+
+    def make_temp_dir(self) -> PurePath:
+        # like `mktemp -d`
+        return PurePath(self._helper_request("mktemp"))
+
     def call(
         self,
         args: Sequence[PathOrStr],
@@ -151,32 +276,78 @@ class DockerContainer:
         capture_output: bool = False,
         cwd: Optional[PathOrStr] = None,
     ) -> str:
+        return self.call_many([args], env=env, capture_output=capture_output, cwd=cwd)[0]
 
+    def call_many(
+        self,
+        commands: Sequence[Sequence[PathOrStr]],
+        env: Optional[Dict[str, str]] = None,
+        capture_output: bool = False,
+        cwd: Optional[PathOrStr] = None,
+    ) -> List[str]:
+        """
+        Runs `commands` one after another, sending them to the shell together,
+        so they cost one round trip. Stops at the first command that fails,
+        raising CalledProcessError with that command's args and returncode.
+        Returns the output of each command, if `capture_output` is set.
+        """
+        if not capture_output:
+            self._call_many(commands, env=env, cwd=cwd, capture_output=False)
+            return [""] * len(commands)
+
+        outputs = []
+        for captured_output in self._call_many(commands, env=env, cwd=cwd, capture_output=True):
+            with captured_output:
+                outputs.append(captured_output.text())
+        return outputs
+
+    def call_captured(
+        self,
+        args: Sequence[PathOrStr],
+        env: Optional[Dict[str, str]] = None,
+        cwd: Optional[PathOrStr] = None,
+    ) -> "CapturedOutput":
+        """
+        Like `call(args, capture_output=True)`, but returns the output as a
+        CapturedOutput, so that it can be streamed rather than decoded all at
+        once. The caller should close it.
+        """
+        return self._call_many([args], env=env, cwd=cwd, capture_output=True)[0]
+
+    def _call_many(
+        self,
+        commands: Sequence[Sequence[PathOrStr]],
+        env: Optional[Dict[str, str]],
+        cwd: Optional[PathOrStr],
+        capture_output: bool,
+    ) -> List["CapturedOutput"]:
         chdir = f"cd {cwd}" if cwd else ""
-        env_assignments = (
-            " ".join(f"{shlex.quote(k)}={shlex.quote(v)}" for k, v in env.items())
-            if env is not None
-            else ""
-        )
-        command = " ".join(shlex.quote(str(a)) for a in args)
-        end_of_message = str(uuid.uuid4())
+        env_definition, env_args = self._environment_args(env)
+        command_strs = [" ".join(shlex.quote(str(a)) for a in args) for args in commands]
+        end_of_message = uuid.uuid4().hex
 
-        # log the command we're executing
-        print(f"    + {command}")
-
-        # Write a command to the remote shell. First we change the
+        # Write the commands to the remote shell. If the environment is new,
+        # it's first defined in the shell. Then, in a subshell, we change the
         # cwd, if that's required. Then, we use the `env` utility to run
-        # `command` inside the specified environment. We use `env` because it
-        # can cope with spaces and strange characters in the name or value.
-        # Finally, the remote shell is told to write a footer - this will show
-        # up in the output so we know when to stop reading, and will include
-        # the returncode of `command`.
+        # each command inside the specified environment. We use `env` because
+        # it can cope with spaces and strange characters in the name or value.
+        # After each command, the remote shell is told to write a trailer -
+        # the random end_of_message marker, followed by the returncode of the
+        # command - and to stop if it failed. The marker can't appear in the
+        # output by chance, so it doesn't need to be at the start of a line.
+        script = "".join(
+            f"""
+            env {env_args} {command_str}
+            rc=$?; printf "%s%04d" {end_of_message} $rc; [ $rc -eq 0 ] || exit 0
+            """
+            for command_str in command_strs
+        )
         self.bash_stdin.write(
             bytes(
-                f"""(
+                f"""{env_definition}
+        (
             {chdir}
-            env {env_assignments} {command}
-            printf "%04d%s\n" $? {end_of_message}
+            {script}
         )
         """,
                 encoding="utf8",
@@ -185,58 +356,281 @@ class DockerContainer:
         )
         self.bash_stdin.flush()
 
-        if capture_output:
-            output_io: IO[bytes] = io.BytesIO()
+        outputs: List[CapturedOutput] = []
+
+        try:
+            for args, command_str in zip(commands, command_strs):
+                # log the command we're executing, before its output
+                print(f"    + {command_str}")
+
+                if capture_output:
+                    captured_output = CapturedOutput()
+                    outputs.append(captured_output)
+                    output_io = captured_output.file
+                else:
+                    output_io = sys.stdout.buffer
+
+                returncode = self._read_output(end_of_message.encode("ascii"), output_io, args)
+
+                if returncode != 0:
+                    output = outputs[-1].text() if capture_output else ""
+                    raise subprocess.CalledProcessError(returncode, args, output)
+        except BaseException:
+            for captured_output in outputs:
+                captured_output.close()
+            raise
+
+        return outputs
+
+    def _environment_args(self, env: Optional[Dict[str, str]]) -> Tuple[str, str]:
+        """
+        Returns shell code to define `env` in the shell, if that's required,
+        and the arguments for `env` that set up `env` for a command. If an
+        environment that's already defined is close to `env`, the arguments
+        refer to it and only add the variables that differ.
+        """
+        if not env:
+            return "", ""
+
+        best: Optional[Tuple[str, Dict[str, str]]] = None
+
+        for name, defined_env in self._environments.items():
+            if any(key not in env for key in defined_env):
+                # variables can't be removed from a defined environment
+                continue
+            differences = {k: v for k, v in env.items() if defined_env.get(k) != v}
+            if best is None or len(differences) < len(best[1]):
+                best = (name, differences)
+
+        if best is not None and len(best[1]) <= len(env) // 2:
+            name, differences = best
+            # mark as recently used
+            self._environments[name] = self._environments.pop(name)
+            definition = ""
         else:
-            output_io = sys.stdout.buffer
-
-        while True:
-            line = self.bash_stdout.readline()
-
-            if line.endswith(bytes(end_of_message, encoding="utf8") + b"\n"):
-                # fmt: off
-                footer_offset = (
-                    len(line)
-                    - 1  # newline character
-                    - len(end_of_message)  # delimiter
-                    - 4  # 4 returncode decimals
-                )
-                # fmt: on
-                returncode_str = line[footer_offset : footer_offset + 4]
-                returncode = int(returncode_str)
-                # add the last line to output, without the footer
-                output_io.write(line[0:footer_offset])
-                break
+            assignments = assignments_for_env(env)
+            if len(assignments) < self.MIN_DEFINED_ENVIRONMENT_SIZE:
+                # not worth remembering
+                return "", assignments
+
+            if len(self._environments) >= self.MAX_ENVIRONMENTS:
+                # reuse the variable of the least recently used environment
+                name = next(iter(self._environments))
+                del self._environments[name]
             else:
-                output_io.write(line)
-
-        if isinstance(output_io, io.BytesIO):
-            output = str(output_io.getvalue(), encoding="utf8", errors="surrogateescape")
-        else:
-            output = ""
+                name = f"__cibuildwheel_env_{len(self._environments)}"
+
+            self._environments[name] = dict(env)
+            definition = f"{name}=({assignments})"
+            differences = {}
+
+        return definition, f'"${{{name}[@]}}" {assignments_for_env(differences)}'
+
+    def _read_output(
+        self, end_of_message: bytes, output_io: IO[bytes], args: Sequence[PathOrStr]
+    ) -> int:
+        """
+        Reads the output of a command from the shell, in chunks as large as
+        are available, writing it to `output_io` until the trailer. Returns
+        the returncode from the trailer.
+        """
+        trailer_length = len(end_of_message) + 4
+        buffer = self._pending_output
+        self._pending_output = b""
 
-        if returncode != 0:
-            raise subprocess.CalledProcessError(returncode, args, output)
+        while True:
+            marker_index = buffer.find(end_of_message)
 
-        return output
+            if marker_index != -1 and len(buffer) >= marker_index + trailer_length:
+                output_io.write(buffer[:marker_index])
+                output_io.flush()
+                returncode = int(
+                    buffer[marker_index + len(end_of_message) : marker_index + trailer_length]
+                )
+                # anything after the trailer was written by a background
+                # process, so it's passed on with the next command's output
+                self._pending_output = buffer[marker_index + trailer_length :]
+                return returncode
+
+            if marker_index == -1:
+                # pass on everything except what could be the start of the
+                # marker
+                safe_length = max(len(buffer) - (len(end_of_message) - 1), 0)
+                if safe_length:
+                    output_io.write(buffer[:safe_length])
+                    output_io.flush()
+                    buffer = buffer[safe_length:]
+
+            chunk = self.bash_stdout.read1(self.READ_SIZE)  # type: ignore[attr-defined]
+            if not chunk:
+                # the shell has gone away, e.g. because the container was killed
+                raise subprocess.CalledProcessError(self.process.wait(), args)
+            buffer += chunk
 
     def get_environment(self) -> Dict[str, str]:
-        env = json.loads(
-            self.call(
-                [
-                    self.UTILITY_PYTHON,
-                    "-c",
-                    "import sys, json, os; json.dump(os.environ.copy(), sys.stdout)",
-                ],
-                capture_output=True,
+        return cast(Dict[str, str], self._helper_request("env"))
+
+    def _helper_request(self, op: str, **args: Any) -> Any:
+        """
+        Sends a request to the helper process, starting it if required, and
+        returns the result. Failures raise CalledProcessError, like call().
+        """
+        if self._helper is None:
+            self._helper = self._start_helper()
+
+        assert self._helper.stdin and self._helper.stdout
+        request = json.dumps({"op": op, "args": args})
+
+        try:
+            self._helper.stdin.write(request.encode("ascii") + b"\n")
+            self._helper.stdin.flush()
+        except BrokenPipeError:
+            # the helper has gone away, which is reported below
+            pass
+
+        response_line = self._helper.stdout.readline()
+        if not response_line:
+            raise subprocess.CalledProcessError(self._helper.wait(), ["container_helper", op])
+
+        response = json.loads(response_line)
+        if "error" in response:
+            raise subprocess.CalledProcessError(
+                1, ["container_helper", op, *map(str, args.values())], response["error"]
             )
+        return response["result"]
+
+    def _start_helper(self) -> PopenBytes:
+        assert self.name is not None
+        cwd_args = ["-w", str(self.cwd)] if self.cwd else []
+        helper_source = (resources_dir / "container_helper.py").read_text()
+
+        return subprocess.Popen(
+            [
+                "docker",
+                "exec",
+                "--interactive",
+                *cwd_args,
+                self.name,
+                self.UTILITY_PYTHON,
+                "-c",
+                helper_source,
+            ],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
         )
-        return cast(Dict[str, str], env)
+
+    def _stop_helper(self) -> None:
+        if self._helper is None:
+            return
+
+        assert self._helper.stdin and self._helper.stdout
+        try:
+            # the helper exits at the end of its input
+            self._helper.stdin.close()
+        except BrokenPipeError:
+            pass
+        self._helper.wait()
+        self._helper.stdout.close()
+        self._helper = None
 
     def environment_executor(self, command: List[str], environment: Dict[str, str]) -> str:
         # used as an EnvironmentExecutor to evaluate commands and capture output
         return self.call(command, env=environment, capture_output=True)
 
 
+class CapturedOutput:
+    """
+    The output of a command, kept in memory up to `max_memory_size` bytes,
+    and in a temporary file beyond that. Use as a context manager, or call
+    `close()` when done.
+    """
+
+    MAX_MEMORY_SIZE = 16 * 1024 * 1024
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, max_memory_size: Optional[int] = None) -> None:
+        if max_memory_size is None:
+            max_memory_size = self.MAX_MEMORY_SIZE
+        self.file = cast(IO[bytes], tempfile.SpooledTemporaryFile(max_size=max_memory_size))
+
+    def __enter__(self) -> "CapturedOutput":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_val: Optional[BaseException],
+        exc_tb: Optional[TracebackType],
+    ) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.file.close()
+
+    @property
+    def size(self) -> int:
+        # SpooledTemporaryFile.seek returns None before Python 3.7
+        self.file.seek(0, io.SEEK_END)
+        return self.file.tell()
+
+    def chunks(self) -> Iterator[bytes]:
+        self.file.seek(0)
+        while True:
+            chunk = self.file.read(self.CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+    def lines(self) -> Iterator[str]:
+        self.file.seek(0)
+        for line in self.file:
+            yield str(line, encoding="utf8", errors="surrogateescape")
+
+    def text(self) -> str:
+        self.file.seek(0)
+        return str(self.file.read(), encoding="utf8", errors="surrogateescape")
+
+
+def get_docker_endpoint() -> Optional[str]:
+    """
+    Returns the address of the Docker daemon that docker commands talk to,
+    e.g. unix:///var/run/docker.sock. That's DOCKER_HOST if it's set, or
+    else the endpoint of the current context, chosen by DOCKER_CONTEXT or
+    `docker context use`. Returns None if it can't be found out, e.g.
+    because this docker doesn't have contexts.
+    """
+    docker_host = os.environ.get("DOCKER_HOST")
+    if docker_host:
+        return docker_host
+
+    try:
+        result = subprocess.run(
+            ["docker", "context", "inspect", "--format", "{{.Endpoints.docker.Host}}"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True,
+        )
+    except OSError:
+        return None
+
+    endpoint = result.stdout.strip()
+    return endpoint if result.returncode == 0 and endpoint else None
+
+
+def docker_is_remote() -> bool:
+    """
+    Returns True if the Docker daemon is on another machine, so that
+    transfers to it go over the network. Daemons reached through a socket
+    or a named pipe are local; those reached over tcp:// or ssh:// are
+    remote.
+    """
+    endpoint = get_docker_endpoint()
+    return endpoint is not None and not endpoint.startswith(("unix://", "npipe://"))
+
+
+def assignments_for_env(env: Dict[str, str]) -> str:
+    return " ".join(shlex.quote(f"{k}={v}") for k, v in env.items())
+
+
 def shell_quote(path: PurePath) -> str:
     return shlex.quote(str(path))
@@ -0,0 +1,368 @@
+"""
+The Docker images that Linux builds run in. They're pulled in the
+background when the build starts, several at once, rather than one after
+another as each is first used. `cibuildwheel images save` and
+`cibuildwheel images load` move them to machines without registry access.
+"""
+
+import argparse
+import getpass
+import json
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from types import TracebackType
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple, Type
+
+from .typing import PopenBytes
+
+
+def local_image_id(docker_image: str) -> Optional[str]:
+    result = subprocess.run(
+        ["docker", "image", "inspect", "--format", "{{.Id}}", docker_image],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        universal_newlines=True,
+    )
+    return result.stdout.strip() if result.returncode == 0 else None
+
+
+def image_exists(docker_image: str) -> bool:
+    return local_image_id(docker_image) is not None
+
+
+def get_loaded_digests_path() -> Path:
+    return Path(tempfile.gettempdir()) / f"cibuildwheel-image-digests-{getpass.getuser()}.json"
+
+
+def read_loaded_digests() -> Dict[str, str]:
+    """
+    Returns the registry digests of the images that `load_images` loaded,
+    by image ID. Docker doesn't keep them, since loaded images weren't
+    pulled.
+    """
+    try:
+        loaded_digests: Dict[str, str] = json.loads(
+            get_loaded_digests_path().read_text(encoding="utf8")
+        )
+    except (OSError, ValueError):
+        return {}
+    return loaded_digests
+
+
+def get_image_digest(docker_image: str) -> Optional[str]:
+    """
+    Returns the registry digest of `docker_image`, without pulling it. If
+    the image is present locally, that's the digest it was pulled with, or
+    that it was saved with, if it was loaded by `load_images`, since that's
+    the image a container would be started from. Otherwise, the registry is
+    asked, with `docker buildx imagetools inspect`. Returns None if the
+    image is local but never came from a registry, e.g. because it was built
+    locally, or if the registry can't be asked.
+    """
+    if "@sha256:" in docker_image:
+        return docker_image.rsplit("@", 1)[1]
+
+    result = subprocess.run(
+        [
+            "docker",
+            "image",
+            "inspect",
+            "--format",
+            "{{json .Id}} {{json .RepoDigests}}",
+            docker_image,
+        ],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        universal_newlines=True,
+    )
+    if result.returncode == 0:
+        image_id, repo_digests_json = result.stdout.split(" ", 1)
+        repo_digests: List[str] = json.loads(repo_digests_json) or []
+        if repo_digests:
+            return repo_digests[0].rsplit("@", 1)[1]
+        return read_loaded_digests().get(json.loads(image_id))
+
+    result = subprocess.run(
+        [
+            "docker",
+            "buildx",
+            "imagetools",
+            "inspect",
+            "--format",
+            "{{json .Manifest}}",
+            docker_image,
+        ],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        universal_newlines=True,
+    )
+    if result.returncode == 0:
+        digest: str = json.loads(result.stdout)["digest"]
+        return digest
+
+    return None
+
+
+class ImagePuller:
+    """
+    Pulls `docker_images` on background threads, `jobs` at a time, skipping
+    those that are available locally already. `wait()` blocks until an image
+    is available. On exit, pulls that are still running are stopped.
+    """
+
+    JOBS = 4
+
+    def __init__(self, docker_images: Iterable[str], jobs: Optional[int] = None) -> None:
+        self._lock = threading.Lock()
+        self._closed = False
+        self._processes: List[PopenBytes] = []
+        self._reported: Set[str] = set()
+        self._executor = ThreadPoolExecutor(max_workers=jobs or self.JOBS)
+        # each image is pulled once, however many groups use it
+        self._pulls: Dict[str, "Future[Optional[float]]"] = {
+            docker_image: self._executor.submit(self._pull, docker_image)
+            for docker_image in dict.fromkeys(docker_images)
+        }
+
+    def __enter__(self) -> "ImagePuller":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_val: Optional[BaseException],
+        exc_tb: Optional[TracebackType],
+    ) -> None:
+        self.close()
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            for future in self._pulls.values():
+                future.cancel()
+            for process in self._processes:
+                process.terminate()
+        self._executor.shutdown(wait=True)
+
+    def _pull(self, docker_image: str) -> Optional[float]:
+        """
+        Pulls `docker_image`, unless it's available already. Returns how long
+        the pull took, or None if it wasn't needed.
+        """
+        if image_exists(docker_image):
+            return None
+
+        start_time = time.time()
+        pull_args = ["docker", "pull", docker_image]
+
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("The image puller has been closed")
+            process = subprocess.Popen(
+                pull_args,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+            )
+            self._processes.append(process)
+
+        output, _ = process.communicate()
+
+        with self._lock:
+            self._processes.remove(process)
+
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError(
+                process.returncode,
+                pull_args,
+                str(output, encoding="utf8", errors="replace"),
+            )
+
+        return time.time() - start_time
+
+    def wait(self, docker_image: str) -> None:
+        """
+        Waits for `docker_image` to be pulled, and reports how long that
+        took the first time it's waited for. Images that this puller wasn't
+        given are left to `docker create` to pull.
+        """
+        future = self._pulls.get(docker_image)
+        if future is None:
+            return
+
+        wait_start_time = time.time()
+        pull_duration = future.result()
+        wait_duration = time.time() - wait_start_time
+
+        with self._lock:
+            if docker_image in self._reported:
+                return
+            self._reported.add(docker_image)
+
+        if pull_duration is not None:
+            message = f"Pulled {docker_image} in {pull_duration:.1f}s"
+            if wait_duration >= 0.1:
+                message += f", after waiting {wait_duration:.1f}s for it"
+            print(message)
+
+
+BUNDLE_MANIFEST_NAME = "images.json"
+
+
+def get_image_info(docker_image: str) -> Tuple[str, List[str]]:
+    """
+    Returns the ID of a local docker image, and the IDs of its layers.
+    """
+    output = subprocess.run(
+        [
+            "docker",
+            "image",
+            "inspect",
+            "--format",
+            "{{json .Id}} {{json .RootFS.Layers}}",
+            docker_image,
+        ],
+        check=True,
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+    ).stdout
+    image_id, layers = output.split(" ", 1)
+    return json.loads(image_id), json.loads(layers)
+
+
+def group_by_shared_layers(image_layers: Dict[str, List[str]]) -> List[List[str]]:
+    """
+    Groups the images that share any layers, directly or through other
+    images, so that each group can be saved to one archive, with every
+    layer stored once.
+    """
+    groups: List[List[str]] = []
+    group_layers: List[Set[str]] = []
+
+    for docker_image, layers in image_layers.items():
+        merged_images = [docker_image]
+        merged_layers = set(layers)
+
+        for index in reversed(range(len(groups))):
+            if group_layers[index] & merged_layers:
+                merged_images = groups.pop(index) + merged_images
+                merged_layers |= group_layers.pop(index)
+
+        groups.append(merged_images)
+        group_layers.append(merged_layers)
+
+    return groups
+
+
+def save_images(docker_images: List[str], directory: Path) -> None:
+    """
+    Pulls `docker_images` if required, and saves them to archives in
+    `directory` with `docker save`, along with a manifest listing the
+    images in each archive, their IDs, and their registry digests, which
+    `docker save` doesn't keep.
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+
+    with ImagePuller(docker_images) as puller:
+        for docker_image in docker_images:
+            puller.wait(docker_image)
+
+    image_ids = {}
+    image_layers = {}
+    image_digests = {}
+    for docker_image in docker_images:
+        image_ids[docker_image], image_layers[docker_image] = get_image_info(docker_image)
+        image_digests[docker_image] = get_image_digest(docker_image)
+
+    bundles = []
+    for index, group in enumerate(group_by_shared_layers(image_layers), start=1):
+        file_name = f"images-{index}.tar"
+        print(f"Saving {', '.join(group)} to {file_name}...")
+        subprocess.run(
+            ["docker", "save", "--output", str(directory / file_name), *group], check=True
+        )
+        bundles.append(
+            {
+                "file": file_name,
+                "images": {image: image_ids[image] for image in group},
+                "digests": {image: image_digests[image] for image in group},
+            }
+        )
+
+    manifest_path = directory / BUNDLE_MANIFEST_NAME
+    manifest_path.write_text(json.dumps({"bundles": bundles}, indent=2), encoding="utf8")
+    print(f"Saved {len(docker_images)} images to {len(bundles)} archives in {directory}")
+
+
+def load_images(directory: Path, jobs: Optional[int] = None) -> None:
+    """
+    Loads the archives saved by `save_images` in `directory`, several at a
+    time. Archives whose images are all present already, with the same
+    IDs, are skipped. The images' registry digests are recorded, for
+    `get_image_digest`.
+    """
+    manifest_path = directory / BUNDLE_MANIFEST_NAME
+    bundles = json.loads(manifest_path.read_text(encoding="utf8"))["bundles"]
+
+    def load_bundle(bundle: Dict[str, Any]) -> None:
+        images: Dict[str, str] = bundle["images"]
+        if all(local_image_id(image) == image_id for image, image_id in images.items()):
+            print(f"Skipped {bundle['file']}, its images are present already")
+            return
+
+        start_time = time.time()
+        subprocess.run(
+            ["docker", "load", "--input", str(directory / bundle["file"])],
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+        print(f"Loaded {', '.join(images)} in {time.time() - start_time:.1f}s")
+
+    with ThreadPoolExecutor(max_workers=jobs or ImagePuller.JOBS) as executor:
+        # list() raises the first error
+        list(executor.map(load_bundle, bundles))
+
+    # bundles saved by older versions don't have digests
+    loaded_digests = read_loaded_digests()
+    for bundle in bundles:
+        for image, digest in bundle.get("digests", {}).items():
+            if digest is not None:
+                loaded_digests[bundle["images"][image]] = digest
+    get_loaded_digests_path().write_text(json.dumps(loaded_digests, indent=2), encoding="utf8")
+
+
+def parse_args(args: List[str]) -> Tuple[argparse.Namespace, List[str]]:
+    """
+    Parses the arguments of `cibuildwheel images`. Returns them, and the
+    rest of the arguments, which select the build whose images are saved.
+    """
+    parser = argparse.ArgumentParser(
+        prog="cibuildwheel images",
+        description="""
+            Save the Docker images for a Linux build to a directory, and load
+            them from there, e.g. on a CI runner without registry access.
+        """,
+    )
+    subparsers = parser.add_subparsers(dest="command")
+    save_parser = subparsers.add_parser(
+        "save",
+        help="""
+            Save the images used by the build that the rest of the arguments
+            (e.g. --archs, --config-file, package_dir) select.
+        """,
+    )
+    save_parser.add_argument("directory", type=Path)
+    load_parser = subparsers.add_parser("load", help="Load the images saved in a directory.")
+    load_parser.add_argument("directory", type=Path)
+
+    parsed_args, build_args = parser.parse_known_args(args)
+
+    if parsed_args.command is None or (parsed_args.command == "load" and build_args):
+        parser.print_usage(sys.stderr)
+        sys.exit(2)
+
+    return parsed_args, build_args
@@ -0,0 +1,82 @@
+"""
+A journal of the build identifiers that have been completed, kept in the
+output dir. Each line is a JSON record of an identifier and its wheels, and
+records are only ever appended, so a run that's interrupted leaves a valid
+journal behind. Passing --resume to the next run skips the identifiers that
+are already complete.
+"""
+
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Set
+
+from .transfer import hash_file
+
+JOURNAL_NAME = ".cibuildwheel-journal.jsonl"
+
+
+class Journal:
+    def __init__(self, output_dir: Path) -> None:
+        self.output_dir = output_dir
+        self.path = output_dir / JOURNAL_NAME
+        self._lock = threading.Lock()
+
+    def reset(self) -> None:
+        if self.path.exists():
+            self.path.unlink()
+
+    def record(self, identifier: str, wheels: List[Path]) -> None:
+        """
+        Records that `identifier` is complete, and that its wheels are in
+        the output dir.
+        """
+        record = {
+            "identifier": identifier,
+            "wheels": {wheel.name: hash_file(wheel) for wheel in wheels},
+            "time": time.time(),
+        }
+        line = json.dumps(record, sort_keys=True) + "\n"
+
+        with self._lock, self.path.open("a+b") as f:
+            # a run that was killed while writing a record leaves a partial
+            # line, which this record mustn't be joined onto
+            if f.seek(0, os.SEEK_END) > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    line = "\n" + line
+            f.write(line.encode("utf8"))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def completed_identifiers(self) -> Set[str]:
+        """
+        Returns the identifiers that the journal records as complete, and
+        whose wheels are still in the output dir, unchanged.
+        """
+        if not self.path.exists():
+            return set()
+
+        records: Dict[str, Dict[str, str]] = {}
+
+        with self.path.open(encoding="utf8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    records[record["identifier"]] = record["wheels"]
+                except (ValueError, KeyError, TypeError):
+                    # a partly-written line, from a run that was killed
+                    continue
+
+        return {
+            identifier
+            for identifier, wheels in records.items()
+            if wheels
+            and all(
+                (self.output_dir / name).is_file()
+                and hash_file(self.output_dir / name) == wheel_hash
+                for name, wheel_hash in wheels.items()
+            )
+        }
@@ -1,9 +1,31 @@
+import contextlib
+import functools
+import hashlib
+import json
+import os
+import shutil
 import subprocess
 import sys
+import tempfile
 import textwrap
+import threading
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor, as_completed
 from pathlib import Path, PurePath
-from typing import List, NamedTuple, Set
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Type,
+)
 
+from . import cache, daemon, images, journal, snapshots, transfer
 from .architecture import Architecture
 from .docker_container import DockerContainer
 from .logger import log
@@ -15,6 +37,7 @@ from .util import (
     get_build_verbosity_extra_flags,
     prepare_command,
     read_python_configs,
+    thread_redirected_stdout,
 )
 
 
@@ -47,6 +70,1091 @@ def get_python_configurations(
     ]
 
 
+class ContainerGroup(NamedTuple):
+    docker_image: str
+    simulate_32_bit: bool
+    configs: List[PythonConfiguration]
+
+    @property
+    def name(self) -> str:
+        """
+        A short, filename-safe description of the group, e.g.
+        'cp_manylinux_x86_64'.
+        """
+        parts: List[str] = []
+        for config in self.configs:
+            implementation = config.identifier[:2]
+            platform_tag = config.identifier.split("-", 1)[1]
+            part = f"{implementation}_{platform_tag}"
+            if part not in parts:
+                parts.append(part)
+        return "-".join(parts)
+
+
+def get_container_groups(
+    python_configurations: List[PythonConfiguration], manylinux_images: Dict[str, str]
+) -> List[ContainerGroup]:
+    """
+    Splits the configurations into groups, each of which is built in its own
+    Docker container. Configurations that resolve to the same image - e.g.
+    CPython and PyPy on x86_64, by default - share a container, so the
+    project is only copied in and before_all is only run once.
+    """
+    platforms = [
+        ("cp", "manylinux_x86_64", manylinux_images["x86_64"]),
+        ("cp", "manylinux_i686", manylinux_images["i686"]),
+        ("cp", "manylinux_aarch64", manylinux_images["aarch64"]),
+        ("cp", "manylinux_ppc64le", manylinux_images["ppc64le"]),
+        ("cp", "manylinux_s390x", manylinux_images["s390x"]),
+        ("pp", "manylinux_x86_64", manylinux_images["pypy_x86_64"]),
+        ("pp", "manylinux_aarch64", manylinux_images["pypy_aarch64"]),
+        ("pp", "manylinux_i686", manylinux_images["pypy_i686"]),
+    ]
+
+    # dicts are ordered, so the groups keep the order of the platforms above
+    container_groups: Dict[Tuple[str, bool], ContainerGroup] = {}
+
+    for implementation, platform_tag, docker_image in platforms:
+        platform_configs = [
+            c
+            for c in python_configurations
+            if c.identifier.startswith(implementation) and c.identifier.endswith(platform_tag)
+        ]
+        if not platform_configs:
+            continue
+
+        simulate_32_bit = platform_tag.endswith("i686")
+        key = (docker_image, simulate_32_bit)
+
+        if key not in container_groups:
+            container_groups[key] = ContainerGroup(
+                docker_image=docker_image,
+                simulate_32_bit=simulate_32_bit,
+                configs=[],
+            )
+
+        container_groups[key].configs.extend(platform_configs)
+
+    return list(container_groups.values())
+
+
+def build_identifier(
+    options: BuildOptions,
+    config: PythonConfiguration,
+    docker: DockerContainer,
+    container_project_path: PurePath,
+    container_package_dir: PurePath,
+) -> List[Path]:
+    """
+    Builds, repairs and tests the wheel for one configuration, and copies it
+    to the output dir. Returns the paths of the wheels in the output dir.
+    """
+    log.build_start(config.identifier)
+
+    # each identifier has its own scratch directory, so builds can share a container
+    temp_dir = PurePath("/tmp/cibuildwheel") / config.identifier
+    built_wheel_dir = temp_dir / "built_wheel"
+    repaired_wheel_dir = temp_dir / "repaired_wheel"
+    docker.remove(temp_dir)
+    docker.make_dirs(built_wheel_dir)
+    docker.make_dirs(repaired_wheel_dir)
+
+    dependency_constraint_flags: List[PathOrStr] = []
+
+    if options.dependency_constraints:
+        constraints_file = options.dependency_constraints.get_for_python_version(config.version)
+        container_constraints_file = temp_dir / "constraints.txt"
+
+        docker.copy_into(constraints_file, container_constraints_file)
+        dependency_constraint_flags = ["-c", container_constraints_file]
+
+    log.step("Setting up build environment...")
+
+    env = docker.get_environment()
+
+    # put this config's python top of the list
+    python_bin = config.path / "bin"
+    env["PATH"] = f'{python_bin}:{env["PATH"]}'
+
+    env = options.environment.as_dictionary(env, executor=docker.environment_executor)
+
+    # check config python is still on PATH
+    which_python = docker.which("python", env=env)
+    if which_python != python_bin / "python":
+        print(
+            "cibuildwheel: python available on PATH doesn't match our installed instance. If you have modified PATH, ensure that you don't overwrite cibuildwheel's entry or insert python above it.",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+    which_pip = docker.which("pip", env=env)
+    if which_pip != python_bin / "pip":
+        print(
+            "cibuildwheel: pip available on PATH doesn't match our installed instance. If you have modified PATH, ensure that you don't overwrite cibuildwheel's entry or insert pip above it.",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+    if options.before_build:
+        log.step("Running before_build...")
+        before_build_prepared = prepare_command(
+            options.before_build,
+            project=container_project_path,
+            package=container_package_dir,
+        )
+        docker.call(["sh", "-c", before_build_prepared], env=env)
+
+    log.step("Building wheel...")
+
+    verbosity_flags = get_build_verbosity_extra_flags(options.build_verbosity)
+
+    if options.build_frontend == "pip":
+        docker.call(
+            [
+                "python",
+                "-m",
+                "pip",
+                "wheel",
+                container_package_dir,
+                f"--wheel-dir={built_wheel_dir}",
+                "--no-deps",
+                *verbosity_flags,
+            ],
+            env=env,
+        )
+    elif options.build_frontend == "build":
+        config_setting = " ".join(verbosity_flags)
+        docker.call(
+            [
+                "python",
+                "-m",
+                "build",
+                container_package_dir,
+                "--wheel",
+                f"--outdir={built_wheel_dir}",
+                f"--config-setting={config_setting}",
+            ],
+            env=env,
+        )
+    else:
+        assert_never(options.build_frontend)
+
+    built_wheel = docker.glob(built_wheel_dir, "*.whl")[0]
+
+    if built_wheel.name.endswith("none-any.whl"):
+        raise NonPlatformWheelError()
+
+    if options.repair_command:
+        log.step("Repairing wheel...")
+        repair_command_prepared = prepare_command(
+            options.repair_command, wheel=built_wheel, dest_dir=repaired_wheel_dir
+        )
+        docker.call(["sh", "-c", repair_command_prepared], env=env)
+    else:
+        docker.call(["mv", built_wheel, repaired_wheel_dir])
+
+    repaired_wheels = docker.glob(repaired_wheel_dir, "*.whl")
+
+    if options.test_command and options.test_selector(config.identifier):
+        log.step("Testing wheel...")
+
+        # set up a virtual environment to install and test from, to make sure
+        # there are no dependencies that were pulled in at build time.
+        venv_dir = docker.make_temp_dir() / "venv"
+        docker.call_many(
+            [
+                ["pip", "install", "virtualenv", *dependency_constraint_flags],
+                ["python", "-m", "virtualenv", "--no-download", venv_dir],
+            ],
+            env=env,
+        )
+
+        virtualenv_env = env.copy()
+        virtualenv_env["PATH"] = f"{venv_dir / 'bin'}:{virtualenv_env['PATH']}"
+
+        if options.before_test:
+            before_test_prepared = prepare_command(
+                options.before_test,
+                project=container_project_path,
+                package=container_package_dir,
+            )
+            docker.call(["sh", "-c", before_test_prepared], env=virtualenv_env)
+
+        # Install the wheel we just built
+        # Note: If auditwheel produced two wheels, it's because the earlier produced wheel
+        # conforms to multiple manylinux standards. These multiple versions of the wheel are
+        # functionally the same, differing only in name, wheel metadata, and possibly include
+        # different external shared libraries. so it doesn't matter which one we run the tests on.
+        # Let's just pick the first one.
+        wheel_to_test = repaired_wheels[0]
+        docker.call(
+            ["pip", "install", str(wheel_to_test) + options.test_extras],
+            env=virtualenv_env,
+        )
+
+        # Install any requirements to run the tests
+        if options.test_requires:
+            docker.call(["pip", "install", *options.test_requires], env=virtualenv_env)
+
+        # Run the tests from a different directory
+        test_command_prepared = prepare_command(
+            options.test_command,
+            project=container_project_path,
+            package=container_package_dir,
+        )
+        docker.call(["sh", "-c", test_command_prepared], cwd="/root", env=virtualenv_env)
+
+        # clean up test environment
+        docker.remove(venv_dir)
+
+    # copy the wheels to the host straight away, so they're kept even if a
+    # later build fails
+    log.step("Copying wheel to host...")
+    options.output_dir.mkdir(parents=True, exist_ok=True)
+    output_wheels = []
+    for repaired_wheel in repaired_wheels:
+        output_wheel = options.output_dir / repaired_wheel.name
+        docker.copy_out_file(repaired_wheel, output_wheel)
+        output_wheels.append(output_wheel)
+
+    log.build_end()
+
+    return output_wheels
+
+
+def copy_project_into(
+    docker: DockerContainer,
+    project_archive: transfer.ProjectArchive,
+    container_project_path: PurePath,
+    *,
+    project_manifest: Optional[transfer.Manifest] = None,
+    project_volume: Optional[transfer.ProjectVolume] = None,
+) -> transfer.SyncResult:
+    """
+    Copies the project into `docker`. If the project has been copied into
+    the container before, `project_manifest` describes that copy, and only
+    the changes are sent. If `project_volume` is mounted in the container,
+    the project is copied from there.
+    """
+    log.step("Copying project into Docker...")
+    sync_result = transfer.sync_into(
+        docker,
+        project_archive,
+        container_project_path,
+        previous=project_manifest,
+        volume=project_volume,
+    )
+    if project_manifest is not None:
+        print(
+            f"Sent {len(sync_result.sent)} changed paths ({sync_result.sent_bytes / 1e6:.1f} MB), "
+            f"deleted {len(sync_result.deleted)}"
+        )
+    if sync_result.stats is not None:
+        print(f"Transferred {sync_result.stats}")
+
+    return sync_result
+
+
+def build_on_docker(
+    options: BuildOptions,
+    platform_configs: List[PythonConfiguration],
+    docker: DockerContainer,
+    container_project_path: PurePath,
+    container_package_dir: PurePath,
+    *,
+    skip_before_all: bool = False,
+    snapshot_key: Optional[str] = None,
+    sync_result: Optional[transfer.SyncResult] = None,
+    on_built: Optional[Callable[[str, List[Path]], None]] = None,
+) -> None:
+    """
+    Builds the configurations in `docker`, which the project has already
+    been copied into, or mounted in. As each one finishes, its wheels are
+    copied to the output dir, and `on_built` is called with the identifier
+    and the paths of the wheels. `sync_result` is the result of copying the
+    project, if it was copied, and is saved in a before_all snapshot.
+    """
+
+    if options.before_all and not skip_before_all:
+        log.step("Running before_all...")
+
+        env = docker.get_environment()
+        env["PATH"] = f'/opt/python/cp38-cp38/bin:{env["PATH"]}'
+        env["PIP_DISABLE_PIP_VERSION_CHECK"] = "1"
+        env = options.environment.as_dictionary(env, executor=docker.environment_executor)
+
+        before_all_prepared = prepare_command(
+            options.before_all,
+            project=container_project_path,
+            package=container_package_dir,
+        )
+        docker.call(["sh", "-c", before_all_prepared], env=env)
+
+        if snapshot_key is not None:
+            log.step("Saving a snapshot of the container...")
+            assert docker.name is not None
+            if sync_result is not None:
+                transfer.save_manifest(docker, sync_result.manifest)
+            snapshot_image = snapshots.create_snapshot(
+                docker.name,
+                snapshot_key,
+                base_image=docker.docker_image,
+                simulate_32_bit=docker.simulate_32_bit,
+                project_dir=Path.cwd(),
+            )
+            print(f"Saved {snapshot_image}")
+
+    if options.container_jobs > 1 and len(platform_configs) > 1:
+        # build several identifiers at once, each in its own shell session
+        runner = ConcurrentRunner(options.container_jobs)
+
+        def build_in_session(config: PythonConfiguration) -> None:
+            with docker.session() as session, runner.track(session):
+                session_project_path, session_package_dir = copy_project_for_session(
+                    session, config.identifier, container_project_path, container_package_dir
+                )
+                wheels = build_identifier(
+                    options, config, session, session_project_path, session_package_dir
+                )
+                session.remove(session_project_path)
+            if on_built is not None:
+                on_built(config.identifier, wheels)
+
+        runner.run(
+            [
+                (config.identifier, functools.partial(build_in_session, config))
+                for config in platform_configs
+            ]
+        )
+    else:
+        for config in platform_configs:
+            wheels = build_identifier(
+                options, config, docker, container_project_path, container_package_dir
+            )
+            if on_built is not None:
+                on_built(config.identifier, wheels)
+
+
+def copy_project_for_session(
+    docker: DockerContainer,
+    identifier: str,
+    container_project_path: PurePath,
+    container_package_dir: PurePath,
+) -> Tuple[PurePath, PurePath]:
+    """
+    Copies the project, as before_all left it, to a directory of its own,
+    for a build that runs at the same time as others in the container.
+    setuptools stages wheels in `build/`, and writes `*.egg-info`, at paths
+    that don't depend on the Python version, so builds that share the
+    project directory would overwrite each other's files. Returns the
+    copy's project and package dirs.
+    """
+    session_project_path = PurePath("/tmp/cibuildwheel/projects") / identifier
+    docker.call_many(
+        [
+            ["rm", "-rf", session_project_path],
+            ["mkdir", "-p", session_project_path.parent],
+            ["cp", "-a", container_project_path, session_project_path],
+        ]
+    )
+    return (
+        session_project_path,
+        session_project_path / container_package_dir.relative_to(container_project_path),
+    )
+
+
+class ConcurrentRunner:
+    """
+    Runs tasks on a pool of threads. The output of each task is written to
+    its own log file, and printed once the task has finished. If a task
+    fails, tasks that haven't started yet are cancelled and the containers
+    of running tasks are killed, then the error is raised.
+    """
+
+    def __init__(self, jobs: int) -> None:
+        self.jobs = jobs
+        self.cancelled = threading.Event()
+        self._active_containers: List[DockerContainer] = []
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def track(self, docker: DockerContainer) -> Iterator[None]:
+        """
+        Registers a container, so it's killed if another task fails.
+        """
+        with self._lock:
+            if self.cancelled.is_set():
+                raise CancelledError()
+            self._active_containers.append(docker)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._active_containers.remove(docker)
+
+    def run(self, tasks: List[Tuple[str, Callable[[], None]]]) -> None:
+        """
+        Runs the tasks, each of which is a name and a function, and waits for
+        them to finish.
+        """
+        with thread_redirected_stdout() as stdout, tempfile.TemporaryDirectory(
+            prefix="cibuildwheel-logs-"
+        ) as log_dir:
+            first_error: Optional[BaseException] = None
+
+            def run_task(name: str, task: Callable[[], None], log_path: Path) -> None:
+                if self.cancelled.is_set():
+                    return
+
+                print(f"Running {name} in the background...")
+
+                with log_path.open("w", encoding="utf8", errors="surrogateescape") as log_file:
+                    with stdout.redirect(log_file):
+                        try:
+                            task()
+                        except BaseException:
+                            # the logger state belongs to this worker thread,
+                            # which might be reused for another task
+                            log.step_end(success=False)
+                            raise
+
+            with ThreadPoolExecutor(max_workers=min(self.jobs, len(tasks))) as executor:
+                futures = {
+                    executor.submit(run_task, name, task, Path(log_dir) / f"{name}.log"): name
+                    for name, task in tasks
+                }
+
+                for future in as_completed(futures):
+                    if future.cancelled():
+                        continue
+
+                    name = futures[future]
+                    log_path = Path(log_dir) / f"{name}.log"
+
+                    if log_path.exists():
+                        c = log.colors
+                        print(f"\n{c.bold}Output from {name}:{c.end}")
+                        with log_path.open("rb") as f:
+                            shutil.copyfileobj(f, sys.stdout.buffer)
+
+                    error = future.exception()
+                    if error is not None and first_error is None:
+                        first_error = error
+                        self.cancel()
+                        for other_future in futures:
+                            other_future.cancel()
+
+            if first_error is not None:
+                raise first_error
+
+    def cancel(self) -> None:
+        with self._lock:
+            self.cancelled.set()
+            for docker in self._active_containers:
+                docker.kill()
+
+
+def get_before_all_snapshot_key(options: BuildOptions, group: ContainerGroup) -> str:
+    # the environment is part of the key as configured, rather than as
+    # evaluated, so that it can be worked out before the container starts
+    return snapshots.snapshot_key(
+        image_id=snapshots.get_image_id(group.docker_image),
+        simulate_32_bit=group.simulate_32_bit,
+        before_all=options.before_all,
+        environment=repr(options.environment),
+        inputs_hash=snapshots.hash_input_files(Path.cwd(), options.before_all_inputs),
+    )
+
+
+def get_pool_setup_key(options: BuildOptions) -> str:
+    # warm containers keep whatever before_all installed, so they're only
+    # shared by builds that would install the same
+    setup = {"before_all": options.before_all, "environment": repr(options.environment)}
+    return hashlib.sha256(json.dumps(setup, sort_keys=True).encode("utf8")).hexdigest()
+
+
+class ContainerStart(NamedTuple):
+    docker: DockerContainer
+    mounted: bool
+    # whether the container was leased from the pool, and had been used
+    # before, so before_all has been run in it already
+    reused: bool
+
+
+def start_container(
+    stack: contextlib.ExitStack,
+    docker_image: str,
+    *,
+    simulate_32_bit: bool,
+    container_project_path: PurePath,
+    cpus: Optional[float],
+    mount_project: bool,
+    mounts: Sequence[str] = (),
+    container_pool: Optional[daemon.ContainerPool] = None,
+    pool_setup_key: str = "",
+) -> ContainerStart:
+    """
+    Starts a container with `mounts`, which is stopped when `stack` exits.
+    If `mount_project` is set, the project is mounted into the container, or
+    if that fails, the container is started without it. If `container_pool`
+    is given, and there's nothing to mount, a warm container is leased from
+    it instead, one that was used for this project and `pool_setup_key`,
+    and returned to it when `stack` exits. Returns the container, whether
+    the project was mounted, and whether it was a pooled container that
+    had been used before.
+    """
+    if container_pool is not None and not mount_project and not mounts:
+        name, reused = container_pool.lease(
+            docker_image,
+            simulate_32_bit=simulate_32_bit,
+            cpus=cpus,
+            project=str(Path.cwd()),
+            setup=pool_setup_key,
+        )
+
+        def release_container(exc_type: Optional[Type[BaseException]], *exc_details: Any) -> None:
+            # a container whose build failed might be in any state
+            container_pool.release(
+                name,
+                reset_paths=[
+                    PurePath("/tmp/cibuildwheel"),
+                    container_project_path,
+                    transfer.MANIFEST_PATH,
+                ],
+                reuse=exc_type is None,
+            )
+
+        stack.push(release_container)
+        subprocess.run(
+            ["docker", "exec", name, "mkdir", "-p", str(container_project_path)], check=True
+        )
+        docker = stack.enter_context(
+            DockerContainer(
+                docker_image,
+                simulate_32_bit=simulate_32_bit,
+                cwd=container_project_path,
+                attach_to=name,
+            )
+        )
+        return ContainerStart(docker, mounted=False, reused=reused)
+
+    if mount_project:
+        try:
+            with contextlib.ExitStack() as mount_stack:
+                project_mount = mount_stack.enter_context(
+                    transfer.ProjectMount(Path.cwd(), cleanup_image=docker_image)
+                )
+                docker = mount_stack.enter_context(
+                    DockerContainer(
+                        docker_image,
+                        simulate_32_bit=simulate_32_bit,
+                        cwd=container_project_path,
+                        cpus=cpus,
+                        mounts=[project_mount.mount_arg(container_project_path), *mounts],
+                    )
+                )
+                stack.push(mount_stack.pop_all())
+                return ContainerStart(docker, mounted=True, reused=False)
+        except (subprocess.CalledProcessError, OSError, ValueError) as error:
+            log.warning(
+                f"Failed to mount the project into Docker, it will be copied instead. {error}"
+            )
+
+    docker = stack.enter_context(
+        DockerContainer(
+            docker_image,
+            simulate_32_bit=simulate_32_bit,
+            cwd=container_project_path,
+            cpus=cpus,
+            mounts=mounts,
+        )
+    )
+    return ContainerStart(docker, mounted=False, reused=False)
+
+
+class GroupContainer(NamedTuple):
+    docker: DockerContainer
+    skip_before_all: bool
+    snapshot_key: Optional[str]
+    sync_result: Optional[transfer.SyncResult]
+
+
+def start_group_container(
+    stack: contextlib.ExitStack,
+    options: BuildOptions,
+    group: ContainerGroup,
+    container_project_path: PurePath,
+    project_archive: transfer.ProjectArchive,
+    *,
+    cpus: Optional[float] = None,
+    runner: Optional["ConcurrentRunner"] = None,
+    project_volume: Optional[transfer.ProjectVolume] = None,
+    image_puller: Optional[images.ImagePuller] = None,
+    container_pool: Optional[daemon.ContainerPool] = None,
+) -> GroupContainer:
+    """
+    Starts a container for `group`, which is stopped when `stack` exits,
+    and copies the project into it, unless it's mounted. If there's a
+    before_all snapshot, the container is started from it. If a runner is
+    given, the container is tracked by it. If `project_volume` is given,
+    it's mounted into the container, and the project is copied from it. If
+    `image_puller` is pulling the group's image, that's waited for first.
+    If `container_pool` is given, the container is leased from it, and
+    if it was used before, with the same before_all, that's skipped.
+    """
+    if image_puller is not None:
+        image_puller.wait(group.docker_image)
+
+    docker_image = group.docker_image
+    snapshot_key = None
+    skip_before_all = False
+
+    if options.before_all and options.before_all_snapshot:
+        snapshot_key = get_before_all_snapshot_key(options, group)
+        snapshot_image = snapshots.find_snapshot(snapshot_key)
+        if snapshot_image is not None:
+            print(f"Found a before_all snapshot for {group.docker_image}, skipping before_all")
+            docker_image = snapshot_image
+            snapshot_key = None
+            skip_before_all = True
+
+    log.step(f"Starting Docker image {docker_image}...")
+    docker, mounted, reused = start_container(
+        stack,
+        docker_image,
+        simulate_32_bit=group.simulate_32_bit,
+        container_project_path=container_project_path,
+        cpus=cpus,
+        mount_project=options.project_transfer == "mount",
+        mounts=[project_volume.mount_arg(docker_image)] if project_volume else [],
+        container_pool=container_pool,
+        pool_setup_key=get_pool_setup_key(options),
+    )
+    if runner is not None:
+        stack.enter_context(runner.track(docker))
+
+    from_snapshot = skip_before_all
+    if reused and options.before_all:
+        print("The warm container has run before_all already, skipping before_all")
+        skip_before_all = True
+
+    sync_result = None
+    if not mounted:
+        # the project was copied into the snapshot, so only send the changes
+        project_manifest = transfer.load_manifest(docker) if from_snapshot else None
+        sync_result = copy_project_into(
+            docker,
+            project_archive,
+            container_project_path,
+            project_manifest=project_manifest,
+            project_volume=project_volume,
+        )
+
+    return GroupContainer(
+        docker=docker,
+        skip_before_all=skip_before_all,
+        snapshot_key=snapshot_key,
+        sync_result=sync_result,
+    )
+
+
+def build_group(
+    options: BuildOptions,
+    group: ContainerGroup,
+    container_project_path: PurePath,
+    container_package_dir: PurePath,
+    project_archive: transfer.ProjectArchive,
+    *,
+    cpus: Optional[float] = None,
+    runner: Optional["ConcurrentRunner"] = None,
+    on_built: Optional[Callable[[str, List[Path]], None]] = None,
+    project_volume: Optional[transfer.ProjectVolume] = None,
+    image_puller: Optional[images.ImagePuller] = None,
+    container_pool: Optional[daemon.ContainerPool] = None,
+) -> None:
+    """
+    Starts a container for `group`, and builds its configurations in it. If
+    a runner is given, the container is tracked by it. `on_built` is called
+    with each identifier and the paths of its wheels in the output dir. If
+    `project_volume` is given, it's mounted into the container, and the
+    project is copied from it. If `image_puller` is given, the group's image
+    is waited for before the container is started. If `container_pool` is
+    given, the container is leased from it.
+    """
+    with contextlib.ExitStack() as stack:
+        container = start_group_container(
+            stack,
+            options,
+            group,
+            container_project_path,
+            project_archive,
+            cpus=cpus,
+            runner=runner,
+            project_volume=project_volume,
+            image_puller=image_puller,
+            container_pool=container_pool,
+        )
+        build_on_docker(
+            options,
+            group.configs,
+            container.docker,
+            container_project_path,
+            container_package_dir,
+            skip_before_all=container.skip_before_all,
+            snapshot_key=container.snapshot_key,
+            sync_result=container.sync_result,
+            on_built=on_built,
+        )
+
+
+# a started GroupContainer, and the stack that stops it
+StartedContainer = Tuple[GroupContainer, contextlib.ExitStack]
+
+
+def build_pipelined(
+    options: BuildOptions,
+    container_groups: List[ContainerGroup],
+    container_project_path: PurePath,
+    container_package_dir: PurePath,
+    project_archive: transfer.ProjectArchive,
+    *,
+    on_built: Optional[Callable[[str, List[Path]], None]] = None,
+    project_volume: Optional[transfer.ProjectVolume] = None,
+    image_puller: Optional[images.ImagePuller] = None,
+    container_pool: Optional[daemon.ContainerPool] = None,
+) -> None:
+    """
+    Builds the container groups one after another. While a group builds,
+    the container for the next group is started, and the project copied
+    into it, on a background thread. The output of that is printed when the
+    next group's build begins. Containers are stopped and removed in the
+    background, too.
+    """
+
+    def start(group: ContainerGroup) -> StartedContainer:
+        with contextlib.ExitStack() as stack:
+            try:
+                container = start_group_container(
+                    stack,
+                    options,
+                    group,
+                    container_project_path,
+                    project_archive,
+                    project_volume=project_volume,
+                    image_puller=image_puller,
+                    container_pool=container_pool,
+                )
+            except BaseException:
+                log.step_end(success=False)
+                raise
+            log.step_end()
+            return container, stack.pop_all()
+
+    with thread_redirected_stdout() as stdout, tempfile.TemporaryDirectory(
+        prefix="cibuildwheel-logs-"
+    ) as log_dir, ThreadPoolExecutor(max_workers=2) as executor:
+
+        def start_in_background(index: int) -> "Future[StartedContainer]":
+            def start_with_log() -> StartedContainer:
+                log_path = Path(log_dir) / f"{index}.log"
+                with log_path.open("w", encoding="utf8", errors="surrogateescape") as log_file:
+                    with stdout.redirect(log_file):
+                        return start(container_groups[index])
+
+            return executor.submit(start_with_log)
+
+        def print_background_log(index: int) -> None:
+            log_path = Path(log_dir) / f"{index}.log"
+            if log_path.exists():
+                with log_path.open("rb") as f:
+                    shutil.copyfileobj(f, sys.stdout.buffer)
+
+        # nothing else is running yet, so the first container is started in
+        # the foreground
+        started = start(container_groups[0])
+        next_started: Optional["Future[StartedContainer]"] = None
+
+        try:
+            for index, group in enumerate(container_groups):
+                if next_started is not None:
+                    future, next_started = next_started, None
+                    try:
+                        started = future.result()
+                    finally:
+                        print_background_log(index)
+
+                container, container_stack = started
+
+                try:
+                    if index + 1 < len(container_groups):
+                        next_started = start_in_background(index + 1)
+
+                    build_on_docker(
+                        options,
+                        group.configs,
+                        container.docker,
+                        container_project_path,
+                        container_package_dir,
+                        skip_before_all=container.skip_before_all,
+                        snapshot_key=container.snapshot_key,
+                        sync_result=container.sync_result,
+                        on_built=on_built,
+                    )
+                except BaseException as error:
+                    # the stack is told about the failure, so that a pooled
+                    # container isn't reused
+                    executor.submit(
+                        container_stack.__exit__, type(error), error, error.__traceback__
+                    )
+                    raise
+                else:
+                    executor.submit(container_stack.close)
+        finally:
+            if next_started is not None and not next_started.cancel():
+                # a build failed, so the next container isn't needed
+                next_started.add_done_callback(stop_started_container)
+
+
+def stop_started_container(future: "Future[StartedContainer]") -> None:
+    if future.exception() is None:
+        _, container_stack = future.result()
+        container_stack.close()
+
+
+def build_concurrently(
+    options: BuildOptions,
+    container_groups: List[ContainerGroup],
+    container_project_path: PurePath,
+    container_package_dir: PurePath,
+    project_archive: transfer.ProjectArchive,
+    *,
+    on_built: Optional[Callable[[str, List[Path]], None]] = None,
+    project_volume: Optional[transfer.ProjectVolume] = None,
+    image_puller: Optional[images.ImagePuller] = None,
+    container_pool: Optional[daemon.ContainerPool] = None,
+) -> None:
+    """
+    Builds each container group on its own thread, up to `options.jobs` at a
+    time. The containers all share `project_archive` and `project_volume`.
+    """
+    runner = ConcurrentRunner(options.jobs)
+
+    # share the docker host's CPUs between the containers
+    cpus = get_docker_cpu_count() / min(options.jobs, len(container_groups))
+    print(f"Building {len(container_groups)} container groups, with {cpus:.2f} CPUs each...")
+
+    runner.run(
+        [
+            (
+                group.name,
+                functools.partial(
+                    build_group,
+                    options,
+                    group,
+                    container_project_path,
+                    container_package_dir,
+                    project_archive,
+                    cpus=cpus,
+                    runner=runner,
+                    on_built=on_built,
+                    project_volume=project_volume,
+                    image_puller=image_puller,
+                    container_pool=container_pool,
+                ),
+            )
+            for group in container_groups
+        ]
+    )
+
+
+def get_project_filter(options: BuildOptions) -> transfer.ProjectFilter:
+    """
+    Returns the filter for the files in the project that are copied into
+    containers. The output dir and the wheel cache are never copied.
+    """
+    exclude_dirs = [options.output_dir]
+    if options.cache_dir is not None:
+        exclude_dirs.append(options.cache_dir)
+    return transfer.ProjectFilter(Path.cwd(), options.project_files, exclude_dirs=exclude_dirs)
+
+
+def get_wheel_cache_key(
+    options: BuildOptions, config: PythonConfiguration, image_id: str, project_fingerprint: str
+) -> str:
+    constraints = None
+    if options.dependency_constraints:
+        constraints_file = options.dependency_constraints.get_for_python_version(config.version)
+        constraints = constraints_file.read_text(encoding="utf8")
+
+    test_options = None
+    if options.test_command and options.test_selector(config.identifier):
+        test_options = repr(
+            (options.test_command, options.before_test, options.test_requires, options.test_extras)
+        )
+
+    # like the before_all snapshot key, this uses the environment as
+    # configured, so that it can be worked out before the container starts
+    return cache.cache_key(
+        project=project_fingerprint,
+        identifier=config.identifier,
+        image_id=image_id,
+        environment=repr(options.environment),
+        build_frontend=options.build_frontend,
+        constraints=constraints,
+        package_dir=str(options.package_dir.resolve().relative_to(Path.cwd())),
+        before_all=options.before_all,
+        before_build=options.before_build,
+        repair_command=options.repair_command,
+        test=test_options,
+    )
+
+
+def use_cached_wheels(
+    options: BuildOptions,
+    wheel_cache: cache.WheelCache,
+    container_groups: List[ContainerGroup],
+    project_archive: transfer.ProjectArchive,
+    *,
+    on_cached: Optional[Callable[[str, List[Path]], None]] = None,
+) -> Tuple[List[ContainerGroup], Dict[str, str]]:
+    """
+    Copies the wheels that are in the cache to the output dir, calling
+    `on_cached` for each identifier. Returns the container groups with the
+    cached configurations removed - groups where every configuration was
+    cached are dropped - and the cache key of each configuration that still
+    has to be built. Images are only pulled if their registry digest can't
+    be found without pulling them.
+    """
+    log.step("Checking the wheel cache...")
+    # the fingerprint covers exactly what's copied into the containers, and
+    # the archive made for it is reused to copy the project
+    project_fingerprint = cache.fingerprint_manifest(
+        project_archive.manifest(), cache.get_git_state(Path.cwd())
+    )
+
+    image_keys: Dict[str, str] = {}
+    cache_keys = {}
+    for group in container_groups:
+        if group.docker_image not in image_keys:
+            # a full cache hit shouldn't need the image, so it's keyed on its
+            # registry digest, which is the same on every machine
+            image_key = images.get_image_digest(group.docker_image)
+            if image_key is None:
+                # the registry couldn't be asked, so the image is pulled,
+                # after which it has a digest, unless it was built locally
+                image_id = snapshots.get_image_id(group.docker_image)
+                image_key = images.get_image_digest(group.docker_image) or image_id
+            image_keys[group.docker_image] = image_key
+        for config in group.configs:
+            cache_keys[config.identifier] = get_wheel_cache_key(
+                options, config, image_keys[group.docker_image], project_fingerprint
+            )
+
+    wheel_cache.fetch({key: identifier for identifier, key in cache_keys.items()})
+
+    remaining_groups = []
+
+    for group in container_groups:
+        remaining_configs = []
+
+        for config in group.configs:
+            cached_wheels = wheel_cache.get(cache_keys[config.identifier], config.identifier)
+
+            if cached_wheels is None:
+                remaining_configs.append(config)
+            else:
+                print(f"Using cached wheels for {config.identifier}")
+                wheel_paths = wheel_cache.copy_to(cached_wheels, options.output_dir)
+                del cache_keys[config.identifier]
+                if on_cached is not None:
+                    on_cached(config.identifier, wheel_paths)
+
+        if remaining_configs:
+            remaining_groups.append(group._replace(configs=remaining_configs))
+
+    log.step_end()
+
+    return remaining_groups, cache_keys
+
+
+@contextlib.contextmanager
+def open_wheel_cache(options: BuildOptions) -> Iterator[Optional[cache.WheelCache]]:
+    """
+    Yields the wheel cache configured in `options`, or None if there isn't
+    one. Waits for uploads to the remote cache to finish on exit.
+    """
+    if options.cache_dir is None and options.cache_url is None:
+        yield None
+        return
+
+    with contextlib.ExitStack() as stack:
+        cache_dir = options.cache_dir
+        if cache_dir is None:
+            # with only a remote cache, keep the local entries for this run only
+            cache_dir = Path(
+                stack.enter_context(tempfile.TemporaryDirectory(prefix="cibuildwheel-cache-"))
+            )
+
+        remote = None
+        if options.cache_url is not None:
+            remote = cache.RemoteCache(options.cache_url, token=os.environ.get("CIBW_CACHE_TOKEN"))
+
+        wheel_cache = cache.WheelCache(cache_dir, max_size=options.cache_max_size, remote=remote)
+        stack.callback(wheel_cache.close)
+
+        yield wheel_cache
+
+
+def print_wheel_cache_summary(wheel_cache: cache.WheelCache) -> None:
+    wheel_cache.wait_for_uploads()
+    summary = wheel_cache.summary()
+    print(
+        f"\nWheel cache: {len(summary['hits'])} hits "
+        f"({len(summary['remote_hits'])} from the remote cache), {len(summary['misses'])} misses",
+        *(f"  hit:  {identifier}" for identifier in summary["hits"]),
+        *(f"  miss: {identifier}" for identifier in summary["misses"]),
+        sep="\n",
+    )
+    if summary["uploads"]:
+        print(f"Uploaded {len(summary['uploads'])} entries to the remote cache")
+
+    evicted = wheel_cache.evict()
+    if evicted:
+        print(f"Evicted {len(evicted)} old entries from the wheel cache")
+
+
+def skip_identifiers(
+    container_groups: List[ContainerGroup], identifiers: Set[str]
+) -> List[ContainerGroup]:
+    """
+    Returns the container groups without the configurations for
+    `identifiers`. Groups that are left empty are dropped.
+    """
+    remaining_groups = []
+    for group in container_groups:
+        configs = [c for c in group.configs if c.identifier not in identifiers]
+        if configs:
+            remaining_groups.append(group._replace(configs=configs))
+    return remaining_groups
+
+
+def get_docker_cpu_count() -> int:
+    """
+    Returns the number of CPUs available to the Docker daemon, which might be
+    on a different machine.
+    """
+    try:
+        ncpu = subprocess.run(
+            ["docker", "info", "--format", "{{.NCPU}}"],
+            check=True,
+            stdout=subprocess.PIPE,
+            universal_newlines=True,
+        ).stdout
+        return int(ncpu.strip())
+    except (subprocess.CalledProcessError, ValueError):
+        return os.cpu_count() or 1
+
+
 def build(options: BuildOptions) -> None:
     try:
         # check docker is installed
@@ -62,16 +1170,7 @@ def build(options: BuildOptions) -> None:
 
     assert options.manylinux_images is not None
     python_configurations = get_python_configurations(options.build_selector, options.architectures)
-    platforms = [
-        ("cp", "manylinux_x86_64", options.manylinux_images["x86_64"]),
-        ("cp", "manylinux_i686", options.manylinux_images["i686"]),
-        ("cp", "manylinux_aarch64", options.manylinux_images["aarch64"]),
-        ("cp", "manylinux_ppc64le", options.manylinux_images["ppc64le"]),
-        ("cp", "manylinux_s390x", options.manylinux_images["s390x"]),
-        ("pp", "manylinux_x86_64", options.manylinux_images["pypy_x86_64"]),
-        ("pp", "manylinux_aarch64", options.manylinux_images["pypy_aarch64"]),
-        ("pp", "manylinux_i686", options.manylinux_images["pypy_i686"]),
-    ]
+    container_groups = get_container_groups(python_configurations, options.manylinux_images)
 
     cwd = Path.cwd()
     abs_package_dir = options.package_dir.resolve()
@@ -80,228 +1179,103 @@ def build(options: BuildOptions) -> None:
 
     container_project_path = PurePath("/project")
     container_package_dir = container_project_path / abs_package_dir.relative_to(cwd)
-    container_output_dir = PurePath("/output")
-
-    for implementation, platform_tag, docker_image in platforms:
-        platform_configs = [
-            c
-            for c in python_configurations
-            if c.identifier.startswith(implementation) and c.identifier.endswith(platform_tag)
-        ]
-        if not platform_configs:
-            continue
 
-        try:
-            log.step(f"Starting Docker image {docker_image}...")
-            with DockerContainer(
-                docker_image,
-                simulate_32_bit=platform_tag.endswith("i686"),
-                cwd=container_project_path,
-            ) as docker:
-
-                log.step("Copying project into Docker...")
-                docker.copy_into(Path.cwd(), container_project_path)
-
-                if options.before_all:
-                    log.step("Running before_all...")
-
-                    env = docker.get_environment()
-                    env["PATH"] = f'/opt/python/cp38-cp38/bin:{env["PATH"]}'
-                    env["PIP_DISABLE_PIP_VERSION_CHECK"] = "1"
-                    env = options.environment.as_dictionary(
-                        env, executor=docker.environment_executor
-                    )
+    if options.project_transfer == "mount" and not transfer.can_mount_project():
+        log.warning(
+            "project-transfer is set to mount, but the project can only be mounted when "
+            "the Docker daemon runs locally, on Linux. It will be copied instead."
+        )
+        options = options._replace(project_transfer="copy")
 
-                    before_all_prepared = prepare_command(
-                        options.before_all,
-                        project=container_project_path,
-                        package=container_package_dir,
-                    )
-                    docker.call(["sh", "-c", before_all_prepared], env=env)
+    build_journal = journal.Journal(options.output_dir)
 
-                for config in platform_configs:
-                    log.build_start(config.identifier)
+    if options.resume:
+        completed_identifiers = build_journal.completed_identifiers()
+        container_groups = skip_identifiers(container_groups, completed_identifiers)
+        if completed_identifiers:
+            print(
+                f"Resuming: skipping {len(completed_identifiers)} identifiers completed by a "
+                f"previous run: {', '.join(sorted(completed_identifiers))}"
+            )
+    else:
+        build_journal.reset()
 
-                    dependency_constraint_flags: List[PathOrStr] = []
+    cache_keys: Dict[str, str] = {}
 
-                    if options.dependency_constraints:
-                        constraints_file = options.dependency_constraints.get_for_python_version(
-                            config.version
-                        )
-                        container_constraints_file = PurePath("/constraints.txt")
+    with contextlib.ExitStack() as stack:
+        wheel_cache = stack.enter_context(open_wheel_cache(options))
+        project_archive = stack.enter_context(
+            transfer.ProjectArchive(Path.cwd(), get_project_filter(options))
+        )
+        project_volume = None
+        if options.project_transfer == "volume":
+            project_volume = stack.enter_context(transfer.ProjectVolume(project_archive))
 
-                        docker.copy_into(constraints_file, container_constraints_file)
-                        dependency_constraint_flags = ["-c", container_constraints_file]
+        # warm containers are only used when the project is copied, and
+        # before_all isn't snapshotted, since snapshots of them would keep
+        # the pool's labels. Nor are they used with the wheel cache, whose
+        # keys assume the build started from a clean image
+        container_pool = None
+        if (
+            options.project_transfer == "copy"
+            and not (options.before_all and options.before_all_snapshot)
+            and wheel_cache is None
+        ):
+            container_pool = daemon.ContainerPool.find_running()
+            if container_pool is not None:
+                print(
+                    f"Using warm containers from the cibuildwheel daemon, in {container_pool.state_dir}"
+                )
 
-                    log.step("Setting up build environment...")
+        def on_built(identifier: str, wheel_paths: List[Path]) -> None:
+            if wheel_cache is not None and identifier in cache_keys:
+                wheel_cache.put(cache_keys[identifier], identifier, wheel_paths)
+            build_journal.record(identifier, wheel_paths)
 
-                    env = docker.get_environment()
+        try:
+            if wheel_cache is not None:
+                container_groups, cache_keys = use_cached_wheels(
+                    options,
+                    wheel_cache,
+                    container_groups,
+                    project_archive,
+                    on_cached=build_journal.record,
+                )
 
-                    # put this config's python top of the list
-                    python_bin = config.path / "bin"
-                    env["PATH"] = f'{python_bin}:{env["PATH"]}'
+            # start pulling the images that are still needed straight away, so
+            # each is ready, or closer to it, by the time its group is built
+            docker_images = list(dict.fromkeys(group.docker_image for group in container_groups))
+            if docker_images:
+                print(f"Fetching {len(docker_images)} Docker images in the background...")
+            image_puller = stack.enter_context(images.ImagePuller(docker_images))
 
-                    env = options.environment.as_dictionary(
-                        env, executor=docker.environment_executor
-                    )
+            if options.jobs > 1 and len(container_groups) > 1:
+                build_concurrently(
+                    options,
+                    container_groups,
+                    container_project_path,
+                    container_package_dir,
+                    project_archive,
+                    on_built=on_built,
+                    project_volume=project_volume,
+                    image_puller=image_puller,
+                    container_pool=container_pool,
+                )
+            elif container_groups:
+                build_pipelined(
+                    options,
+                    container_groups,
+                    container_project_path,
+                    container_package_dir,
+                    project_archive,
+                    on_built=on_built,
+                    project_volume=project_volume,
+                    image_puller=image_puller,
+                    container_pool=container_pool,
+                )
 
-                    # check config python is still on PATH
-                    which_python = docker.call(
-                        ["which", "python"], env=env, capture_output=True
-                    ).strip()
-                    if PurePath(which_python) != python_bin / "python":
-                        print(
-                            "cibuildwheel: python available on PATH doesn't match our installed instance. If you have modified PATH, ensure that you don't overwrite cibuildwheel's entry or insert python above it.",
-                            file=sys.stderr,
-                        )
-                        sys.exit(1)
-
-                    which_pip = docker.call(["which", "pip"], env=env, capture_output=True).strip()
-                    if PurePath(which_pip) != python_bin / "pip":
-                        print(
-                            "cibuildwheel: pip available on PATH doesn't match our installed instance. If you have modified PATH, ensure that you don't overwrite cibuildwheel's entry or insert pip above it.",
-                            file=sys.stderr,
-                        )
-                        sys.exit(1)
-
-                    if options.before_build:
-                        log.step("Running before_build...")
-                        before_build_prepared = prepare_command(
-                            options.before_build,
-                            project=container_project_path,
-                            package=container_package_dir,
-                        )
-                        docker.call(["sh", "-c", before_build_prepared], env=env)
-
-                    log.step("Building wheel...")
-
-                    temp_dir = PurePath("/tmp/cibuildwheel")
-                    built_wheel_dir = temp_dir / "built_wheel"
-                    docker.call(["rm", "-rf", built_wheel_dir])
-                    docker.call(["mkdir", "-p", built_wheel_dir])
-
-                    verbosity_flags = get_build_verbosity_extra_flags(options.build_verbosity)
-
-                    if options.build_frontend == "pip":
-                        docker.call(
-                            [
-                                "python",
-                                "-m",
-                                "pip",
-                                "wheel",
-                                container_package_dir,
-                                f"--wheel-dir={built_wheel_dir}",
-                                "--no-deps",
-                                *verbosity_flags,
-                            ],
-                            env=env,
-                        )
-                    elif options.build_frontend == "build":
-                        config_setting = " ".join(verbosity_flags)
-                        docker.call(
-                            [
-                                "python",
-                                "-m",
-                                "build",
-                                container_package_dir,
-                                "--wheel",
-                                f"--outdir={built_wheel_dir}",
-                                f"--config-setting={config_setting}",
-                            ],
-                            env=env,
-                        )
-                    else:
-                        assert_never(options.build_frontend)
-
-                    built_wheel = docker.glob(built_wheel_dir, "*.whl")[0]
-
-                    repaired_wheel_dir = temp_dir / "repaired_wheel"
-                    docker.call(["rm", "-rf", repaired_wheel_dir])
-                    docker.call(["mkdir", "-p", repaired_wheel_dir])
-
-                    if built_wheel.name.endswith("none-any.whl"):
-                        raise NonPlatformWheelError()
-
-                    if options.repair_command:
-                        log.step("Repairing wheel...")
-                        repair_command_prepared = prepare_command(
-                            options.repair_command, wheel=built_wheel, dest_dir=repaired_wheel_dir
-                        )
-                        docker.call(["sh", "-c", repair_command_prepared], env=env)
-                    else:
-                        docker.call(["mv", built_wheel, repaired_wheel_dir])
-
-                    repaired_wheels = docker.glob(repaired_wheel_dir, "*.whl")
-
-                    if options.test_command and options.test_selector(config.identifier):
-                        log.step("Testing wheel...")
-
-                        # set up a virtual environment to install and test from, to make sure
-                        # there are no dependencies that were pulled in at build time.
-                        docker.call(
-                            ["pip", "install", "virtualenv", *dependency_constraint_flags], env=env
-                        )
-                        venv_dir = (
-                            PurePath(docker.call(["mktemp", "-d"], capture_output=True).strip())
-                            / "venv"
-                        )
-
-                        docker.call(
-                            ["python", "-m", "virtualenv", "--no-download", venv_dir], env=env
-                        )
-
-                        virtualenv_env = env.copy()
-                        virtualenv_env["PATH"] = f"{venv_dir / 'bin'}:{virtualenv_env['PATH']}"
-
-                        if options.before_test:
-                            before_test_prepared = prepare_command(
-                                options.before_test,
-                                project=container_project_path,
-                                package=container_package_dir,
-                            )
-                            docker.call(["sh", "-c", before_test_prepared], env=virtualenv_env)
-
-                        # Install the wheel we just built
-                        # Note: If auditwheel produced two wheels, it's because the earlier produced wheel
-                        # conforms to multiple manylinux standards. These multiple versions of the wheel are
-                        # functionally the same, differing only in name, wheel metadata, and possibly include
-                        # different external shared libraries. so it doesn't matter which one we run the tests on.
-                        # Let's just pick the first one.
-                        wheel_to_test = repaired_wheels[0]
-                        docker.call(
-                            ["pip", "install", str(wheel_to_test) + options.test_extras],
-                            env=virtualenv_env,
-                        )
-
-                        # Install any requirements to run the tests
-                        if options.test_requires:
-                            docker.call(
-                                ["pip", "install", *options.test_requires], env=virtualenv_env
-                            )
-
-                        # Run the tests from a different directory
-                        test_command_prepared = prepare_command(
-                            options.test_command,
-                            project=container_project_path,
-                            package=container_package_dir,
-                        )
-                        docker.call(
-                            ["sh", "-c", test_command_prepared], cwd="/root", env=virtualenv_env
-                        )
-
-                        # clean up test environment
-                        docker.call(["rm", "-rf", venv_dir])
-
-                    # move repaired wheels to output
-                    docker.call(["mkdir", "-p", container_output_dir])
-                    docker.call(["mv", *repaired_wheels, container_output_dir])
-
-                    log.build_end()
-
-                log.step("Copying wheels back to host...")
-                # copy the output back into the host
-                docker.copy_out(container_output_dir, options.output_dir)
-                log.step_end()
+            if wheel_cache is not None:
+                print_wheel_cache_summary(wheel_cache)
         except subprocess.CalledProcessError as error:
             log.step_end_with_error(
                 f"Command {error.cmd} failed with code {error.returncode}. {error.stdout}"
@@ -2,6 +2,7 @@ import codecs
 import os
 import re
 import sys
+import threading
 import time
 from typing import IO, AnyStr, Optional, Union
 
@@ -28,7 +29,9 @@ PLATFORM_IDENTIFIER_DESCIPTIONS = {
 }
 
 
-class Logger:
+# Logger is thread-local, so that builds running concurrently on different
+# threads each keep track of their own build and step timings.
+class Logger(threading.local):
     fold_mode: str
     colors_enabled: bool
     unicode_enabled: bool
@@ -0,0 +1,287 @@
+"""
+Planning of builds: estimating how long each build identifier takes, and
+splitting the identifiers into balanced shards, so that a build can be spread
+across several CI jobs.
+"""
+
+import json
+import platform as platform_module
+import re
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from . import linux, macos, windows
+from .architecture import Architecture
+from .typing import PlatformName, assert_never
+from .util import BuildSelector, TestSelector
+
+# estimated seconds to build and test one wheel natively, used for
+# identifiers that there are no recorded timings for
+DEFAULT_BUILD_COST = 60.0
+
+# roughly how many times slower a build is under emulation
+EMULATION_WEIGHT = 10.0
+
+# Linux architectures that are normally built under emulation. These don't
+# depend on the machine that's running cibuildwheel, so that every shard of a
+# build computes the same partition.
+EMULATED_ARCH_WEIGHTS = {
+    Architecture.aarch64: EMULATION_WEIGHT,
+    Architecture.ppc64le: EMULATION_WEIGHT,
+    Architecture.s390x: EMULATION_WEIGHT,
+}
+
+
+def parse_shard(shard_str: str) -> Tuple[int, int]:
+    """
+    Parses a shard specifier like '2/5' into (index, count), where index
+    counts from 1.
+
+    >>> parse_shard('2/5')
+    (2, 5)
+    """
+    match = re.fullmatch(r"\s*(\d+)\s*/\s*(\d+)\s*", shard_str)
+    if not match:
+        raise ValueError(f"Invalid shard {shard_str!r}, expected something like '1/4'")
+
+    index, count = int(match.group(1)), int(match.group(2))
+    if not 1 <= index <= count:
+        raise ValueError(f"Invalid shard {shard_str!r}, the index must be between 1 and {count}")
+
+    return index, count
+
+
+def read_timings(path: Path) -> Dict[str, float]:
+    """
+    Reads a JSON file mapping build identifiers to the number of seconds
+    their builds took.
+    """
+    with path.open(encoding="utf8") as f:
+        timings = json.load(f)
+
+    if not isinstance(timings, dict):
+        raise ValueError(f"{path} should contain a JSON object of identifier to seconds")
+
+    return {str(k): float(v) for k, v in timings.items()}
+
+
+def get_identifier_arch(identifier: str) -> Optional[Architecture]:
+    for arch in Architecture:
+        if identifier.endswith(f"_{arch.value}"):
+            return arch
+    return None
+
+
+def native_linux_archs() -> Set[Architecture]:
+    """
+    Returns the Linux architectures that this machine runs containers for
+    without emulation.
+    """
+    machine = platform_module.machine()
+    # Docker on Apple Silicon and Windows on ARM runs aarch64 natively
+    machine = {"arm64": "aarch64", "ARM64": "aarch64", "AMD64": "x86_64"}.get(machine, machine)
+
+    try:
+        native_arch = Architecture(machine)
+    except ValueError:
+        return set()
+
+    if native_arch == Architecture.x86_64:
+        # x86_64 machines can run i686 docker containers
+        return {Architecture.x86_64, Architecture.i686}
+    return {native_arch}
+
+
+def is_emulated(
+    platform: PlatformName, identifier: str, native_archs: Optional[Set[Architecture]] = None
+) -> bool:
+    """
+    Returns whether `identifier` is built under emulation, on a machine that
+    runs `native_archs` natively - by default, this one.
+    """
+    if platform != "linux":
+        return False
+    if native_archs is None:
+        native_archs = native_linux_archs()
+    arch = get_identifier_arch(identifier)
+    return arch is not None and arch not in native_archs
+
+
+def estimate_cost(
+    platform: PlatformName,
+    identifier: str,
+    timings: Optional[Dict[str, float]] = None,
+    *,
+    native_archs: Optional[Set[Architecture]] = None,
+) -> float:
+    """
+    Returns the estimated number of seconds to build `identifier`, from the
+    timings of previous builds if there are any, or the cost model if not.
+    If `native_archs` is given, emulation is judged against them, otherwise
+    against EMULATED_ARCH_WEIGHTS, which is the same on every machine.
+    """
+    if timings and identifier in timings:
+        return timings[identifier]
+
+    if native_archs is not None:
+        if is_emulated(platform, identifier, native_archs):
+            return DEFAULT_BUILD_COST * EMULATION_WEIGHT
+        return DEFAULT_BUILD_COST
+
+    arch = get_identifier_arch(identifier)
+    if platform == "linux" and arch in EMULATED_ARCH_WEIGHTS:
+        return DEFAULT_BUILD_COST * EMULATED_ARCH_WEIGHTS[arch]
+
+    return DEFAULT_BUILD_COST
+
+
+def get_build_groups(
+    platform: PlatformName,
+    build_selector: BuildSelector,
+    architectures: Set[Architecture],
+    manylinux_images: Optional[Dict[str, str]],
+) -> List[List[str]]:
+    """
+    Returns the selected build identifiers, grouped by the environment they
+    are built in. On Linux, each group shares a Docker container; on other
+    platforms, every identifier is its own group.
+    """
+    if platform == "linux":
+        assert manylinux_images is not None
+        configs = linux.get_python_configurations(build_selector, architectures)
+        container_groups = linux.get_container_groups(configs, manylinux_images)
+        return [[c.identifier for c in group.configs] for group in container_groups]
+    elif platform == "windows":
+        return [
+            [c.identifier] for c in windows.get_python_configurations(build_selector, architectures)
+        ]
+    elif platform == "macos":
+        return [
+            [c.identifier] for c in macos.get_python_configurations(build_selector, architectures)
+        ]
+    else:
+        assert_never(platform)
+
+
+def get_build_plan(
+    platform: PlatformName,
+    build_selector: BuildSelector,
+    architectures: Set[Architecture],
+    manylinux_images: Optional[Dict[str, str]],
+    *,
+    test_selector: Optional[TestSelector],
+    timings: Optional[Dict[str, float]] = None,
+    native_archs: Optional[Set[Architecture]] = None,
+) -> Dict[str, Any]:
+    """
+    Returns a description of the builds that would run, suitable for
+    dumping as JSON. `test_selector` should be None if there's no test
+    command. Only the options are used, so this is cheap to call. Whether
+    each build is emulated, and its estimate, depend on `native_archs`, the
+    architectures that run natively - by default, this machine's.
+    """
+    if native_archs is None:
+        native_archs = native_linux_archs()
+
+    identifiers = []
+    groups = []
+
+    if platform == "linux":
+        assert manylinux_images is not None
+        configs = linux.get_python_configurations(build_selector, architectures)
+        container_groups: List[Tuple[str, Optional[str], List[str]]] = [
+            (group.name, group.docker_image, [c.identifier for c in group.configs])
+            for group in linux.get_container_groups(configs, manylinux_images)
+        ]
+    else:
+        container_groups = [
+            (identifier, None, [identifier])
+            for group in get_build_groups(platform, build_selector, architectures, None)
+            for identifier in group
+        ]
+
+    for group_name, image, group_identifiers in container_groups:
+        group_cost = 0.0
+        for identifier in group_identifiers:
+            cost = estimate_cost(platform, identifier, timings, native_archs=native_archs)
+            group_cost += cost
+            identifiers.append(
+                {
+                    "identifier": identifier,
+                    "group": group_name,
+                    "image": image,
+                    "emulated": is_emulated(platform, identifier, native_archs),
+                    "test": test_selector is not None and test_selector(identifier),
+                    "estimated_seconds": cost,
+                }
+            )
+        groups.append(
+            {
+                "name": group_name,
+                "image": image,
+                "identifiers": group_identifiers,
+                "estimated_seconds": group_cost,
+            }
+        )
+
+    return {
+        "platform": platform,
+        "identifiers": identifiers,
+        "groups": groups,
+        "estimated_seconds": sum(g["estimated_seconds"] for g in groups),
+    }
+
+
+def split_into_shards(
+    groups: List[List[str]], costs: Dict[str, float], count: int
+) -> List[List[str]]:
+    """
+    Splits the groups of identifiers into `count` shards of roughly equal
+    cost. Groups are kept together where possible, so that each shard starts
+    as few containers as it can - a group is only split up if it would
+    unbalance the shards, or if there are fewer groups than shards. The
+    result only depends on the arguments, so every shard computes the same
+    partition.
+    """
+    order = {identifier: i for i, identifier in enumerate(i for g in groups for i in g)}
+
+    def unit_cost(unit: List[str]) -> float:
+        return sum(costs[i] for i in unit)
+
+    def sort_key(unit: List[str]) -> Tuple[float, int]:
+        return (-unit_cost(unit), order[unit[0]])
+
+    units = [list(g) for g in groups if g]
+    target = sum(unit_cost(u) for u in units) / count
+
+    while True:
+        splittable = sorted((u for u in units if len(u) > 1), key=sort_key)
+        if not splittable:
+            break
+        largest = splittable[0]
+        if unit_cost(largest) <= target and len(units) >= count:
+            break
+
+        # split the unit in two halves of about the same cost, keeping the
+        # identifiers in their original order
+        half_cost = unit_cost(largest) / 2
+        running_cost = 0.0
+        split_index = 1
+        for split_index in range(1, len(largest)):
+            running_cost += costs[largest[split_index - 1]]
+            if running_cost >= half_cost:
+                break
+
+        units.remove(largest)
+        units += [largest[:split_index], largest[split_index:]]
+
+    # longest processing time first: give each unit to the least-loaded shard
+    shards: List[List[str]] = [[] for _ in range(count)]
+    loads = [0.0] * count
+
+    for unit in sorted(units, key=sort_key):
+        shard_index = min(range(count), key=lambda s: (loads[s], s))
+        shards[shard_index] += unit
+        loads[shard_index] += unit_cost(unit)
+
+    return [sorted(shard, key=order.__getitem__) for shard in shards]
@@ -0,0 +1,80 @@
+# This script runs inside the build container, under the container's utility
+# python, for the lifetime of a DockerContainer. It answers filesystem and
+# environment queries, so that these don't each need a process to be started.
+#
+# Each request is a JSON object on a line of stdin, of the form
+# {"op": <name>, "args": {...}}. Each response is a JSON object on a line of
+# stdout, either {"result": <value>} or {"error": <message>}.
+
+import glob
+import json
+import os
+import shutil
+import sys
+import tempfile
+from typing import Any, Callable, Dict, List, Optional
+
+
+def op_glob(pattern: str) -> List[str]:
+    return glob.glob(pattern)
+
+
+def op_env() -> Dict[str, str]:
+    return dict(os.environ)
+
+
+def op_which(name: str, path: Optional[str] = None) -> Optional[str]:
+    return shutil.which(name, path=path)
+
+
+def op_mkdir(path: str) -> None:
+    os.makedirs(path, exist_ok=True)
+
+
+def op_rm(path: str) -> None:
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.unlink(path)
+
+
+def op_stat(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return {"size": st.st_size, "mtime": st.st_mtime, "mode": st.st_mode}
+
+
+def op_mktemp() -> str:
+    return tempfile.mkdtemp()
+
+
+OPS: Dict[str, Callable[..., Any]] = {
+    "glob": op_glob,
+    "env": op_env,
+    "which": op_which,
+    "mkdir": op_mkdir,
+    "rm": op_rm,
+    "stat": op_stat,
+    "mktemp": op_mktemp,
+}
+
+
+def main() -> None:
+    stdin = sys.stdin.buffer
+    stdout = sys.stdout.buffer
+
+    for line in stdin:
+        try:
+            request = json.loads(line.decode("utf8", "surrogateescape"))
+            response: Dict[str, Any] = {"result": OPS[request["op"]](**request.get("args", {}))}
+        except Exception as e:
+            response = {"error": "{}: {}".format(type(e).__name__, e)}
+
+        stdout.write(json.dumps(response).encode("utf8", "surrogateescape") + b"\n")
+        stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
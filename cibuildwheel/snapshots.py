@@ -0,0 +1,249 @@
+"""
+Snapshots of Linux build containers, taken with `docker commit` after
+before_all has run. Later builds that would run the same before_all in the
+same image start from the snapshot instead, and skip before_all.
+"""
+
+import argparse
+import hashlib
+import json
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional
+
+SNAPSHOT_REPOSITORY = "cibuildwheel-snapshot"
+LABEL = "io.cibuildwheel.snapshot"
+
+
+class Snapshot(NamedTuple):
+    image: str
+    base_image: str
+    simulate_32_bit: bool
+    project: str
+    created: float
+    size: int
+
+
+def get_image_id(docker_image: str) -> str:
+    """
+    Returns the ID (the digest of the image config) of a docker image,
+    pulling it first if it's not available locally.
+    """
+    for attempt in range(2):
+        result = subprocess.run(
+            ["docker", "image", "inspect", "--format", "{{.Id}}", docker_image],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True,
+        )
+        if result.returncode == 0:
+            return result.stdout.strip()
+        if attempt == 0:
+            subprocess.run(["docker", "pull", docker_image], check=True)
+
+    raise RuntimeError(f"Docker image {docker_image} not found")
+
+
+def hash_input_files(project_dir: Path, patterns: List[str]) -> str:
+    """
+    Returns a hash of the paths and contents of the files in `project_dir`
+    that match any of the glob `patterns`.
+    """
+    paths = sorted({p for pattern in patterns for p in project_dir.glob(pattern) if p.is_file()})
+    digest = hashlib.sha256()
+
+    for path in paths:
+        digest.update(path.relative_to(project_dir).as_posix().encode("utf8"))
+        digest.update(b"\0")
+        digest.update(hashlib.sha256(path.read_bytes()).digest())
+
+    return digest.hexdigest()
+
+
+def snapshot_key(
+    *,
+    image_id: str,
+    simulate_32_bit: bool,
+    before_all: str,
+    environment: str,
+    inputs_hash: str,
+) -> str:
+    """
+    Returns a key that identifies the result of running before_all. If any
+    of the inputs change, before_all has to be run again.
+    """
+    key_data = {
+        "image_id": image_id,
+        "simulate_32_bit": simulate_32_bit,
+        "before_all": before_all,
+        "environment": environment,
+        "inputs_hash": inputs_hash,
+    }
+    return hashlib.sha256(json.dumps(key_data, sort_keys=True).encode("utf8")).hexdigest()
+
+
+def snapshot_image_name(key: str) -> str:
+    return f"{SNAPSHOT_REPOSITORY}:{key}"
+
+
+def find_snapshot(key: str) -> Optional[str]:
+    """
+    Returns the name of the snapshot image for `key`, if there is one.
+    """
+    image = snapshot_image_name(key)
+    result = subprocess.run(
+        ["docker", "image", "inspect", image],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    return image if result.returncode == 0 else None
+
+
+def create_snapshot(
+    container_name: str,
+    key: str,
+    *,
+    base_image: str,
+    simulate_32_bit: bool,
+    project_dir: Path,
+) -> str:
+    """
+    Commits the container to a snapshot image, and removes snapshots of
+    older before_all runs for the same project and base image, since those
+    can't be used anymore.
+    """
+    image = snapshot_image_name(key)
+    labels = {
+        LABEL: "1",
+        f"{LABEL}.base-image": base_image,
+        f"{LABEL}.linux32": "1" if simulate_32_bit else "0",
+        f"{LABEL}.project": str(project_dir.resolve()),
+        f"{LABEL}.created": str(int(time.time())),
+    }
+    change_args = [f"--change=LABEL {json.dumps(k)}={json.dumps(v)}" for k, v in labels.items()]
+
+    subprocess.run(
+        ["docker", "commit", *change_args, container_name, image],
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+
+    stale_snapshots = [
+        s
+        for s in list_snapshots()
+        if s.image != image
+        and s.base_image == base_image
+        and s.simulate_32_bit == simulate_32_bit
+        and s.project == labels[f"{LABEL}.project"]
+    ]
+    remove_snapshots(stale_snapshots)
+
+    return image
+
+
+def list_snapshots() -> List[Snapshot]:
+    image_names = subprocess.run(
+        [
+            "docker",
+            "image",
+            "ls",
+            f"--filter=label={LABEL}",
+            "--format={{.Repository}}:{{.Tag}}",
+        ],
+        check=True,
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+    ).stdout.split()
+
+    if not image_names:
+        return []
+
+    image_details = json.loads(
+        subprocess.run(
+            ["docker", "image", "inspect", *image_names],
+            check=True,
+            stdout=subprocess.PIPE,
+            universal_newlines=True,
+        ).stdout
+    )
+
+    snapshots = []
+    for name, details in zip(image_names, image_details):
+        labels: Dict[str, str] = details["Config"]["Labels"] or {}
+        snapshots.append(
+            Snapshot(
+                image=name,
+                base_image=labels.get(f"{LABEL}.base-image", ""),
+                simulate_32_bit=labels.get(f"{LABEL}.linux32") == "1",
+                project=labels.get(f"{LABEL}.project", ""),
+                created=float(labels.get(f"{LABEL}.created", 0)),
+                size=int(details["Size"]),
+            )
+        )
+
+    return sorted(snapshots, key=lambda s: s.created)
+
+
+def remove_snapshots(snapshots: List[Snapshot]) -> None:
+    if snapshots:
+        subprocess.run(
+            ["docker", "image", "rm", *(s.image for s in snapshots)],
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+
+
+def prune_snapshots(older_than_days: Optional[float] = None) -> List[Snapshot]:
+    """
+    Removes snapshots that were created more than `older_than_days` ago, or
+    all snapshots if that's None. Returns the removed snapshots.
+    """
+    snapshots = list_snapshots()
+
+    if older_than_days is not None:
+        cutoff = time.time() - older_than_days * 24 * 60 * 60
+        snapshots = [s for s in snapshots if s.created < cutoff]
+
+    remove_snapshots(snapshots)
+    return snapshots
+
+
+def main(args: List[str]) -> None:
+    """
+    Entry point for `cibuildwheel snapshots`.
+    """
+    parser = argparse.ArgumentParser(
+        prog="cibuildwheel snapshots",
+        description="Manage the before_all snapshots created by CIBW_BEFORE_ALL_SNAPSHOT.",
+    )
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.add_parser("list", help="List the snapshots on this Docker host.")
+    prune_parser = subparsers.add_parser("prune", help="Remove snapshots.")
+    prune_parser.add_argument(
+        "--older-than",
+        type=float,
+        default=None,
+        metavar="DAYS",
+        help="Only remove snapshots created more than DAYS days ago.",
+    )
+
+    parsed_args = parser.parse_args(args)
+
+    if parsed_args.command == "list":
+        now = time.time()
+        for snapshot in list_snapshots():
+            age_days = (now - snapshot.created) / (24 * 60 * 60)
+            print(
+                f"{snapshot.image}  {snapshot.base_image}{' (linux32)' if snapshot.simulate_32_bit else ''}  "
+                f"{snapshot.project}  {age_days:.1f} days old  {snapshot.size / 1e6:.0f} MB"
+            )
+    elif parsed_args.command == "prune":
+        removed = prune_snapshots(older_than_days=parsed_args.older_than)
+        for snapshot in removed:
+            print(f"Removed {snapshot.image}")
+        print(f"{len(removed)} snapshots removed.")
+    else:
+        parser.print_usage(sys.stderr)
+        sys.exit(2)
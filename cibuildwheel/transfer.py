@@ -0,0 +1,926 @@
+"""
+Transfer of the project into Docker containers.
+
+The project is tarred once per run, into a ProjectArchive, and the archive is
+streamed into each container that needs a full copy. Alongside it is a
+manifest of what it holds - each path's size, mtime and the hash of its
+contents. When a container is snapshotted, the manifest is saved inside it,
+so that containers started from the snapshot are only sent what changed, and
+what was removed is deleted.
+
+Rather than streaming the archive into every container, it can be put into
+a Docker volume once (ProjectVolume), which containers copy it from.
+Alternatively, when the Docker daemon is local, the project can be mounted
+into containers through an overlay volume (ProjectMount), so it isn't copied
+at all.
+"""
+
+import hashlib
+import json
+import os
+import re
+import shlex
+import shutil
+import stat
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+from pathlib import Path, PurePath, PurePosixPath
+from typing import (
+    Any,
+    BinaryIO,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Pattern,
+    Set,
+    Tuple,
+    cast,
+)
+
+from .docker_container import DockerContainer, docker_is_remote
+from .logger import log
+from .util import ProjectFiles
+
+
+class FileState(NamedTuple):
+    kind: str  # "file", "dir" or "link"
+    size: int
+    mtime_ns: int
+    mode: int
+    # the sha256 of a file's contents, or a link's target. None if it hasn't
+    # been needed yet.
+    digest: Optional[str]
+
+
+Manifest = Dict[str, FileState]
+
+COPY_BUFFER_SIZE = 1024 * 1024
+
+# where a container's manifest is kept, when it's going to be snapshotted
+MANIFEST_PATH = PurePath("/cibuildwheel-project-manifest.json")
+
+
+class TransferStats(NamedTuple):
+    compression: Optional[str]
+    # the size of the data, and what was actually sent, after compression
+    data_bytes: int
+    sent_bytes: int
+    seconds: float
+
+    def __str__(self) -> str:
+        description = f"{self.sent_bytes / 1e6:.1f} MB"
+        if self.compression is not None:
+            description += f" ({self.data_bytes / 1e6:.1f} MB before {self.compression})"
+        rate = self.sent_bytes / 1e6 / max(self.seconds, 1e-3)
+        return f"{description} in {self.seconds:.2f}s, {rate:.1f} MB/s"
+
+
+class SyncResult(NamedTuple):
+    manifest: Manifest
+    sent: List[str]
+    deleted: List[str]
+    sent_bytes: int
+    # None if nothing was streamed from the host
+    stats: Optional[TransferStats]
+
+
+def hash_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# paths that are never worth sending into a container, in .cibwignore
+# syntax. The .git directory isn't one of them, because tools like
+# setuptools_scm need it to work out the version of the project.
+DEFAULT_IGNORE_PATTERNS = [
+    "__pycache__/",
+    "*.py[co]",
+    ".tox/",
+    ".nox/",
+    ".mypy_cache/",
+    ".pytest_cache/",
+    "node_modules/",
+    "/build/",
+]
+
+IGNORE_FILE_NAME = ".cibwignore"
+
+
+class IgnorePattern(NamedTuple):
+    regex: Pattern[str]
+    negated: bool
+    dir_only: bool
+
+
+def translate_pattern(pattern: str) -> str:
+    """
+    Translates a glob pattern, where '*' doesn't match '/' but '**' does,
+    into a regex.
+    """
+    regex = ""
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith("**/", i):
+            regex += "(?:.*/)?"
+            i += 3
+        elif pattern.startswith("**", i):
+            regex += ".*"
+            i += 2
+        elif pattern[i] == "*":
+            regex += "[^/]*"
+            i += 1
+        elif pattern[i] == "?":
+            regex += "[^/]"
+            i += 1
+        elif pattern[i] == "[" and "]" in pattern[i + 2 :]:
+            end = pattern.index("]", i + 2)
+            chars = pattern[i + 1 : end]
+            if chars.startswith("!"):
+                chars = "^" + chars[1:]
+            regex += f"[{chars}]"
+            i = end + 1
+        else:
+            regex += re.escape(pattern[i])
+            i += 1
+    return regex
+
+
+def parse_ignore_pattern(line: str) -> Optional[IgnorePattern]:
+    """
+    Parses a line of a .cibwignore file. The syntax is a subset of
+    .gitignore's - a pattern without a '/' (other than a trailing one)
+    matches at any depth, otherwise it's relative to the project dir. A
+    trailing '/' only matches directories, and '!' re-includes paths that an
+    earlier pattern excluded.
+    """
+    line = line.strip()
+    if not line or line.startswith("#"):
+        return None
+
+    negated = line.startswith("!")
+    if negated:
+        line = line[1:]
+
+    dir_only = line.endswith("/")
+    line = line.strip("/") if dir_only else line
+    anchored = "/" in line.lstrip("/") or line.startswith("/")
+    line = line.lstrip("/")
+    if not line:
+        return None
+
+    prefix = "" if anchored else "(?:.*/)?"
+    return IgnorePattern(
+        regex=re.compile(prefix + translate_pattern(line) + r"\Z"),
+        negated=negated,
+        dir_only=dir_only,
+    )
+
+
+def git_list_files(project_dir: Path) -> Optional[Set[str]]:
+    """
+    Returns the files in the project that git knows about - those that are
+    tracked, and those that are untracked but not ignored. Returns None if
+    the project isn't in a git repository.
+    """
+    try:
+        result = subprocess.run(
+            ["git", "ls-files", "-z", "--cached", "--others", "--exclude-standard"],
+            cwd=project_dir,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    return {path for path in result.stdout.decode("utf8", "surrogateescape").split("\0") if path}
+
+
+class ProjectFilter:
+    """
+    Decides which paths in the project are copied into containers.
+
+    Paths matching the default ignore patterns or the project's .cibwignore
+    file are left out, as are virtualenvs and `exclude_dirs` (e.g. the output
+    dir). With the "git" mode, only the files that git knows about are
+    included, along with the .git directory itself.
+    """
+
+    def __init__(
+        self,
+        project_dir: Path,
+        mode: ProjectFiles = "all",
+        exclude_dirs: Optional[List[Path]] = None,
+    ) -> None:
+        self.project_dir = project_dir
+        self.patterns = [
+            pattern
+            for line in DEFAULT_IGNORE_PATTERNS + self.read_ignore_file()
+            for pattern in [parse_ignore_pattern(line)]
+            if pattern is not None
+        ]
+
+        self.excluded_paths = set()
+        resolved_project_dir = project_dir.resolve()
+        for exclude_dir in exclude_dirs or []:
+            try:
+                excluded = exclude_dir.resolve().relative_to(resolved_project_dir)
+            except ValueError:
+                # outside the project, so it's never copied anyway
+                continue
+            self.excluded_paths.add(excluded.as_posix())
+
+        self.git_files: Optional[Set[str]] = None
+        self.git_dirs: Set[str] = set()
+        if mode == "git":
+            self.git_files = git_list_files(project_dir)
+            if self.git_files is None:
+                log.warning(
+                    f"{project_dir.resolve()} isn't in a git repository, so project-files = "
+                    '"git" has no effect, and all the files in the project are copied'
+                )
+            else:
+                self.git_dirs = {
+                    parent.as_posix()
+                    for path in self.git_files
+                    for parent in PurePosixPath(path).parents
+                }
+
+    def read_ignore_file(self) -> List[str]:
+        ignore_file = self.project_dir / IGNORE_FILE_NAME
+        if not ignore_file.is_file():
+            return []
+        return ignore_file.read_text(encoding="utf8").splitlines()
+
+    def includes(self, rel_path: str, is_dir: bool) -> bool:
+        """
+        Returns True if the path, relative to the project dir, should be
+        copied. Directories that aren't included aren't descended into.
+        """
+        if rel_path in self.excluded_paths:
+            return False
+
+        if is_dir and (self.project_dir / rel_path / "pyvenv.cfg").exists():
+            return False
+
+        if self.git_files is not None and not self.is_known_to_git(rel_path, is_dir):
+            return False
+
+        included = True
+        for pattern in self.patterns:
+            if pattern.dir_only and not is_dir:
+                continue
+            if pattern.regex.match(rel_path):
+                included = pattern.negated
+
+        return included
+
+    def is_known_to_git(self, rel_path: str, is_dir: bool) -> bool:
+        assert self.git_files is not None
+        top_level = rel_path.split("/", 1)[0]
+        if top_level == ".git" or rel_path in self.git_files:
+            return True
+        if is_dir and rel_path in self.git_dirs:
+            return True
+        # submodules are listed as a single path, so everything inside them
+        # is included
+        return any(
+            parent.as_posix() in self.git_files for parent in PurePosixPath(rel_path).parents
+        )
+
+
+def walk_project(
+    project_dir: Path, include: Optional[Callable[[str, bool], bool]] = None
+) -> Iterator[Tuple[str, os.stat_result]]:
+    """
+    Yields the relative path and lstat of everything in the project,
+    parents before children, without following symlinks. If given,
+    `include` is called with each relative path and whether it's a
+    directory, and paths it returns False for are skipped.
+    """
+    for dirpath, dirnames, filenames in os.walk(project_dir):
+        rel_dir = Path(dirpath).relative_to(project_dir)
+        included_dirnames = []
+
+        for name in [*sorted(dirnames), *sorted(filenames)]:
+            rel_path = (rel_dir / name).as_posix()
+            st = os.lstat(project_dir / rel_path)
+            is_dir = stat.S_ISDIR(st.st_mode)
+
+            if include is not None and not include(rel_path, is_dir):
+                continue
+
+            if is_dir:
+                included_dirnames.append(name)
+            yield rel_path, st
+
+        # only descend into the included directories
+        dirnames[:] = included_dirnames
+
+
+def scan(
+    project_dir: Path,
+    previous: Optional[Manifest] = None,
+    project_filter: Optional[ProjectFilter] = None,
+) -> Manifest:
+    """
+    Returns the manifest of the project as it is now. Contents are only
+    hashed when a file's size or mtime differs from `previous`, and the
+    previous entry had a hash to compare with.
+    """
+    previous = previous or {}
+    manifest: Manifest = {}
+
+    include = project_filter.includes if project_filter is not None else None
+
+    for rel_path, st in walk_project(project_dir, include):
+        if stat.S_ISDIR(st.st_mode):
+            kind = "dir"
+        elif stat.S_ISLNK(st.st_mode):
+            kind = "link"
+        elif stat.S_ISREG(st.st_mode):
+            kind = "file"
+        else:
+            # sockets, fifos etc. can't be copied
+            continue
+
+        state = FileState(kind, st.st_size, st.st_mtime_ns, stat.S_IMODE(st.st_mode), None)
+        old_state = previous.get(rel_path)
+
+        if kind == "link":
+            state = state._replace(digest=os.readlink(project_dir / rel_path))
+        elif kind == "file" and old_state is not None and old_state.kind == "file":
+            if (old_state.size, old_state.mtime_ns) == (state.size, state.mtime_ns):
+                state = state._replace(digest=old_state.digest)
+            elif old_state.digest is not None and old_state.size == state.size:
+                state = state._replace(digest=hash_file(project_dir / rel_path))
+
+        manifest[rel_path] = state
+
+    return manifest
+
+
+def diff(old: Manifest, new: Manifest) -> Tuple[List[str], List[str]]:
+    """
+    Returns the paths that need to be sent, and the paths that need to be
+    deleted, to turn a copy of `old` into a copy of `new`.
+    """
+    changed = []
+    for path, state in new.items():
+        old_state = old.get(path)
+        if old_state is None or old_state.kind != state.kind or old_state.mode != state.mode:
+            changed.append(path)
+        elif state.kind == "file":
+            same_stat = (old_state.size, old_state.mtime_ns) == (state.size, state.mtime_ns)
+            same_digest = state.digest is not None and old_state.digest == state.digest
+            if not (same_stat or same_digest):
+                changed.append(path)
+        elif state.kind == "link" and old_state.digest != state.digest:
+            changed.append(path)
+
+    # paths that changed kind, e.g. from a file to a directory, are deleted
+    # before the new one is sent
+    deleted = [path for path in old if path not in new or new[path].kind != old[path].kind]
+    # a deleted directory takes its contents with it
+    deleted_dirs = {path for path in deleted if old[path].kind == "dir"}
+    deleted = [
+        path
+        for path in deleted
+        if not any(parent.as_posix() in deleted_dirs for parent in PurePath(path).parents)
+    ]
+
+    return changed, deleted
+
+
+class ProjectArchive:
+    """
+    A tar of the project, made the first time it's needed and then sent
+    into every container, so the project is only walked and read once per
+    run. Safe to use from several threads - each container reads the
+    archive through its own file handle.
+    """
+
+    def __init__(self, project_dir: Path, project_filter: Optional[ProjectFilter] = None) -> None:
+        self.project_dir = project_dir
+        self.project_filter = project_filter
+        self._lock = threading.Lock()
+        self._temp_dir: Optional[Path] = None
+        self._manifest: Optional[Manifest] = None
+
+    @property
+    def path(self) -> Path:
+        self.manifest()
+        assert self._temp_dir is not None
+        return self._temp_dir / "project.tar"
+
+    def manifest(self) -> Manifest:
+        """
+        Returns the manifest of the archive, making it if needed. Every file
+        in the manifest has a digest.
+        """
+        with self._lock:
+            if self._manifest is None:
+                self._manifest = self._make()
+            return self._manifest
+
+    def _make(self) -> Manifest:
+        manifest = scan(self.project_dir, project_filter=self.project_filter)
+        self._temp_dir = Path(tempfile.mkdtemp(prefix="cibw-project-"))
+
+        with (self._temp_dir / "project.tar").open("wb") as f, tarfile.open(
+            fileobj=f, mode="w|"
+        ) as tar:
+            digests = add_paths(tar, self.project_dir, list(manifest))
+
+        for path, digest in digests.items():
+            manifest[path] = manifest[path]._replace(digest=digest)
+
+        return manifest
+
+    def close(self) -> None:
+        with self._lock:
+            if self._temp_dir is not None:
+                shutil.rmtree(self._temp_dir, ignore_errors=True)
+            self._temp_dir = None
+            self._manifest = None
+
+    def __enter__(self) -> "ProjectArchive":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+
+class ProjectVolume:
+    """
+    A named Docker volume holding the project, filled from the archive once
+    per run, the first time it's needed. It's mounted read-only into each
+    container, and copied from there into the container's project dir, so
+    the project only goes through the Docker API once, however many
+    containers there are. Unlike a ProjectMount, this works with a remote
+    Docker daemon.
+    """
+
+    # where the volume is mounted, in each container
+    container_path = PurePath("/cibuildwheel-project-source")
+
+    def __init__(self, archive: ProjectArchive) -> None:
+        self.archive = archive
+        self.name = f"cibuildwheel-project-{uuid.uuid4()}"
+        self._lock = threading.Lock()
+        self._created = False
+        self._filled = False
+
+    def mount_arg(self, docker_image: str) -> str:
+        """
+        Returns the `--mount` argument for the volume, filling it first if
+        needed, using a container of `docker_image`.
+        """
+        with self._lock:
+            if not self._filled:
+                self._fill(docker_image)
+                self._filled = True
+        return f"type=volume,source={self.name},target={self.container_path},readonly"
+
+    def _fill(self, docker_image: str) -> None:
+        subprocess.run(
+            ["docker", "volume", "create", self.name], check=True, stdout=subprocess.DEVNULL
+        )
+        self._created = True
+
+        docker_args = [
+            "docker",
+            "run",
+            "--rm",
+            "--interactive",
+            f"--mount=type=volume,source={self.name},target=/volume",
+            docker_image,
+        ]
+        compression = choose_compression(["docker", "run", "--rm", docker_image])
+
+        with self.archive.path.open("rb") as f, ContainerStream(
+            docker_args, "tar -xC /volume -f -", compression
+        ) as stream:
+            shutil.copyfileobj(f, stream, COPY_BUFFER_SIZE)
+
+        print(f"Copied the project into a Docker volume: {stream.stats()}")
+
+    def close(self) -> None:
+        with self._lock:
+            if self._created:
+                subprocess.run(
+                    ["docker", "volume", "rm", "--force", self.name],
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL,
+                )
+            self._created = False
+            self._filled = False
+
+    def __enter__(self) -> "ProjectVolume":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+
+def can_mount_project() -> bool:
+    """
+    Returns True if the project can be mounted into containers. Overlay
+    volumes are made by the Docker daemon, from paths on its own filesystem,
+    so this only works when the daemon is running on this machine, and it's
+    a Linux machine (not a VM, like Docker Desktop).
+    """
+    return sys.platform == "linux" and not docker_is_remote()
+
+
+class ProjectMount:
+    """
+    A Docker volume that presents the project to a container without copying
+    it. It's an overlay mount, with the project as its read-only lower layer,
+    and an upper layer in a temporary directory that takes the build's
+    writes, so the project on the host is never modified. Each container
+    needs its own ProjectMount.
+
+    `cleanup_image` is used to remove the upper layer afterwards, if it
+    contains files that were written by root in the container.
+    """
+
+    def __init__(self, project_dir: Path, cleanup_image: str) -> None:
+        self.project_dir = project_dir.resolve()
+        self.cleanup_image = cleanup_image
+        self.name = f"cibuildwheel-project-{uuid.uuid4()}"
+        self.temp_dir: Optional[Path] = None
+
+    def __enter__(self) -> "ProjectMount":
+        # the overlay options are a comma separated list, and colons separate
+        # lower layers
+        if any(c in str(self.project_dir) for c in ",:"):
+            raise ValueError(f"Can't mount {self.project_dir}, because of the characters in it")
+
+        self.temp_dir = Path(tempfile.mkdtemp(prefix="cibw-overlay-"))
+        upper_dir = self.temp_dir / "upper"
+        work_dir = self.temp_dir / "work"
+        upper_dir.mkdir()
+        work_dir.mkdir()
+
+        try:
+            subprocess.run(
+                [
+                    "docker",
+                    "volume",
+                    "create",
+                    "--driver=local",
+                    "--opt=type=overlay",
+                    "--opt=device=overlay",
+                    f"--opt=o=lowerdir={self.project_dir},upperdir={upper_dir},workdir={work_dir}",
+                    self.name,
+                ],
+                check=True,
+                stdout=subprocess.DEVNULL,
+            )
+        except BaseException:
+            self.__exit__(None, None, None)
+            raise
+
+        return self
+
+    def mount_arg(self, container_path: PurePath) -> str:
+        """
+        Returns the `--mount` argument for mounting the project at
+        `container_path`.
+        """
+        return f"type=volume,source={self.name},target={container_path}"
+
+    def __exit__(self, *args: Any) -> None:
+        subprocess.run(
+            ["docker", "volume", "rm", "--force", self.name],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+
+        if self.temp_dir is None:
+            return
+
+        try:
+            shutil.rmtree(self.temp_dir)
+        except OSError:
+            # the build ran as root in the container, so the files it wrote
+            # can only be removed as root
+            subprocess.run(
+                [
+                    "docker",
+                    "run",
+                    "--rm",
+                    f"--volume={self.temp_dir}:/overlay",
+                    self.cleanup_image,
+                    "rm",
+                    "-rf",
+                    "/overlay/upper",
+                    "/overlay/work",
+                ],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+            shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+        self.temp_dir = None
+
+
+def sync_into(
+    docker: DockerContainer,
+    archive: ProjectArchive,
+    container_path: PurePath,
+    previous: Optional[Manifest] = None,
+    volume: Optional[ProjectVolume] = None,
+) -> SyncResult:
+    """
+    Makes `container_path` in the container match the project archive,
+    given that it was last synced with the `previous` manifest. Without a
+    previous manifest, the whole archive is streamed in, or if `volume` is
+    mounted in the container, copied from there. Otherwise, the changed and
+    added paths are taken from the archive and sent in a single tar stream,
+    and removed paths are deleted in the container.
+    """
+    manifest = archive.manifest()
+    changed: List[str]
+    deleted: List[str]
+    stats = None
+
+    if previous is None:
+        changed, deleted = list(manifest), []
+        if volume is not None:
+            docker.call_many(
+                [
+                    ["mkdir", "-p", container_path],
+                    ["cp", "-a", f"{volume.container_path}/.", container_path],
+                ]
+            )
+        else:
+            docker.make_dirs(container_path)
+            stats = send_archive(docker, archive, container_path)
+    else:
+        docker.make_dirs(container_path)
+        changed, deleted = diff(previous, manifest)
+        if deleted:
+            delete_paths(docker, container_path, deleted)
+        if changed:
+            stats = send_members(docker, archive, container_path, changed)
+
+    sent_bytes = sum(manifest[path].size for path in changed if manifest[path].kind == "file")
+
+    return SyncResult(
+        manifest=manifest, sent=changed, deleted=deleted, sent_bytes=sent_bytes, stats=stats
+    )
+
+
+def delete_paths(docker: DockerContainer, container_path: PurePath, paths: List[str]) -> None:
+    assert docker.name is not None
+    subprocess.run(
+        ["docker", "exec", "-i", docker.name, "xargs", "-0", "rm", "-rf", "--"],
+        input=b"".join(str(container_path / path).encode() + b"\0" for path in paths),
+        check=True,
+    )
+
+
+class HashingReader:
+    """
+    Wraps a binary file, hashing the data as it's read.
+    """
+
+    def __init__(self, f: BinaryIO) -> None:
+        self.f = f
+        self.hash = hashlib.sha256()
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.f.read(size)
+        self.hash.update(data)
+        return data
+
+
+def add_paths(tar: tarfile.TarFile, project_dir: Path, paths: List[str]) -> Dict[str, str]:
+    """
+    Adds `paths` from the project to the tar. Returns the hashes of the files
+    that were added.
+    """
+    digests = {}
+    for path in paths:
+        tar_info = tar.gettarinfo(str(project_dir / path), arcname=path)
+        if tar_info.isreg():
+            with (project_dir / path).open("rb") as f:
+                reader = HashingReader(f)
+                tar.addfile(tar_info, cast(BinaryIO, reader))
+            digests[path] = reader.hash.hexdigest()
+        else:
+            tar.addfile(tar_info)
+    return digests
+
+
+def choose_compression(docker_args: List[str]) -> Optional[str]:
+    """
+    Returns the compression to use for streams sent to a container, or None
+    if they shouldn't be compressed. `docker_args` runs a command in the
+    container. Compression only pays off when the Docker daemon is remote,
+    and streams go over the network. zstd is used if it's installed both
+    here and in the container, as it's much faster than gzip for the same
+    ratio, otherwise gzip, which every image has.
+    """
+    if not docker_is_remote():
+        return None
+
+    if shutil.which("zstd") is not None:
+        result = subprocess.run(
+            [*docker_args, "sh", "-c", "command -v zstd"],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        if result.returncode == 0:
+            return "zstd"
+
+    return "gzip"
+
+
+class ContainerStream:
+    """
+    A writable stream, to the stdin of the shell `command` run in a
+    container by `docker_args`. If `compression` is set, data is compressed
+    on the way, at a low level, as the aim is to keep up with the network
+    rather than to get the smallest stream. Raises CalledProcessError on
+    exit if the command fails.
+    """
+
+    DECOMPRESS_COMMANDS = {"zstd": "zstd -dcq | ", "gzip": "gzip -dc | "}
+
+    def __init__(self, docker_args: List[str], command: str, compression: Optional[str]) -> None:
+        self.docker_args = docker_args
+        self.command = command
+        self.compression = compression
+        self.data_bytes = 0
+        self.sent_bytes = 0
+
+    def __enter__(self) -> "ContainerStream":
+        self.start_time = time.time()
+        decompress_command = self.DECOMPRESS_COMMANDS.get(self.compression or "", "")
+        self.process = subprocess.Popen(
+            [*self.docker_args, "sh", "-c", decompress_command + self.command],
+            stdin=subprocess.PIPE,
+        )
+        assert self.process.stdin is not None
+        self.stdin = self.process.stdin
+
+        if self.compression == "gzip":
+            # wbits=31 makes a gzip stream, rather than raw zlib
+            self.compressor = zlib.compressobj(1, zlib.DEFLATED, 31)
+        elif self.compression == "zstd":
+            self.zstd_process = subprocess.Popen(
+                ["zstd", "-1", "-T0", "-cq"], stdin=subprocess.PIPE, stdout=subprocess.PIPE
+            )
+            self.pump_thread = threading.Thread(target=self._pump_zstd_output)
+            self.pump_thread.start()
+
+        return self
+
+    def _send(self, data: bytes) -> None:
+        self.stdin.write(data)
+        self.sent_bytes += len(data)
+
+    def _pump_zstd_output(self) -> None:
+        zstd_stdout = self.zstd_process.stdout
+        assert zstd_stdout is not None
+        try:
+            for chunk in iter(lambda: zstd_stdout.read(COPY_BUFFER_SIZE), b""):
+                self._send(chunk)
+        except BrokenPipeError:
+            # the command has exited, which __exit__ reports
+            self.zstd_process.kill()
+
+    def write(self, data: bytes) -> int:
+        self.data_bytes += len(data)
+        if self.compression == "gzip":
+            self._send(self.compressor.compress(data))
+        elif self.compression == "zstd":
+            assert self.zstd_process.stdin is not None
+            self.zstd_process.stdin.write(data)
+        else:
+            self._send(data)
+        return len(data)
+
+    def __exit__(self, exc_type: Any, exc_val: Any, exc_tb: Any) -> None:
+        try:
+            if exc_type is None:
+                if self.compression == "gzip":
+                    self._send(self.compressor.flush())
+                elif self.compression == "zstd":
+                    assert self.zstd_process.stdin is not None
+                    self.zstd_process.stdin.close()
+        except BrokenPipeError:
+            pass
+        finally:
+            if self.compression == "zstd":
+                if exc_type is not None:
+                    self.zstd_process.kill()
+                self.pump_thread.join()
+                self.zstd_process.wait()
+            try:
+                self.stdin.close()
+            except BrokenPipeError:
+                pass
+            returncode = self.process.wait()
+            self.seconds = time.time() - self.start_time
+
+        if returncode != 0 and exc_type in (None, BrokenPipeError):
+            raise subprocess.CalledProcessError(returncode, self.process.args)
+
+    def stats(self) -> TransferStats:
+        return TransferStats(
+            compression=self.compression,
+            data_bytes=self.data_bytes,
+            sent_bytes=self.sent_bytes,
+            seconds=self.seconds,
+        )
+
+
+def send_archive(
+    docker: DockerContainer, archive: ProjectArchive, container_path: PurePath
+) -> TransferStats:
+    """
+    Sends the whole archive into the container, and extracts it into
+    `container_path`.
+    """
+    assert docker.name is not None
+    docker_args = ["docker", "exec", "-i", docker.name]
+    compression = choose_compression(docker_args)
+
+    with archive.path.open("rb") as f, ContainerStream(
+        docker_args, f"tar -xC {shlex.quote(str(container_path))} -f -", compression
+    ) as stream:
+        shutil.copyfileobj(f, stream, COPY_BUFFER_SIZE)
+
+    return stream.stats()
+
+
+def send_members(
+    docker: DockerContainer, archive: ProjectArchive, container_path: PurePath, paths: List[str]
+) -> TransferStats:
+    """
+    Sends `paths` from the archive into the container, as a tar stream.
+    """
+    assert docker.name is not None
+    docker_args = ["docker", "exec", "-i", docker.name]
+    compression = choose_compression(docker_args)
+
+    with tarfile.open(archive.path, mode="r:") as source, ContainerStream(
+        docker_args, f"tar -xC {shlex.quote(str(container_path))} -f -", compression
+    ) as stream:
+        with tarfile.open(fileobj=cast(BinaryIO, stream), mode="w|") as tar:
+            for path in paths:
+                member = source.getmember(path)
+                tar.addfile(member, source.extractfile(member) if member.isreg() else None)
+
+    return stream.stats()
+
+
+def save_manifest(docker: DockerContainer, manifest: Manifest) -> None:
+    """
+    Stores the manifest inside the container, so that it's kept in
+    snapshots of the container, alongside the files it describes.
+    """
+    assert docker.name is not None
+    manifest_json = json.dumps({path: list(state) for path, state in manifest.items()})
+    subprocess.run(
+        ["docker", "exec", "-i", docker.name, "sh", "-c", f"cat > {MANIFEST_PATH}"],
+        input=manifest_json.encode("utf8"),
+        check=True,
+    )
+
+
+def load_manifest(docker: DockerContainer) -> Optional[Manifest]:
+    """
+    Returns the manifest stored in the container, or None if there isn't
+    one.
+    """
+    assert docker.name is not None
+    result = subprocess.run(
+        ["docker", "exec", docker.name, "cat", str(MANIFEST_PATH)],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+    if result.returncode != 0:
+        return None
+
+    try:
+        manifest_json = json.loads(result.stdout)
+        return {path: FileState(*state) for path, state in manifest_json.items()}
+    except (ValueError, TypeError):
+        return None
@@ -3,16 +3,18 @@ import fnmatch
 import itertools
 import os
 import re
+import shutil
 import ssl
 import subprocess
 import sys
 import textwrap
+import threading
 import time
 import urllib.request
 from enum import Enum
 from pathlib import Path
 from time import sleep
-from typing import Dict, Iterator, List, NamedTuple, Optional, Set
+from typing import IO, Any, Dict, Iterator, List, NamedTuple, Optional, Set, TextIO
 
 import bracex
 import certifi
@@ -30,6 +32,10 @@ install_certifi_script = resources_dir / "install_certifi.py"
 
 BuildFrontend = Literal["pip", "build"]
 
+ProjectFiles = Literal["all", "git"]
+
+ProjectTransfer = Literal["copy", "mount", "volume"]
+
 
 def prepare_command(command: str, **kwargs: PathOrStr) -> str:
     """
@@ -152,6 +158,80 @@ class Unbuffered:
         return getattr(self.stream, attr)
 
 
+class ThreadRedirectedStream:
+    """
+    Wraps a text stream (usually sys.stdout), allowing individual threads to
+    send their output somewhere else, e.g. a log file for a build that's
+    running in the background. Threads that haven't redirected write through
+    to the wrapped stream.
+    """
+
+    def __init__(self, stream: TextIO) -> None:
+        self.stream = stream
+        self._local = threading.local()
+
+    @property
+    def target(self) -> IO[str]:
+        target: Optional[IO[str]] = getattr(self._local, "target", None)
+        return target if target is not None else self.stream
+
+    def write(self, data: str) -> int:
+        target = self.target
+        result = target.write(data)
+        target.flush()
+        return result
+
+    def writelines(self, data: List[str]) -> None:
+        target = self.target
+        target.writelines(data)
+        target.flush()
+
+    def flush(self) -> None:
+        self.target.flush()
+
+    @property
+    def buffer(self) -> IO[bytes]:
+        # callers write bytes straight to the buffer, so make sure that
+        # anything written as text has gone through first
+        target = self.target
+        target.flush()
+        return target.buffer  # type: ignore
+
+    def __getattr__(self, attr: str) -> Any:
+        return getattr(self.stream, attr)
+
+    @contextlib.contextmanager
+    def redirect(self, target: IO[str]) -> Iterator[None]:
+        """
+        Redirects the output of the current thread to `target` for the
+        duration of the context.
+        """
+        previous = getattr(self._local, "target", None)
+        self._local.target = target
+        try:
+            yield
+        finally:
+            self._local.target = previous
+
+
+@contextlib.contextmanager
+def thread_redirected_stdout() -> Iterator[ThreadRedirectedStream]:
+    """
+    Replaces sys.stdout with a ThreadRedirectedStream for the duration of the
+    context, if it isn't one already.
+    """
+    if isinstance(sys.stdout, ThreadRedirectedStream):
+        yield sys.stdout
+        return
+
+    stream = ThreadRedirectedStream(sys.stdout)
+    sys.stdout = stream  # type: ignore
+    try:
+        yield stream
+    finally:
+        sys.stdout = stream.stream
+
+
 def download(url: str, dest: Path) -> None:
     print(f"+ Download {url} to {dest}")
     dest_dir = dest.parent
@@ -179,6 +259,22 @@ def download(url: str, dest: Path) -> None:
         response.close()
 
 
+def copy_file_atomically(src: Path, dest_dir: Path) -> Path:
+    """
+    Copies `src` into `dest_dir`, such that the file either appears there
+    complete, or not at all.
+    """
+    dest = dest_dir / src.name
+    temp_dest = dest_dir / f".{src.name}.{os.getpid()}-{threading.get_ident()}.tmp"
+    try:
+        shutil.copyfile(src, temp_dest)
+        os.replace(temp_dest, dest)
+    finally:
+        if temp_dest.exists():
+            temp_dest.unlink()
+    return dest
+
+
 class DependencyConstraints:
     def __init__(self, base_file_path: Path):
         assert base_file_path.exists()
@@ -212,6 +308,8 @@ class BuildOptions(NamedTuple):
     architectures: Set[Architecture]
     environment: ParsedEnvironment
     before_all: str
+    before_all_snapshot: bool
+    before_all_inputs: List[str]
     before_build: Optional[str]
     repair_command: str
     manylinux_images: Optional[Dict[str, str]]
@@ -223,6 +321,14 @@ class BuildOptions(NamedTuple):
     test_extras: str
     build_verbosity: int
     build_frontend: BuildFrontend
+    project_files: ProjectFiles
+    project_transfer: ProjectTransfer
+    jobs: int
+    container_jobs: int
+    cache_dir: Optional[Path]
+    cache_max_size: Optional[int]
+    cache_url: Optional[str]
+    resume: bool
 
 
 class NonPlatformWheelError(Exception):
@@ -299,7 +405,8 @@ def print_new_wheels(msg: str, output_dir: Path) -> Iterator[None]:
     start_time = time.time()
     existing_contents = set(output_dir.iterdir())
     yield
-    final_contents = set(output_dir.iterdir())
+    # hidden files, like the build journal, aren't wheels
+    final_contents = {p for p in output_dir.iterdir() if not p.name.startswith(".")}
     new_contents = final_contents - existing_contents
     n = len(new_contents)
     s = time.time() - start_time
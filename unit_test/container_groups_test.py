@@ -0,0 +1,256 @@
+import contextlib
+import functools
+import subprocess
+import threading
+from pathlib import PurePath
+from types import SimpleNamespace
+from typing import cast
+
+import pytest
+
+from cibuildwheel import daemon, linux
+from cibuildwheel.architecture import Architecture
+from cibuildwheel.docker_container import DockerContainer
+from cibuildwheel.linux import get_container_groups, get_python_configurations
+from cibuildwheel.transfer import ProjectArchive
+from cibuildwheel.util import BuildOptions, BuildSelector
+
+MANYLINUX_IMAGES = {
+    "x86_64": "manylinux2010_x86_64",
+    "i686": "manylinux2010_i686",
+    "pypy_x86_64": "manylinux2010_x86_64",
+    "aarch64": "manylinux2014_aarch64",
+    "ppc64le": "manylinux2014_ppc64le",
+    "s390x": "manylinux2014_s390x",
+    "pypy_aarch64": "manylinux2014_aarch64",
+    "pypy_i686": "manylinux2010_i686",
+}
+
+
+def get_configurations(build_config):
+    build_selector = BuildSelector(build_config=build_config, skip_config="")
+    return get_python_configurations(build_selector, {Architecture.x86_64, Architecture.i686})
+
+
+def test_shared_image_uses_one_container():
+    configurations = get_configurations("cp39-* pp37-*")
+
+    groups = get_container_groups(configurations, MANYLINUX_IMAGES)
+
+    assert [(g.docker_image, g.simulate_32_bit) for g in groups] == [
+        ("manylinux2010_x86_64", False),
+        ("manylinux2010_i686", True),
+    ]
+    assert [c.identifier for c in groups[0].configs] == [
+        "cp39-manylinux_x86_64",
+        "pp37-manylinux_x86_64",
+    ]
+    assert groups[0].name == "cp_manylinux_x86_64-pp_manylinux_x86_64"
+
+
+def test_different_images_use_separate_containers():
+    configurations = get_configurations("cp39-manylinux_x86_64 pp37-*_x86_64")
+    images = {**MANYLINUX_IMAGES, "pypy_x86_64": "manylinux2014_x86_64"}
+
+    groups = get_container_groups(configurations, images)
+
+    assert [g.docker_image for g in groups] == ["manylinux2010_x86_64", "manylinux2014_x86_64"]
+
+
+def test_same_image_for_32_and_64_bit():
+    configurations = get_configurations("cp39-*")
+    images = {**MANYLINUX_IMAGES, "i686": "manylinux2010_x86_64"}
+
+    groups = get_container_groups(configurations, images)
+
+    # i686 builds need linux32, so can't share a container with x86_64 builds
+    assert [(g.docker_image, g.simulate_32_bit) for g in groups] == [
+        ("manylinux2010_x86_64", False),
+        ("manylinux2010_x86_64", True),
+    ]
+
+
+class FakeBuild:
+    """
+    Stands in for the container steps of build_pipelined, recording them.
+    """
+
+    def __init__(self, monkeypatch, images, fail_identifier=None):
+        self.images = images
+        self.events = []
+        self.started = {image: threading.Event() for image in images}
+        self.fail_identifier = fail_identifier
+        monkeypatch.setattr(linux, "start_group_container", self.start_group_container)
+        monkeypatch.setattr(linux, "build_on_docker", self.build_on_docker)
+
+    def start_group_container(self, stack, options, group, *args, **kwargs):
+        self.events.append(("start", group.docker_image))
+        self.started[group.docker_image].set()
+        stack.callback(self.events.append, ("stop", group.docker_image))
+        return linux.GroupContainer(
+            docker=group.docker_image, skip_before_all=False, snapshot_key=None, sync_result=None
+        )
+
+    def build_on_docker(self, options, configs, docker, *args, **kwargs):
+        # the next container is started while this group builds
+        next_index = self.images.index(docker) + 1
+        if next_index < len(self.images):
+            assert self.started[self.images[next_index]].wait(timeout=5)
+
+        self.events.append(("build", docker))
+        if configs[0].identifier == self.fail_identifier:
+            raise subprocess.CalledProcessError(1, ["build"])
+
+
+def start_pipelined_build(monkeypatch, configurations, fail_identifier=None):
+    groups = get_container_groups(configurations, MANYLINUX_IMAGES)
+    fake = FakeBuild(monkeypatch, [g.docker_image for g in groups], fail_identifier)
+    build = functools.partial(
+        linux.build_pipelined,
+        cast(BuildOptions, None),
+        groups,
+        PurePath("/project"),
+        PurePath("/project"),
+        cast(ProjectArchive, None),
+    )
+    return fake, build
+
+
+def test_pipelined_build(monkeypatch):
+    fake, build = start_pipelined_build(monkeypatch, get_configurations("cp39-*"))
+
+    build()
+
+    assert fake.events.index(("start", "manylinux2010_i686")) < fake.events.index(
+        ("build", "manylinux2010_x86_64")
+    )
+    assert sorted(fake.events) == [
+        ("build", "manylinux2010_i686"),
+        ("build", "manylinux2010_x86_64"),
+        ("start", "manylinux2010_i686"),
+        ("start", "manylinux2010_x86_64"),
+        ("stop", "manylinux2010_i686"),
+        ("stop", "manylinux2010_x86_64"),
+    ]
+
+
+def test_pipelined_build_failure(monkeypatch):
+    fake, build = start_pipelined_build(
+        monkeypatch, get_configurations("cp39-*"), fail_identifier="cp39-manylinux_x86_64"
+    )
+
+    with pytest.raises(subprocess.CalledProcessError):
+        build()
+
+    # the next container was started, but it's stopped without being used
+    assert sorted(fake.events) == [
+        ("build", "manylinux2010_x86_64"),
+        ("start", "manylinux2010_i686"),
+        ("start", "manylinux2010_x86_64"),
+        ("stop", "manylinux2010_i686"),
+        ("stop", "manylinux2010_x86_64"),
+    ]
+
+
+class FakeSessionDocker:
+    """
+    Stands in for a DockerContainer whose sessions build concurrently,
+    recording the commands that each session runs.
+    """
+
+    def __init__(self):
+        self.commands = []
+
+    @contextlib.contextmanager
+    def session(self):
+        yield self
+
+    def call_many(self, commands, **kwargs):
+        self.commands.extend(commands)
+
+    def remove(self, path):
+        self.commands.append(["rm", "-rf", path])
+
+    def kill(self):
+        pass
+
+
+def test_sessions_have_separate_projects(monkeypatch):
+    configs = get_configurations("cp38-manylinux_x86_64 cp39-manylinux_x86_64")
+    docker = FakeSessionDocker()
+    project_dirs = {}
+
+    def build_identifier(options, config, docker, project_path, package_dir):
+        project_dirs[config.identifier] = (project_path, package_dir)
+        return []
+
+    monkeypatch.setattr(linux, "build_identifier", build_identifier)
+    options = SimpleNamespace(before_all="", container_jobs=2)
+
+    linux.build_on_docker(
+        cast(BuildOptions, options),
+        configs,
+        cast(DockerContainer, docker),
+        PurePath("/project"),
+        PurePath("/project/src"),
+    )
+
+    assert project_dirs == {
+        "cp38-manylinux_x86_64": (
+            PurePath("/tmp/cibuildwheel/projects/cp38-manylinux_x86_64"),
+            PurePath("/tmp/cibuildwheel/projects/cp38-manylinux_x86_64/src"),
+        ),
+        "cp39-manylinux_x86_64": (
+            PurePath("/tmp/cibuildwheel/projects/cp39-manylinux_x86_64"),
+            PurePath("/tmp/cibuildwheel/projects/cp39-manylinux_x86_64/src"),
+        ),
+    }
+    for project_path, _ in project_dirs.values():
+        assert ["cp", "-a", PurePath("/project"), project_path] in docker.commands
+
+
+class FakePool:
+    """
+    Stands in for the daemon's pool, leasing one container, which was used
+    before if `reused` is set.
+    """
+
+    def __init__(self, reused):
+        self.reused = reused
+
+    def lease(self, docker_image, **kwargs):
+        return "cibuildwheel-pool-1", self.reused
+
+    def release(self, name, **kwargs):
+        pass
+
+
+@pytest.mark.parametrize("reused", [False, True])
+def test_reused_pool_container_skips_before_all(reused, monkeypatch):
+    (group,) = get_container_groups(get_configurations("cp39-manylinux_x86_64"), MANYLINUX_IMAGES)
+
+    @contextlib.contextmanager
+    def fake_docker_container(*args, **kwargs):
+        yield FakeSessionDocker()
+
+    monkeypatch.setattr("cibuildwheel.linux.subprocess.run", lambda args, **kwargs: None)
+    monkeypatch.setattr(linux, "DockerContainer", fake_docker_container)
+    monkeypatch.setattr(linux, "copy_project_into", lambda *args, **kwargs: None)
+    options = SimpleNamespace(
+        before_all="git clone https://example.com/spam.git /opt/spam",
+        before_all_snapshot=False,
+        project_transfer="copy",
+        environment=None,
+    )
+
+    with contextlib.ExitStack() as stack:
+        container = linux.start_group_container(
+            stack,
+            cast(BuildOptions, options),
+            group,
+            PurePath("/project"),
+            cast(ProjectArchive, None),
+            container_pool=cast(daemon.ContainerPool, FakePool(reused)),
+        )
+
+    assert container.skip_before_all == reused
@@ -0,0 +1,164 @@
+import os
+import subprocess
+
+import pytest
+
+from cibuildwheel import daemon
+
+
+def container(name, last_used, leased_by=None):
+    return daemon.PooledContainer(
+        name=name,
+        docker_image="manylinux",
+        simulate_32_bit=False,
+        cpus=None,
+        project="/project",
+        setup="",
+        last_used=last_used,
+        leased_by=leased_by,
+    )
+
+
+def test_choose_containers_to_remove():
+    containers = [
+        container("old", last_used=0),
+        container("leased", last_used=10, leased_by=1),
+        container("recent", last_used=90),
+        container("newest", last_used=100),
+    ]
+
+    def chosen(**kwargs):
+        return [c.name for c in daemon.choose_containers_to_remove(containers, now=100, **kwargs)]
+
+    assert chosen(idle_timeout=60, max_containers=8) == ["old"]
+    assert chosen(idle_timeout=600, max_containers=8) == []
+    # the least recently used go first, and leased containers are kept
+    assert chosen(idle_timeout=600, max_containers=2) == ["old", "recent"]
+    assert chosen(idle_timeout=0, max_containers=0) == ["old", "recent", "newest"]
+
+
+@pytest.fixture
+def fake_docker(monkeypatch):
+    """
+    Replaces the docker commands that the pool runs with a record of the
+    containers that exist, by name, with their labels, and their status
+    under "status".
+    """
+    containers = {}
+
+    def fake_run(args, **kwargs):
+        assert args[0] == "docker"
+        command = args[1]
+        stdout = ""
+
+        if command == "run":
+            name = next(a for a in args if a.startswith("--name=")).split("=", 1)[1]
+            labels = dict(
+                a.split("=", 2)[1:] for a in args if a.startswith(f"--label={daemon.LABEL}.")
+            )
+            containers[name] = {**labels, "status": "running"}
+        elif command == "ps":
+            running_only = "--filter=status=running" in args
+            stdout = "".join(
+                "\t".join(
+                    [
+                        name,
+                        labels[f"{daemon.LABEL}.image"],
+                        labels[f"{daemon.LABEL}.linux32"],
+                        labels[f"{daemon.LABEL}.cpus"],
+                        labels[f"{daemon.LABEL}.project"],
+                        labels[f"{daemon.LABEL}.setup"],
+                    ]
+                )
+                + "\n"
+                for name, labels in containers.items()
+                if labels["status"] == "running" or not running_only
+            )
+        elif command == "rm":
+            containers.pop(args[-1], None)
+        elif command == "exec":
+            assert args[3:5] == ["rm", "-rf"]
+        else:
+            raise AssertionError(args)
+
+        return subprocess.CompletedProcess(args, 0, stdout=stdout)
+
+    monkeypatch.setattr("cibuildwheel.daemon.subprocess.run", fake_run)
+    return containers
+
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = daemon.ContainerPool(tmp_path)
+    for directory in (pool.leases_dir, pool.last_used_dir):
+        directory.mkdir()
+    return pool
+
+
+def lease(pool, docker_image="manylinux", **kwargs):
+    kwargs = {"simulate_32_bit": False, "cpus": None, "project": "/project", "setup": "", **kwargs}
+    return pool.lease(docker_image, **kwargs)
+
+
+def test_lease_and_release(fake_docker, pool):
+    first, reused = lease(pool)
+    assert not reused
+    # the first container is leased, so another is started
+    second, _ = lease(pool)
+    assert first != second
+    assert set(fake_docker) == {first, second}
+    assert {c.leased_by for c in pool.list_containers()} == {os.getpid()}
+
+    pool.release(first, reset_paths=[])
+    assert lease(pool) == (first, True)
+    # containers for other images, or without linux32, aren't reused
+    pool.release(first, reset_paths=[])
+    assert lease(pool, simulate_32_bit=True)[0] not in (first, second)
+    assert lease(pool, "musllinux")[0] != first
+    # nor are those used for another project, or after another before_all
+    assert lease(pool, project="/other-project")[0] != first
+    assert lease(pool, setup="yum install -y libffi-devel")[0] != first
+    assert lease(pool) == (first, True)
+
+    # a container whose build failed is removed
+    pool.release(second, reset_paths=[], reuse=False)
+    assert second not in fake_docker
+
+
+def test_reap(fake_docker, pool):
+    names = [lease(pool)[0] for _ in range(3)]
+    pool.release(names[0], reset_paths=[])
+    os.utime(pool.last_used_dir / names[0], (0, 0))
+    # a lease held by a process that has gone
+    (pool.leases_dir / names[1]).write_text(str(2**22 + 1))
+
+    removed = pool.reap(idle_timeout=60, max_containers=8)
+
+    assert sorted(removed) == sorted(names[:2])
+    assert list(fake_docker) == [names[2]]
+    assert sorted(p.name for p in pool.last_used_dir.iterdir()) == [names[2]]
+    assert sorted(p.name for p in pool.leases_dir.iterdir()) == [names[2]]
+
+
+def test_stopped_containers_are_not_leased(fake_docker, pool):
+    stopped, _ = lease(pool)
+    pool.release(stopped, reset_paths=[])
+    # e.g. the machine restarted
+    fake_docker[stopped]["status"] = "exited"
+
+    name, reused = lease(pool)
+    assert (name, reused) != (stopped, True)
+    pool.release(name, reset_paths=[])
+
+    assert pool.reap(idle_timeout=60, max_containers=8) == [stopped]
+    assert list(fake_docker) == [name]
+
+
+def test_find_running(tmp_path, monkeypatch):
+    monkeypatch.setenv("CIBW_DAEMON_DIR", str(tmp_path))
+    assert daemon.ContainerPool.find_running() is None
+
+    (tmp_path / "daemon.pid").write_text(str(os.getpid()))
+    pool = daemon.ContainerPool.find_running()
+    assert pool is not None
+    assert pool.state_dir == tmp_path
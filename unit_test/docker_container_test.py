@@ -7,7 +7,8 @@ from pathlib import Path, PurePath
 
 import pytest
 
-from cibuildwheel.docker_container import DockerContainer
+from cibuildwheel import docker_container
+from cibuildwheel.docker_container import CapturedOutput, DockerContainer
 from cibuildwheel.environment import EnvironmentAssignment
 
 # for these tests we use manylinux2014 images, because they're available on
@@ -35,6 +36,97 @@ def test_no_lf():
         assert container.call(["printf", "hello"], capture_output=True) == "hello"
 
 
+@pytest.mark.docker
+def test_large_output():
+    with DockerContainer(DEFAULT_IMAGE) as container:
+        # a single long line, larger than a read, followed by a failing command
+        output = container.call(
+            ["sh", "-c", "head -c 5000000 /dev/zero | tr '\\0' x"], capture_output=True
+        )
+        assert output == "x" * 5_000_000
+
+        with pytest.raises(subprocess.CalledProcessError) as excinfo:
+            container.call(["sh", "-c", "printf partial; exit 3"], capture_output=True)
+        assert excinfo.value.returncode == 3
+        assert excinfo.value.output == "partial"
+
+
+@pytest.mark.docker
+def test_call_many():
+    with DockerContainer(DEFAULT_IMAGE) as container:
+        assert container.call_many(
+            [["echo", "a"], ["printf", "b"], ["pwd"]], cwd="/opt", capture_output=True
+        ) == ["a\n", "b", "/opt\n"]
+
+        # stops at the first failure
+        with pytest.raises(subprocess.CalledProcessError) as excinfo:
+            container.call_many(
+                [["true"], ["sh", "-c", "echo failed; exit 2"], ["touch", "/tmp/not-run"]],
+                capture_output=True,
+            )
+        assert excinfo.value.cmd == ["sh", "-c", "echo failed; exit 2"]
+        assert excinfo.value.returncode == 2
+        assert excinfo.value.output == "failed\n"
+        assert container.stat(PurePath("/tmp/not-run")) is None
+
+
+@pytest.mark.docker
+def test_call_captured():
+    with DockerContainer(DEFAULT_IMAGE) as container:
+        with container.call_captured(["sh", "-c", "seq 1 100000"]) as output:
+            assert output.size == len("".join(f"{i}\n" for i in range(1, 100001)))
+            assert next(output.lines()) == "1\n"
+            assert sum(1 for _ in output.lines()) == 100000
+
+
+def test_captured_output():
+    with CapturedOutput(max_memory_size=10) as output:
+        output.file.write(b"line 1\nline 2\n\xff")
+        assert output.size == 15
+        assert list(output.lines()) == ["line 1\n", "line 2\n", "\udcff"]
+        assert b"".join(output.chunks()) == b"line 1\nline 2\n\xff"
+        assert output.text() == "line 1\nline 2\n\udcff"
+    assert output.file.closed
+
+
+@pytest.mark.parametrize(
+    "endpoint, remote",
+    [
+        ("unix:///var/run/docker.sock", False),
+        ("unix:///home/ci/.docker/run/docker.sock", False),
+        ("npipe:////./pipe/docker_engine", False),
+        ("tcp://build-server:2376", True),
+        ("ssh://ci@build-server", True),
+    ],
+)
+def test_docker_is_remote(endpoint, remote, monkeypatch):
+    monkeypatch.delenv("DOCKER_HOST", raising=False)
+
+    def fake_run(args, **kwargs):
+        # the endpoint of the current context, e.g. one chosen with
+        # `docker context use`
+        assert args[:3] == ["docker", "context", "inspect"]
+        return subprocess.CompletedProcess(args, 0, stdout=endpoint + "\n")
+
+    monkeypatch.setattr("cibuildwheel.docker_container.subprocess.run", fake_run)
+    assert docker_container.docker_is_remote() == remote
+
+    # DOCKER_HOST takes precedence over the context
+    monkeypatch.setenv("DOCKER_HOST", "tcp://other-server:2376")
+    assert docker_container.docker_is_remote()
+    monkeypatch.setenv("DOCKER_HOST", "unix:///var/run/docker.sock")
+    assert not docker_container.docker_is_remote()
+
+
+def test_docker_is_remote_without_contexts(monkeypatch):
+    monkeypatch.delenv("DOCKER_HOST", raising=False)
+    monkeypatch.setattr(
+        "cibuildwheel.docker_container.subprocess.run",
+        lambda args, **kwargs: subprocess.CompletedProcess(args, 1, stdout=""),
+    )
+    assert not docker_container.docker_is_remote()
+
+
 @pytest.mark.docker
 def test_environment():
     with DockerContainer(DEFAULT_IMAGE) as container:
@@ -96,6 +188,42 @@ def test_large_environment():
         )
 
 
+@pytest.mark.docker
+def test_similar_environments():
+    environment = {f"VAR_{i}": "0" * 1024 for i in range(20)}
+    environment["TEST_VAR"] = "1"
+
+    with DockerContainer(DEFAULT_IMAGE) as container:
+        assert (
+            container.call(
+                ["sh", "-c", "echo $TEST_VAR ${#VAR_0}"], env=environment, capture_output=True
+            )
+            == "1 1024\n"
+        )
+
+        # later calls only send what's changed
+        changed_environment = {**environment, "TEST_VAR": "2", "NEW_VAR": "3"}
+        assert (
+            container.call(
+                ["sh", "-c", "echo $TEST_VAR $NEW_VAR ${#VAR_19}"],
+                env=changed_environment,
+                capture_output=True,
+            )
+            == "2 3 1024\n"
+        )
+        assert len(container._environments) == 1
+
+        # removing a variable defines a new environment
+        del changed_environment["VAR_0"]
+        assert (
+            container.call(
+                ["sh", "-c", "echo ${VAR_0-unset}"], env=changed_environment, capture_output=True
+            )
+            == "unset\n"
+        )
+        assert len(container._environments) == 2
+
+
 @pytest.mark.docker
 def test_binary_output():
     with DockerContainer(DEFAULT_IMAGE) as container:
@@ -192,9 +320,62 @@ def test_dir_operations(tmp_path: Path):
 
         assert test_binary_data == (new_test_dir / "test.dat").read_bytes()
 
+        # test copy a single file out
+        copied_file = tmp_path / "copied.dat"
+        container.copy_out_file(dst_file, copied_file)
+
+        assert test_binary_data == copied_file.read_bytes()
+        assert sorted(p.name for p in tmp_path.iterdir()) == [
+            "copied.dat",
+            "test.dat",
+            "test_dir",
+            "test_dir_new",
+        ]
+
 
 @pytest.mark.docker
 def test_environment_executor():
     with DockerContainer(DEFAULT_IMAGE) as container:
         assignment = EnvironmentAssignment("TEST=$(echo 42)")
         assert assignment.evaluated_value({}, container.environment_executor) == "42"
+
+
+@pytest.mark.docker
+def test_helper_operations():
+    with DockerContainer(DEFAULT_IMAGE) as container:
+        test_dir = container.make_temp_dir() / "a" / "b"
+        container.make_dirs(test_dir)
+        container.make_dirs(test_dir)  # already exists
+        container.call(["touch", test_dir / "x.whl", test_dir / "y.txt"])
+
+        assert container.glob(test_dir, "*.whl") == [test_dir / "x.whl"]
+        stat = container.stat(test_dir / "y.txt")
+        assert stat is not None and stat["size"] == 0
+        assert container.stat(test_dir / "missing") is None
+
+        container.remove(test_dir.parent)
+        container.remove(test_dir.parent)  # already removed
+        assert container.glob(test_dir, "*") == []
+
+        which_sh = container.which("sh")
+        assert which_sh is not None and which_sh.name == "sh"
+        assert container.which("python", env={"PATH": "/opt/python/cp38-cp38/bin"}) == PurePath(
+            "/opt/python/cp38-cp38/bin/python"
+        )
+        assert container.which("not-a-command") is None
+        assert "PATH" in container.get_environment()
+
+        # a session has its own helper
+        with container.session() as session:
+            assert session.glob(PurePath("/opt/python/cp38-cp38/bin"), "python") == [
+                PurePath("/opt/python/cp38-cp38/bin/python")
+            ]
+
+
+@pytest.mark.docker
+def test_helper_error():
+    with DockerContainer(DEFAULT_IMAGE) as container:
+        container.call(["touch", "/tmp/file"])
+        with pytest.raises(subprocess.CalledProcessError) as excinfo:
+            container.make_dirs(PurePath("/tmp/file/dir"))
+        assert "NotADirectoryError" in excinfo.value.output
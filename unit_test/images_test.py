@@ -0,0 +1,138 @@
+import json
+import subprocess
+from typing import Any, Dict, Set
+
+import pytest
+
+from cibuildwheel import images
+
+
+@pytest.fixture
+def fake_docker(monkeypatch):
+    """
+    Replaces `docker pull` with a command that succeeds, or fails for images
+    named "missing". Records the images that are pulled.
+    """
+    pulled = []
+    real_popen = subprocess.Popen
+
+    def fake_popen(args, **kwargs):
+        assert args[:2] == ["docker", "pull"]
+        pulled.append(args[2])
+        command = "echo no such image; exit 1" if args[2] == "missing" else "sleep 0.1"
+        return real_popen(["sh", "-c", command], **kwargs)
+
+    monkeypatch.setattr("cibuildwheel.images.subprocess.Popen", fake_popen)
+    monkeypatch.setattr(images, "image_exists", lambda docker_image: docker_image == "local")
+    return pulled
+
+
+def test_pull(fake_docker, capsys):
+    with images.ImagePuller(["a", "b", "local", "a"]) as puller:
+        puller.wait("a")
+        puller.wait("b")
+        puller.wait("local")
+        puller.wait("a")
+        # images that weren't given are left to docker
+        puller.wait("snapshot")
+
+    assert sorted(fake_docker) == ["a", "b"]
+    output = capsys.readouterr().out
+    assert output.count("Pulled a in") == 1
+    assert "Pulled b in" in output
+    assert "local" not in output
+
+
+def test_pull_failure(fake_docker):
+    with images.ImagePuller(["missing"]) as puller:
+        with pytest.raises(subprocess.CalledProcessError) as excinfo:
+            puller.wait("missing")
+
+    assert excinfo.value.cmd == ["docker", "pull", "missing"]
+    assert "no such image" in excinfo.value.output
+
+
+def test_group_by_shared_layers():
+    groups = images.group_by_shared_layers(
+        {
+            "manylinux2010_x86_64": ["centos6", "devtoolset"],
+            "manylinux2014_aarch64": ["centos7-arm"],
+            "manylinux2014_x86_64": ["centos7", "devtoolset-9"],
+            "custom_x86_64": ["centos7", "devtoolset-9", "extras"],
+            # shares layers with both x86_64 groups, so joins them
+            "bridge": ["centos6", "centos7"],
+        }
+    )
+
+    assert groups == [
+        ["manylinux2014_aarch64"],
+        ["manylinux2010_x86_64", "manylinux2014_x86_64", "custom_x86_64", "bridge"],
+    ]
+
+
+def test_get_image_digest(tmp_path, monkeypatch):
+    local_images = {
+        "quay.io/pypa/manylinux2014_x86_64:2021-10-16": (
+            '"sha256:1111" ["quay.io/pypa/manylinux2014_x86_64@sha256:aaaa"]'
+        ),
+        "locally-built": '"sha256:2222" []',
+    }
+    registry_images = {"quay.io/pypa/manylinux2014_aarch64:2021-10-16": "sha256:bbbb"}
+    commands = []
+
+    def fake_run(args, **kwargs):
+        commands.append(args[:3])
+        image = args[-1]
+        if args[1] == "image" and image in local_images:
+            return subprocess.CompletedProcess(args, 0, stdout=local_images[image])
+        if args[1] == "buildx" and image in registry_images:
+            stdout = json.dumps({"digest": registry_images[image], "size": 1000})
+            return subprocess.CompletedProcess(args, 0, stdout=stdout)
+        return subprocess.CompletedProcess(args, 1, stdout="")
+
+    monkeypatch.setattr("cibuildwheel.images.subprocess.run", fake_run)
+    monkeypatch.setattr(images, "get_loaded_digests_path", lambda: tmp_path / "digests.json")
+
+    assert images.get_image_digest("quay.io/pypa/manylinux2014_x86_64@sha256:cccc") == "sha256:cccc"
+    assert commands == []
+    assert images.get_image_digest("quay.io/pypa/manylinux2014_x86_64:2021-10-16") == "sha256:aaaa"
+    assert images.get_image_digest("quay.io/pypa/manylinux2014_aarch64:2021-10-16") == "sha256:bbbb"
+    # nothing is pulled
+    assert all(command[1] in {"image", "buildx"} for command in commands)
+
+    assert images.get_image_digest("locally-built") is None
+    assert images.get_image_digest("unreachable") is None
+
+
+def test_loaded_images_keep_their_digests(tmp_path, monkeypatch):
+    bundle: Dict[str, Any] = {
+        "file": "images-1.tar",
+        "images": {"manylinux2014_x86_64": "sha256:1111", "custom": "sha256:2222"},
+        "digests": {"manylinux2014_x86_64": "sha256:aaaa", "custom": None},
+    }
+    (tmp_path / images.BUNDLE_MANIFEST_NAME).write_text(json.dumps({"bundles": [bundle]}))
+    loaded = []
+    loaded_images: Set[str] = set()
+
+    def fake_run(args, **kwargs):
+        if args[:2] == ["docker", "load"]:
+            loaded.append(args[-1])
+            return subprocess.CompletedProcess(args, 0)
+        assert args[:3] == ["docker", "image", "inspect"]
+        if args[-1] not in loaded_images:
+            return subprocess.CompletedProcess(args, 1, stdout="")
+        # loaded images don't have repo digests
+        image_id = bundle["images"][args[-1]]
+        stdout = image_id if args[4] == "{{.Id}}" else f"{json.dumps(image_id)} []"
+        return subprocess.CompletedProcess(args, 0, stdout=stdout)
+
+    monkeypatch.setattr("cibuildwheel.images.subprocess.run", fake_run)
+    monkeypatch.setattr(images, "get_loaded_digests_path", lambda: tmp_path / "digests.json")
+
+    images.load_images(tmp_path)
+    loaded_images.update(bundle["images"])
+
+    assert loaded == [str(tmp_path / "images-1.tar")]
+    # the same digest as on a machine that pulled the image
+    assert images.get_image_digest("manylinux2014_x86_64") == "sha256:aaaa"
+    assert images.get_image_digest("custom") is None
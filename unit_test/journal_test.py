@@ -0,0 +1,68 @@
+from cibuildwheel.journal import JOURNAL_NAME, Journal
+
+
+def make_wheel(output_dir, name, content=b"wheel"):
+    path = output_dir / name
+    path.write_bytes(content)
+    return path
+
+
+def test_completed_identifiers(tmp_path):
+    journal = Journal(tmp_path)
+    assert journal.completed_identifiers() == set()
+
+    journal.record("cp38-manylinux_x86_64", [make_wheel(tmp_path, "spam-cp38.whl")])
+    journal.record("cp39-manylinux_x86_64", [make_wheel(tmp_path, "spam-cp39.whl")])
+
+    # a new journal object reads what the previous run wrote
+    assert Journal(tmp_path).completed_identifiers() == {
+        "cp38-manylinux_x86_64",
+        "cp39-manylinux_x86_64",
+    }
+
+
+def test_missing_or_changed_wheels_are_not_complete(tmp_path):
+    journal = Journal(tmp_path)
+    journal.record("cp37-manylinux_x86_64", [make_wheel(tmp_path, "spam-cp37.whl")])
+    journal.record("cp38-manylinux_x86_64", [make_wheel(tmp_path, "spam-cp38.whl")])
+    journal.record("cp39-manylinux_x86_64", [make_wheel(tmp_path, "spam-cp39.whl")])
+
+    (tmp_path / "spam-cp38.whl").unlink()
+    (tmp_path / "spam-cp39.whl").write_bytes(b"truncated")
+
+    assert journal.completed_identifiers() == {"cp37-manylinux_x86_64"}
+
+
+def test_partial_lines_are_ignored(tmp_path):
+    journal = Journal(tmp_path)
+    journal.record("cp39-manylinux_x86_64", [make_wheel(tmp_path, "spam-cp39.whl")])
+
+    # a run that was killed while writing a record
+    with (tmp_path / JOURNAL_NAME).open("a") as f:
+        f.write('{"identifier": "cp310-manylinux_x86_64", "whe')
+
+    assert journal.completed_identifiers() == {"cp39-manylinux_x86_64"}
+
+
+def test_record_after_a_partial_line(tmp_path):
+    journal = Journal(tmp_path)
+    journal.record("cp39-manylinux_x86_64", [make_wheel(tmp_path, "spam-cp39.whl")])
+
+    # a run that was killed while writing a record, then resumed
+    with (tmp_path / JOURNAL_NAME).open("a") as f:
+        f.write('{"identifier": "cp310-manylinux_x86_64", "whe')
+    journal.record("cp310-manylinux_x86_64", [make_wheel(tmp_path, "spam-cp310.whl")])
+
+    assert Journal(tmp_path).completed_identifiers() == {
+        "cp39-manylinux_x86_64",
+        "cp310-manylinux_x86_64",
+    }
+
+
+def test_reset(tmp_path):
+    journal = Journal(tmp_path)
+    journal.record("cp39-manylinux_x86_64", [make_wheel(tmp_path, "spam-cp39.whl")])
+
+    journal.reset()
+
+    assert journal.completed_identifiers() == set()
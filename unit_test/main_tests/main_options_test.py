@@ -1,10 +1,14 @@
+import json
 import sys
+import tempfile
 from fnmatch import fnmatch
 from pathlib import Path
+from typing import Any, Dict, List
 
 import pytest
 
-from cibuildwheel.__main__ import main
+import cibuildwheel.images
+from cibuildwheel.__main__ import get_build_identifiers, main
 from cibuildwheel.environment import ParsedEnvironment
 from cibuildwheel.util import BuildSelector
 
@@ -287,3 +291,256 @@ def test_before_all(before_all, platform_specific, platform, intercepted_build_a
     main()
 
     assert intercepted_build_args.args[0].before_all == (before_all or "")
+
+
+@pytest.mark.parametrize("use_argument", [False, True])
+def test_jobs(use_argument, platform, intercepted_build_args, monkeypatch):
+    if use_argument:
+        monkeypatch.setattr(sys, "argv", sys.argv + ["--jobs", "3"])
+        monkeypatch.setenv("CIBW_PARALLEL", "2")
+    else:
+        monkeypatch.setenv("CIBW_PARALLEL", "2")
+
+    main()
+
+    assert intercepted_build_args.args[0].jobs == (3 if use_argument else 2)
+
+
+@pytest.mark.parametrize("jobs", ["0", "lots"])
+def test_jobs_invalid(jobs, platform, intercepted_build_args, monkeypatch):
+    monkeypatch.setenv("CIBW_PARALLEL", jobs)
+
+    with pytest.raises(SystemExit) as e:
+        main()
+
+    assert e.value.code == 2
+
+
+@pytest.mark.parametrize("use_argument", [False, True])
+def test_container_jobs(use_argument, platform, intercepted_build_args, monkeypatch):
+    monkeypatch.setenv("CIBW_CONTAINER_PARALLEL", "4")
+    if use_argument:
+        monkeypatch.setattr(sys, "argv", sys.argv + ["--container-jobs", "5"])
+
+    main()
+
+    assert intercepted_build_args.args[0].container_jobs == (5 if use_argument else 4)
+    assert intercepted_build_args.args[0].jobs == 1
+
+
+def test_jobs_config_file(platform, intercepted_build_args, monkeypatch):
+    # Path.mkdir is mocked, so tmp_path can't be used
+    with tempfile.TemporaryDirectory() as temp_dir:
+        config_file = Path(temp_dir) / "cibuildwheel.toml"
+        config_file.write_text("[tool.cibuildwheel]\nparallel = 3\ncontainer-parallel = 2\n")
+        monkeypatch.setattr(sys, "argv", sys.argv + ["--config-file", str(config_file)])
+
+        main()
+
+    assert intercepted_build_args.args[0].jobs == 3
+    assert intercepted_build_args.args[0].container_jobs == 2
+
+
+@pytest.mark.parametrize("snapshot", [None, "0", "1"])
+def test_before_all_snapshot(snapshot, platform, intercepted_build_args, monkeypatch):
+    monkeypatch.setenv("CIBW_BEFORE_ALL_INPUTS", "scripts/*.sh ci/deps.txt")
+    if snapshot is not None:
+        monkeypatch.setenv("CIBW_BEFORE_ALL_SNAPSHOT", snapshot)
+
+    main()
+
+    assert intercepted_build_args.args[0].before_all_snapshot == (snapshot == "1")
+    assert intercepted_build_args.args[0].before_all_inputs == ["scripts/*.sh", "ci/deps.txt"]
+
+
+@pytest.mark.parametrize("project_files", [None, "all", "git"])
+def test_project_files(project_files, platform, intercepted_build_args, monkeypatch):
+    if project_files is not None:
+        monkeypatch.setenv("CIBW_PROJECT_FILES", project_files)
+
+    main()
+
+    assert intercepted_build_args.args[0].project_files == (project_files or "all")
+
+
+def test_project_files_invalid(platform, intercepted_build_args, monkeypatch):
+    monkeypatch.setenv("CIBW_PROJECT_FILES", "tracked")
+
+    with pytest.raises(SystemExit) as e:
+        main()
+
+    assert e.value.code == 2
+
+
+@pytest.mark.parametrize("project_transfer", [None, "copy", "mount", "volume"])
+def test_project_transfer(project_transfer, platform, intercepted_build_args, monkeypatch):
+    if project_transfer is not None:
+        monkeypatch.setenv("CIBW_PROJECT_TRANSFER", project_transfer)
+
+    main()
+
+    assert intercepted_build_args.args[0].project_transfer == (project_transfer or "copy")
+
+
+def test_project_transfer_invalid(platform, intercepted_build_args, monkeypatch):
+    monkeypatch.setenv("CIBW_PROJECT_TRANSFER", "rsync")
+
+    with pytest.raises(SystemExit) as e:
+        main()
+
+    assert e.value.code == 2
+
+
+def test_cache_dir(platform, intercepted_build_args, monkeypatch):
+    monkeypatch.setenv("CIBW_CACHE_DIR", "/tmp/cibuildwheel-cache")
+    monkeypatch.setenv("CIBW_CACHE_MAX_SIZE", "2G")
+    monkeypatch.setenv("CIBW_CACHE_URL", "https://cache.example.com/wheels")
+
+    main()
+
+    assert intercepted_build_args.args[0].cache_dir == Path("/tmp/cibuildwheel-cache").resolve()
+    assert intercepted_build_args.args[0].cache_max_size == 2 * 1024 ** 3
+    assert intercepted_build_args.args[0].cache_url == "https://cache.example.com/wheels"
+
+
+def test_cache_dir_config_file(platform, intercepted_build_args, monkeypatch):
+    # Path.mkdir is mocked, so tmp_path can't be used
+    with tempfile.TemporaryDirectory() as temp_dir:
+        config_file = Path(temp_dir) / "cibuildwheel.toml"
+        config_file.write_text(
+            "[tool.cibuildwheel]\n"
+            'cache-dir = "/tmp/cibuildwheel-cache"\n'
+            'cache-max-size = "500M"\n'
+            'cache-url = "https://cache.example.com/wheels"\n'
+        )
+        monkeypatch.setattr(sys, "argv", sys.argv + ["--config-file", str(config_file)])
+
+        main()
+
+    assert intercepted_build_args.args[0].cache_dir == Path("/tmp/cibuildwheel-cache").resolve()
+    assert intercepted_build_args.args[0].cache_max_size == 500 * 1024 ** 2
+    assert intercepted_build_args.args[0].cache_url == "https://cache.example.com/wheels"
+
+
+def test_cache_dir_default(platform, intercepted_build_args):
+    main()
+
+    assert intercepted_build_args.args[0].cache_dir is None
+    assert intercepted_build_args.args[0].cache_max_size is None
+    assert intercepted_build_args.args[0].cache_url is None
+
+
+def test_cache_max_size_invalid(platform, intercepted_build_args, monkeypatch):
+    monkeypatch.setenv("CIBW_CACHE_MAX_SIZE", "lots")
+
+    with pytest.raises(SystemExit) as e:
+        main()
+
+    assert e.value.code == 2
+
+
+@pytest.mark.parametrize("use_env_var", [False, True])
+def test_shard(use_env_var, platform, intercepted_build_args, monkeypatch, fake_package_dir):
+    monkeypatch.setenv("CIBW_BUILD", "cp3*")
+    shards = []
+
+    for shard in ["1/2", "2/2"]:
+        if use_env_var:
+            monkeypatch.setenv("CIBW_SHARD", shard)
+        else:
+            monkeypatch.setattr(sys, "argv", fake_package_dir + ["--shard", shard])
+
+        main()
+
+        build_options = intercepted_build_args.args[0]
+        shards.append(
+            get_build_identifiers(
+                platform, build_options.build_selector, build_options.architectures
+            )
+        )
+
+    assert shards[0] and shards[1]
+    assert not set(shards[0]) & set(shards[1])
+
+
+def test_shard_invalid(platform, intercepted_build_args, monkeypatch):
+    monkeypatch.setattr(sys, "argv", sys.argv + ["--shard", "3/2"])
+
+    with pytest.raises(SystemExit) as e:
+        main()
+
+    assert e.value.code == 2
+
+
+def test_print_build_plan(platform, intercepted_build_args, monkeypatch, fake_package_dir, capsys):
+    monkeypatch.setenv("CIBW_BUILD", "cp39-*")
+    monkeypatch.setenv("CIBW_TEST_COMMAND", "pytest")
+    monkeypatch.setattr(sys, "argv", fake_package_dir + ["--print-build-plan"])
+
+    with pytest.raises(SystemExit) as e:
+        main()
+
+    assert e.value.code == 0
+    assert not hasattr(intercepted_build_args, "args")
+
+    build_plan = json.loads(capsys.readouterr().out)
+    assert build_plan["platform"] == platform
+    assert build_plan["identifiers"]
+    assert all(i["identifier"].startswith("cp39-") for i in build_plan["identifiers"])
+    assert all(i["test"] for i in build_plan["identifiers"])
+
+
+@pytest.mark.parametrize("resume", [False, True])
+def test_resume(resume, platform, intercepted_build_args, monkeypatch, fake_package_dir):
+    if resume:
+        monkeypatch.setattr(sys, "argv", fake_package_dir + ["--resume"])
+
+    main()
+
+    assert intercepted_build_args.args[0].resume == resume
+
+
+def test_images_save(intercepted_build_args, monkeypatch, fake_package_dir):
+    saved: Dict[str, Any] = {}
+    monkeypatch.setattr(
+        cibuildwheel.images,
+        "save_images",
+        lambda docker_images, directory: saved.update(images=docker_images, directory=directory),
+    )
+    monkeypatch.setenv("CIBW_BUILD", "cp39-* pp37-*_x86_64")
+    monkeypatch.setenv("CIBW_MANYLINUX_I686_IMAGE", "custom_i686_image")
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        [
+            "cibuildwheel",
+            "images",
+            "save",
+            "bundle",
+            "--archs",
+            "x86_64,i686",
+            *fake_package_dir[1:],
+        ],
+    )
+
+    with pytest.raises(SystemExit) as e:
+        main()
+
+    assert e.value.code == 0
+    assert not hasattr(intercepted_build_args, "args")
+    assert saved["directory"] == Path("bundle")
+    # the x86_64 image is shared by CPython and PyPy, so it's only saved once
+    assert len(saved["images"]) == 2
+    assert fnmatch(saved["images"][0], "quay.io/pypa/manylinux2010_x86_64:*")
+    assert saved["images"][1] == "custom_i686_image"
+
+
+def test_images_load(intercepted_build_args, monkeypatch):
+    loaded: List[Path] = []
+    monkeypatch.setattr(cibuildwheel.images, "load_images", loaded.append)
+    monkeypatch.setattr(sys, "argv", ["cibuildwheel", "images", "load", "bundle"])
+
+    main()
+
+    assert loaded == [Path("bundle")]
+    assert not hasattr(intercepted_build_args, "args")
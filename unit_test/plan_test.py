@@ -0,0 +1,154 @@
+import platform as platform_module
+
+import pytest
+
+from cibuildwheel import util
+from cibuildwheel.architecture import Architecture
+from cibuildwheel.plan import (
+    estimate_cost,
+    get_build_plan,
+    parse_shard,
+    split_into_shards,
+)
+
+
+def test_parse_shard():
+    assert parse_shard("1/1") == (1, 1)
+    assert parse_shard(" 3 / 4 ") == (3, 4)
+
+    for invalid in ["0/4", "5/4", "2", "a/b", "1/0"]:
+        with pytest.raises(ValueError):
+            parse_shard(invalid)
+
+
+def test_estimate_cost():
+    native = estimate_cost("linux", "cp39-manylinux_x86_64")
+    emulated = estimate_cost("linux", "cp39-manylinux_aarch64")
+
+    assert emulated == 10 * native
+    assert estimate_cost("linux", "cp39-manylinux_i686") == native
+    assert estimate_cost("macos", "cp39-macosx_arm64") == native
+
+    timings = {"cp39-manylinux_aarch64": 42.0}
+    assert estimate_cost("linux", "cp39-manylinux_aarch64", timings) == 42.0
+    assert estimate_cost("linux", "cp39-manylinux_x86_64", timings) == native
+
+
+X86_64 = ["cp36-manylinux_x86_64", "cp37-manylinux_x86_64", "cp38-manylinux_x86_64"]
+AARCH64 = ["cp36-manylinux_aarch64", "cp37-manylinux_aarch64", "cp38-manylinux_aarch64"]
+GROUPS = [X86_64, AARCH64]
+COSTS = {**{i: 1.0 for i in X86_64}, **{i: 10.0 for i in AARCH64}}
+
+
+def test_shards_cover_every_identifier_once():
+    for count in range(1, 8):
+        shards = split_into_shards(GROUPS, COSTS, count)
+
+        assert len(shards) == count
+        assert sorted(i for shard in shards for i in shard) == sorted(X86_64 + AARCH64)
+
+
+def test_shards_are_balanced():
+    shards = split_into_shards(GROUPS, COSTS, 3)
+    loads = sorted(sum(COSTS[i] for i in shard) for shard in shards)
+
+    # the slow emulated builds are spread out, rather than kept in one shard
+    assert loads == [10.0, 10.0, 13.0]
+
+
+def test_shards_keep_groups_together():
+    shards = split_into_shards(GROUPS, {i: 1.0 for i in COSTS}, 2)
+
+    assert shards == [X86_64, AARCH64]
+
+
+def test_shards_are_deterministic():
+    assert split_into_shards(GROUPS, COSTS, 4) == split_into_shards(
+        [list(g) for g in GROUPS], dict(reversed(list(COSTS.items()))), 4
+    )
+
+
+MANYLINUX_IMAGES = {
+    "x86_64": "manylinux2014_x86_64",
+    "i686": "manylinux2014_i686",
+    "aarch64": "manylinux2014_aarch64",
+    "ppc64le": "manylinux2014_ppc64le",
+    "s390x": "manylinux2014_s390x",
+    "pypy_x86_64": "manylinux2014_x86_64",
+    "pypy_i686": "manylinux2014_i686",
+    "pypy_aarch64": "manylinux2014_aarch64",
+}
+
+
+@pytest.mark.parametrize("machine", ["x86_64", "aarch64"])
+def test_shard_costs_dont_depend_on_the_host(machine, monkeypatch):
+    monkeypatch.setattr(platform_module, "machine", lambda: machine)
+
+    assert estimate_cost("linux", "cp39-manylinux_aarch64") == 600.0
+    assert estimate_cost("linux", "cp39-manylinux_x86_64") == 60.0
+
+
+def test_get_build_plan(monkeypatch):
+    monkeypatch.setattr(platform_module, "machine", lambda: "x86_64")
+    build_plan = get_build_plan(
+        "linux",
+        util.BuildSelector(build_config="cp39-* pp37-*", skip_config="*i686"),
+        {Architecture.x86_64, Architecture.aarch64},
+        MANYLINUX_IMAGES,
+        test_selector=util.TestSelector(skip_config="pp*"),
+        timings={"cp39-manylinux_x86_64": 100.0},
+    )
+
+    assert [g["name"] for g in build_plan["groups"]] == [
+        "cp_manylinux_x86_64-pp_manylinux_x86_64",
+        "cp_manylinux_aarch64-pp_manylinux_aarch64",
+    ]
+    assert build_plan["identifiers"][0] == {
+        "identifier": "cp39-manylinux_x86_64",
+        "group": "cp_manylinux_x86_64-pp_manylinux_x86_64",
+        "image": "manylinux2014_x86_64",
+        "emulated": False,
+        "test": True,
+        "estimated_seconds": 100.0,
+    }
+    assert build_plan["identifiers"][1]["identifier"] == "pp37-manylinux_x86_64"
+    assert build_plan["identifiers"][1]["test"] is False
+    assert build_plan["identifiers"][2]["emulated"] is True
+    assert build_plan["estimated_seconds"] == 100.0 + 60.0 + 2 * 600.0
+
+
+def test_get_build_plan_on_aarch64(monkeypatch):
+    monkeypatch.setattr(platform_module, "machine", lambda: "aarch64")
+    build_plan = get_build_plan(
+        "linux",
+        util.BuildSelector(build_config="cp39-*", skip_config="*i686"),
+        {Architecture.x86_64, Architecture.aarch64},
+        MANYLINUX_IMAGES,
+        test_selector=None,
+    )
+
+    emulated = {i["identifier"]: i["emulated"] for i in build_plan["identifiers"]}
+    assert emulated == {"cp39-manylinux_x86_64": True, "cp39-manylinux_aarch64": False}
+    estimates = {i["identifier"]: i["estimated_seconds"] for i in build_plan["identifiers"]}
+    assert estimates == {"cp39-manylinux_x86_64": 600.0, "cp39-manylinux_aarch64": 60.0}
+
+
+def test_get_build_plan_without_tests():
+    build_plan = get_build_plan(
+        "windows",
+        util.BuildSelector(build_config="cp39-*", skip_config=""),
+        {Architecture.AMD64},
+        None,
+        test_selector=None,
+    )
+
+    assert build_plan["identifiers"] == [
+        {
+            "identifier": "cp39-win_amd64",
+            "group": "cp39-win_amd64",
+            "image": None,
+            "emulated": False,
+            "test": False,
+            "estimated_seconds": 60.0,
+        }
+    ]
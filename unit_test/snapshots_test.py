@@ -0,0 +1,48 @@
+from typing import Any, Dict
+
+from cibuildwheel.snapshots import hash_input_files, snapshot_key
+
+KEY_ARGS: Dict[str, Any] = dict(
+    image_id="sha256:1234",
+    simulate_32_bit=False,
+    before_all="yum install -y openssl-devel",
+    environment="ParsedEnvironment([])",
+    inputs_hash="",
+)
+
+
+def test_snapshot_key_is_stable():
+    assert snapshot_key(**KEY_ARGS) == snapshot_key(**KEY_ARGS)
+
+
+def test_snapshot_key_changes_with_inputs():
+    key = snapshot_key(**KEY_ARGS)
+
+    for name, value in [
+        ("image_id", "sha256:5678"),
+        ("simulate_32_bit", True),
+        ("before_all", "yum install -y hdf5-devel"),
+        ("environment", "ParsedEnvironment(['A=1'])"),
+        ("inputs_hash", "abcd"),
+    ]:
+        assert snapshot_key(**{**KEY_ARGS, name: value}) != key
+
+
+def test_hash_input_files(tmp_path):
+    (tmp_path / "scripts").mkdir()
+    (tmp_path / "scripts" / "install_deps.sh").write_text("make install")
+    (tmp_path / "setup.py").write_text("setup()")
+
+    patterns = ["scripts/*.sh"]
+    original_hash = hash_input_files(tmp_path, patterns)
+
+    # files that don't match the patterns don't affect the hash
+    (tmp_path / "setup.py").write_text("setup(name='changed')")
+    assert hash_input_files(tmp_path, patterns) == original_hash
+
+    (tmp_path / "scripts" / "install_deps.sh").write_text("make install PREFIX=/usr")
+    assert hash_input_files(tmp_path, patterns) != original_hash
+
+
+def test_hash_input_files_no_matches(tmp_path):
+    assert hash_input_files(tmp_path, []) == hash_input_files(tmp_path, ["missing/*"])
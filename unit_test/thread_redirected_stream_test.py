@@ -0,0 +1,50 @@
+import io
+import threading
+
+from cibuildwheel.util import ThreadRedirectedStream
+
+
+def test_redirect_only_affects_current_thread():
+    main_output = io.StringIO()
+    thread_output = io.StringIO()
+    stream = ThreadRedirectedStream(main_output)
+
+    def write_in_thread():
+        with stream.redirect(thread_output):
+            stream.write("from thread\n")
+
+    thread = threading.Thread(target=write_in_thread)
+    thread.start()
+    thread.join()
+
+    stream.write("from main\n")
+
+    assert main_output.getvalue() == "from main\n"
+    assert thread_output.getvalue() == "from thread\n"
+
+
+def test_redirect_is_restored():
+    main_output = io.StringIO()
+    redirected_output = io.StringIO()
+    stream = ThreadRedirectedStream(main_output)
+
+    with stream.redirect(redirected_output):
+        stream.write("a")
+
+    stream.write("b")
+
+    assert redirected_output.getvalue() == "a"
+    assert main_output.getvalue() == "b"
+
+
+def test_buffer_writes_go_to_redirect(tmp_path):
+    main_output = io.TextIOWrapper(io.BytesIO(), encoding="utf8")
+    stream = ThreadRedirectedStream(main_output)
+    log_path = tmp_path / "build.log"
+
+    with log_path.open("w", encoding="utf8") as log_file:
+        with stream.redirect(log_file):
+            stream.write("text\n")
+            stream.buffer.write(b"bytes\n")
+
+    assert log_path.read_text(encoding="utf8") == "text\nbytes\n"
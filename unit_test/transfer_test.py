@@ -0,0 +1,325 @@
+import os
+import shutil
+import subprocess
+import sys
+import tarfile
+from pathlib import PurePath
+
+import pytest
+
+from cibuildwheel import transfer
+from cibuildwheel.docker_container import DockerContainer
+
+from .docker_container_test import DEFAULT_IMAGE
+
+
+def make_project(project_dir):
+    (project_dir / "pkg").mkdir()
+    (project_dir / "pkg" / "__init__.py").write_text("spam = 1\n")
+    (project_dir / "pkg" / "data.txt").write_text("eggs\n")
+    (project_dir / "setup.py").write_text("setup()\n")
+
+
+def test_scan(tmp_path):
+    make_project(tmp_path)
+    os.symlink("setup.py", tmp_path / "link.py")
+
+    manifest = transfer.scan(tmp_path)
+
+    assert sorted(manifest) == ["link.py", "pkg", "pkg/__init__.py", "pkg/data.txt", "setup.py"]
+    assert manifest["pkg"].kind == "dir"
+    assert manifest["setup.py"].kind == "file"
+    assert manifest["setup.py"].size == len("setup()\n")
+    assert manifest["link.py"].kind == "link"
+    assert manifest["link.py"].digest == "setup.py"
+    # nothing is hashed without a previous manifest to compare with
+    assert manifest["setup.py"].digest is None
+
+
+def test_diff_unchanged(tmp_path):
+    make_project(tmp_path)
+    manifest = transfer.scan(tmp_path)
+
+    assert transfer.diff(manifest, transfer.scan(tmp_path, manifest)) == ([], [])
+
+
+def test_diff_changes(tmp_path):
+    make_project(tmp_path)
+    old = transfer.scan(tmp_path)
+
+    (tmp_path / "setup.py").write_text("setup(name='spam')\n")
+    (tmp_path / "pkg" / "data.txt").unlink()
+    (tmp_path / "README.md").write_text("# spam\n")
+
+    changed, deleted = transfer.diff(old, transfer.scan(tmp_path, old))
+
+    assert sorted(changed) == ["README.md", "setup.py"]
+    assert deleted == ["pkg/data.txt"]
+
+
+def test_diff_touched_file_with_same_contents(tmp_path):
+    make_project(tmp_path)
+    old = transfer.scan(tmp_path)
+    old["setup.py"] = old["setup.py"]._replace(digest=transfer.hash_file(tmp_path / "setup.py"))
+
+    stat = (tmp_path / "setup.py").stat()
+    os.utime(tmp_path / "setup.py", ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    new = transfer.scan(tmp_path, old)
+
+    # the contents are hashed, because the mtime changed, and they match
+    assert new["setup.py"].digest == old["setup.py"].digest
+    assert transfer.diff(old, new) == ([], [])
+
+
+def test_diff_deleted_dir(tmp_path):
+    make_project(tmp_path)
+    old = transfer.scan(tmp_path)
+
+    for path in (tmp_path / "pkg").iterdir():
+        path.unlink()
+    (tmp_path / "pkg").rmdir()
+    # replaced by a file of the same name
+    (tmp_path / "pkg").write_text("not a package\n")
+
+    changed, deleted = transfer.diff(old, transfer.scan(tmp_path, old))
+
+    assert changed == ["pkg"]
+    # the directory's contents go with it
+    assert deleted == ["pkg"]
+
+
+def test_project_archive(tmp_path):
+    project_dir = tmp_path / "project"
+    project_dir.mkdir()
+    make_project(project_dir)
+
+    with transfer.ProjectArchive(project_dir) as archive:
+        manifest = archive.manifest()
+        assert manifest["setup.py"].digest == transfer.hash_file(project_dir / "setup.py")
+
+        with tarfile.open(archive.path) as tar:
+            assert sorted(tar.getnames()) == sorted(manifest)
+            setup_py = tar.extractfile("setup.py")
+            assert setup_py is not None
+            assert setup_py.read() == b"setup()\n"
+
+        # the archive is only made once, so later changes aren't seen
+        archive_path = archive.path
+        (project_dir / "setup.py").write_text("setup(name='spam')\n")
+        assert archive.manifest() is manifest
+        assert archive.path == archive_path
+
+    assert not archive_path.exists()
+
+
+@pytest.mark.docker
+def test_sync_into(tmp_path):
+    project_dir = tmp_path / "project"
+    project_dir.mkdir()
+    make_project(project_dir)
+    container_path = PurePath("/project")
+
+    with DockerContainer(DEFAULT_IMAGE) as container:
+        with transfer.ProjectArchive(project_dir) as archive:
+            result = transfer.sync_into(container, archive, container_path)
+        assert len(result.sent) == 4
+
+        (project_dir / "setup.py").write_text("setup(name='spam')\n")
+        (project_dir / "pkg" / "data.txt").unlink()
+
+        with transfer.ProjectArchive(project_dir) as archive:
+            result = transfer.sync_into(container, archive, container_path, result.manifest)
+        assert result.sent == ["setup.py"]
+        assert result.deleted == ["pkg/data.txt"]
+
+        assert container.call(["cat", "/project/setup.py"], capture_output=True) == (
+            "setup(name='spam')\n"
+        )
+        assert container.glob(container_path, "pkg/*") == [container_path / "pkg/__init__.py"]
+
+
+@pytest.mark.docker
+def test_project_volume(tmp_path):
+    project_dir = tmp_path / "project"
+    project_dir.mkdir()
+    make_project(project_dir)
+    container_path = PurePath("/project")
+
+    with transfer.ProjectArchive(project_dir) as archive, transfer.ProjectVolume(archive) as volume:
+        mount_arg = volume.mount_arg(DEFAULT_IMAGE)
+
+        for _ in range(2):
+            with DockerContainer(DEFAULT_IMAGE, mounts=[mount_arg]) as container:
+                result = transfer.sync_into(container, archive, container_path, volume=volume)
+                assert len(result.sent) == 4
+                assert container.call(["cat", "/project/setup.py"], capture_output=True) == (
+                    "setup()\n"
+                )
+
+    volumes = subprocess.run(
+        ["docker", "volume", "ls", "--quiet"],
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    ).stdout.split()
+    assert volume.name not in volumes
+
+
+@pytest.mark.parametrize("compression", [None, "gzip", "zstd"])
+def test_container_stream(compression, tmp_path):
+    if compression == "zstd" and shutil.which("zstd") is None:
+        pytest.skip("zstd isn't installed")
+
+    data = os.urandom(100_000) + b"spam" * 100_000
+    output_path = tmp_path / "output"
+
+    # run the command here rather than in a container
+    with transfer.ContainerStream([], f"cat > {output_path}", compression) as stream:
+        for i in range(0, len(data), 4096):
+            stream.write(data[i : i + 4096])
+
+    assert output_path.read_bytes() == data
+
+    stats = stream.stats()
+    assert stats.compression == compression
+    assert stats.data_bytes == len(data)
+    if compression is None:
+        assert stats.sent_bytes == len(data)
+    else:
+        assert stats.sent_bytes < len(data) / 2
+
+
+def test_container_stream_failure():
+    with pytest.raises(subprocess.CalledProcessError):
+        with transfer.ContainerStream([], "exit 3", "gzip") as stream:
+            for _ in range(100):
+                stream.write(os.urandom(100_000))
+
+
+def test_choose_compression(monkeypatch):
+    endpoint = "unix:///var/run/docker.sock"
+    monkeypatch.setattr("cibuildwheel.docker_container.get_docker_endpoint", lambda: endpoint)
+    assert transfer.choose_compression(["docker", "exec", "spam"]) is None
+
+    endpoint = "tcp://build-server:2376"
+    monkeypatch.setattr(shutil, "which", lambda name: None)
+    assert transfer.choose_compression(["docker", "exec", "spam"]) == "gzip"
+
+
+@pytest.mark.parametrize(
+    "platform, endpoint, can_mount",
+    [
+        ("linux", "unix:///var/run/docker.sock", True),
+        ("linux", "unix:///run/user/1000/docker.sock", True),
+        ("linux", "tcp://build-server:2376", False),
+        ("linux", "ssh://ci@build-server", False),
+        ("darwin", "unix:///var/run/docker.sock", False),
+        ("win32", "npipe:////./pipe/docker_engine", False),
+    ],
+)
+def test_can_mount_project(platform, endpoint, can_mount, monkeypatch):
+    monkeypatch.setattr(sys, "platform", platform)
+    monkeypatch.setattr("cibuildwheel.docker_container.get_docker_endpoint", lambda: endpoint)
+
+    assert transfer.can_mount_project() == can_mount
+
+
+@pytest.mark.docker
+def test_project_mount(tmp_path):
+    project_dir = tmp_path / "project"
+    project_dir.mkdir()
+    make_project(project_dir)
+    container_path = PurePath("/project")
+
+    with transfer.ProjectMount(project_dir, DEFAULT_IMAGE) as project_mount, DockerContainer(
+        DEFAULT_IMAGE, mounts=[project_mount.mount_arg(container_path)]
+    ) as container:
+        assert container.call(["cat", "/project/setup.py"], capture_output=True) == "setup()\n"
+
+        container.call(["mkdir", "/project/build"])
+        container.call(["sh", "-c", "echo changed > /project/setup.py"])
+        assert container.call(["cat", "/project/setup.py"], capture_output=True) == "changed\n"
+
+    # the writes went to the overlay, not the project
+    assert (project_dir / "setup.py").read_text() == "setup()\n"
+    assert not (project_dir / "build").exists()
+
+
+@pytest.mark.parametrize(
+    "pattern, path, is_dir, matches",
+    [
+        ("*.so", "spam.so", False, True),
+        ("*.so", "src/spam.so", False, True),
+        ("/*.so", "src/spam.so", False, False),
+        ("src/*.so", "src/spam.so", False, True),
+        ("src/*.so", "src/ext/spam.so", False, False),
+        ("src/**/*.so", "src/ext/spam.so", False, True),
+        ("src/**/*.so", "src/spam.so", False, True),
+        ("docs/", "docs", True, True),
+        ("docs/", "docs", False, False),
+        ("spam.py[co]", "spam.pyc", False, True),
+        ("spam.py[!co]", "spam.pyc", False, False),
+        ("spam?.txt", "spam1.txt", False, True),
+        ("spam?.txt", "spam/.txt", False, False),
+    ],
+)
+def test_ignore_patterns(pattern, path, is_dir, matches):
+    ignore_pattern = transfer.parse_ignore_pattern(pattern)
+    assert ignore_pattern is not None
+    matched = bool(ignore_pattern.regex.match(path)) and (is_dir or not ignore_pattern.dir_only)
+    assert matched == matches
+
+
+def test_project_filter(tmp_path):
+    make_project(tmp_path)
+    (tmp_path / "pkg" / "__pycache__").mkdir()
+    (tmp_path / "pkg" / "__pycache__" / "__init__.cpython-39.pyc").write_bytes(b"\0")
+    (tmp_path / "build" / "lib").mkdir(parents=True)
+    (tmp_path / "wheelhouse").mkdir()
+    (tmp_path / "venv").mkdir()
+    (tmp_path / "venv" / "pyvenv.cfg").write_text("home = /usr/bin\n")
+    (tmp_path / "docs").mkdir()
+    (tmp_path / "docs" / "index.md").write_text("# spam\n")
+    (tmp_path / "docs" / "keep.md").write_text("# eggs\n")
+    (tmp_path / ".cibwignore").write_text("# not needed for the build\ndocs/*\n!docs/keep.md\n")
+
+    project_filter = transfer.ProjectFilter(tmp_path, exclude_dirs=[tmp_path / "wheelhouse"])
+
+    assert sorted(transfer.scan(tmp_path, project_filter=project_filter)) == [
+        ".cibwignore",
+        "docs",
+        "docs/keep.md",
+        "pkg",
+        "pkg/__init__.py",
+        "pkg/data.txt",
+        "setup.py",
+    ]
+
+
+def test_project_filter_git(tmp_path):
+    make_project(tmp_path)
+    (tmp_path / ".gitignore").write_text("*.log\n")
+    (tmp_path / "build.log").write_text("log\n")
+
+    subprocess.run(["git", "init", "-q"], cwd=tmp_path, check=True)
+    subprocess.run(["git", "add", "setup.py", "pkg/__init__.py"], cwd=tmp_path, check=True)
+
+    project_filter = transfer.ProjectFilter(tmp_path, "git")
+    manifest = transfer.scan(tmp_path, project_filter=project_filter)
+
+    # tracked and untracked files are included, ignored files aren't, and the
+    # .git dir comes along
+    assert "build.log" not in manifest
+    assert {".gitignore", "setup.py", "pkg/__init__.py", "pkg/data.txt"} <= set(manifest)
+    assert ".git/HEAD" in manifest
+
+
+def test_project_filter_git_not_a_repo(tmp_path):
+    make_project(tmp_path)
+    (tmp_path / ".git").write_text("gitdir: /nonexistent\n")
+
+    project_filter = transfer.ProjectFilter(tmp_path, "git")
+
+    assert project_filter.git_files is None
+    assert "pkg/data.txt" in transfer.scan(tmp_path, project_filter=project_filter)
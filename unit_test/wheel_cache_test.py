@@ -0,0 +1,229 @@
+import http.server
+import os
+import subprocess
+import threading
+from typing import Dict
+
+import pytest
+
+from cibuildwheel.cache import (
+    RemoteCache,
+    WheelCache,
+    cache_key,
+    fingerprint_manifest,
+    get_git_state,
+    parse_size,
+)
+from cibuildwheel.transfer import ProjectArchive, ProjectFilter
+
+
+def make_wheel(path, size=10):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"x" * size)
+    return path
+
+
+def test_parse_size():
+    assert parse_size("100") == 100
+    assert parse_size("1k") == 1024
+    assert parse_size("500M") == 500 * 1024 ** 2
+    assert parse_size("10GB") == 10 * 1024 ** 3
+
+    with pytest.raises(ValueError):
+        parse_size("ten")
+
+
+def test_cache_key_changes_with_inputs():
+    key = cache_key(project="abc", identifier="cp39-manylinux_x86_64")
+
+    assert key == cache_key(identifier="cp39-manylinux_x86_64", project="abc")
+    assert key != cache_key(project="abd", identifier="cp39-manylinux_x86_64")
+    assert key != cache_key(project="abc", identifier="cp38-manylinux_x86_64")
+
+
+def git(cwd, *args):
+    subprocess.run(
+        ["git", "-c", "user.name=spam", "-c", "user.email=spam@example.com", *args],
+        cwd=cwd,
+        stdout=subprocess.DEVNULL,
+        check=True,
+    )
+
+
+def fingerprint(project):
+    project_filter = ProjectFilter(project, exclude_dirs=[project / "wheelhouse"])
+    with ProjectArchive(project, project_filter) as archive:
+        return fingerprint_manifest(archive.manifest(), get_git_state(project))
+
+
+@pytest.fixture
+def git_project(tmp_path):
+    project = tmp_path / "project"
+    (project / "src").mkdir(parents=True)
+    (project / "src" / "spam.c").write_text("int main() {}")
+    (project / "setup.py").write_text("setup()")
+    git(project, "init", "-q")
+    git(project, "add", ".")
+    git(project, "commit", "-q", "-m", "Initial commit")
+    return project
+
+
+def test_fingerprint_manifest(git_project):
+    original = fingerprint(git_project)
+
+    # excluded dirs, and files that aren't copied into containers, don't count
+    make_wheel(git_project / "wheelhouse" / "spam.whl")
+    (git_project / "src" / "__pycache__").mkdir()
+    (git_project / "src" / "__pycache__" / "spam.pyc").write_bytes(b"\0")
+    assert fingerprint(git_project) == original
+
+    # setuptools_scm reads the version from git, so a new tag changes the
+    # fingerprint
+    git(git_project, "tag", "v1.0")
+    tagged = fingerprint(git_project)
+    assert tagged != original
+
+    (git_project / "src" / "spam.c").write_text("int main() { return 1; }")
+    assert fingerprint(git_project) != tagged
+
+
+def test_fingerprint_manifest_of_clones(git_project, tmp_path):
+    git(git_project, "tag", "v1.0")
+    git(tmp_path, "clone", "-q", str(git_project), "first")
+    git(tmp_path, "clone", "-q", str(git_project), "second")
+    # refreshes the index of one of them
+    git(tmp_path / "second", "status")
+
+    # .git/index, .git/logs and the like differ, but the checkout is the same
+    assert (tmp_path / "first" / ".git" / "index").read_bytes() != (
+        tmp_path / "second" / ".git" / "index"
+    ).read_bytes()
+    assert fingerprint(tmp_path / "first") == fingerprint(tmp_path / "second")
+
+
+def test_get_and_put(tmp_path):
+    cache = WheelCache(tmp_path / "cache")
+    wheel = make_wheel(tmp_path / "build" / "spam-0.1-cp39-cp39-manylinux_x86_64.whl")
+
+    assert cache.get("a" * 64, "cp39-manylinux_x86_64") is None
+
+    cache.put("a" * 64, "cp39-manylinux_x86_64", [wheel])
+    cached_wheels = cache.get("a" * 64, "cp39-manylinux_x86_64")
+
+    assert cached_wheels is not None
+    assert [w.name for w in cached_wheels] == [wheel.name]
+    assert cache.summary()["hits"] == ["cp39-manylinux_x86_64"]
+    assert cache.summary()["misses"] == ["cp39-manylinux_x86_64"]
+
+    output_dir = tmp_path / "wheelhouse"
+    output_dir.mkdir()
+    cache.copy_to(cached_wheels, output_dir)
+    assert os.listdir(output_dir) == [wheel.name]
+
+
+def test_evict_least_recently_used(tmp_path):
+    cache = WheelCache(tmp_path / "cache")
+
+    for i, key in enumerate(["a" * 64, "b" * 64, "c" * 64]):
+        wheel = make_wheel(tmp_path / key[0] / f"{key[0]}.whl")
+        cache.put(key, key[0], [wheel])
+        os.utime(cache.entry_path(key), (1000 + i, 1000 + i))
+
+    # using an entry makes it the most recently used
+    cache.get("a" * 64, "a")
+
+    # room for two of the three entries
+    entry_size = max(e.size for e in cache.entries())
+    cache.max_size = entry_size * 2
+
+    removed = cache.evict()
+
+    assert removed == [cache.entry_path("b" * 64)]
+    assert cache.get("a" * 64, "a") is not None
+    assert cache.get("c" * 64, "c") is not None
+
+
+class CacheServer(http.server.HTTPServer):
+    """
+    An HTTP server that stores the entries PUT to it in memory, by path.
+    """
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), CacheRequestHandler)
+        self.entries: Dict[str, bytes] = {}
+
+
+class CacheRequestHandler(http.server.BaseHTTPRequestHandler):
+    server: CacheServer
+
+    def do_GET(self):
+        data = self.server.entries.get(self.path)
+        if data is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_PUT(self):
+        length = int(self.headers["Content-Length"])
+        self.server.entries[self.path] = self.rfile.read(length)
+        self.send_response(201)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def cache_server():
+    server = CacheServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_remote_cache_shares_wheels(tmp_path, cache_server):
+    url = f"http://127.0.0.1:{cache_server.server_port}/cache"
+    key = "a" * 64
+    wheel = make_wheel(tmp_path / "build" / "spam-0.1-cp39-cp39-manylinux_x86_64.whl")
+
+    # one machine builds the wheel...
+    first_cache = WheelCache(tmp_path / "cache1", remote=RemoteCache(url))
+    first_cache.put(key, "cp39-manylinux_x86_64", [wheel])
+    first_cache.close()
+
+    assert first_cache.summary()["uploads"] == ["cp39-manylinux_x86_64"]
+    assert f"/cache/{key}.tar" in cache_server.entries
+
+    # ...and another one reuses it
+    second_cache = WheelCache(tmp_path / "cache2", remote=RemoteCache(url))
+    second_cache.fetch({key: "cp39-manylinux_x86_64", "b" * 64: "cp38-manylinux_x86_64"})
+    cached_wheels = second_cache.get(key, "cp39-manylinux_x86_64")
+    second_cache.close()
+
+    assert cached_wheels is not None
+    assert [w.read_bytes() for w in cached_wheels] == [wheel.read_bytes()]
+    assert second_cache.summary()["remote_hits"] == ["cp39-manylinux_x86_64"]
+    assert second_cache.get("b" * 64, "cp38-manylinux_x86_64") is None
+
+
+def test_remote_cache_unreachable(tmp_path, capsys):
+    # nothing listens on port 9 (discard) on localhost
+    cache = WheelCache(tmp_path / "cache", remote=RemoteCache("http://127.0.0.1:9", timeout=5))
+    wheel = make_wheel(tmp_path / "build" / "spam.whl")
+
+    cache.fetch({"a" * 64: "cp39-manylinux_x86_64"})
+    assert cache.get("a" * 64, "cp39-manylinux_x86_64") is None
+    assert cache.remote is None
+
+    # the local cache still works
+    cache.put("a" * 64, "cp39-manylinux_x86_64", [wheel])
+    cache.close()
+    assert cache.get("a" * 64, "cp39-manylinux_x86_64") is not None
+
+    assert "won't be used for the rest of this run" in capsys.readouterr().err